@@ -0,0 +1,229 @@
+"""
+批量分离 / Batch Separation
+
+此脚本在命令行中批量处理音频，不导入 gradio，适合在服务器上处理大量文件。
+This script separates many files from the command line without importing gradio, for batch nodes.
+
+功能 / Features:
+1. 输入可以是目录、清单文件(每行一个路径)或音频文件 / Inputs can be directories, manifest files or audio files
+2. 单模型分离或多模型合成 / Single-model separation or multi-model ensemble
+3. 多个文件同时处理，每个工作进程保持模型常驻 / Several files at once, each worker keeps its models loaded
+4. 任务状态保存在状态文件中，中断后重新运行即可继续 / Job state is persisted, rerun to resume after a crash
+5. 多模型合成默认按模型顺序调度，每个模型只加载一次 / Ensembles run model-major, loading each model once per batch
+6. 长音频可按重叠窗口分块分离，内存占用取决于窗口长度 / Long files can be separated in overlapping chunks with bounded memory
+7. 可跳过静音区域，不把静音交给模型 / Silent regions can be skipped instead of going through the model
+
+使用方法 / Usage:
+    python batch_separate.py songs/ --models "MelBand Roformer | INSTV7 by Gabox"
+    python batch_separate.py list.txt --models "A" "B" "C" --method avg_wave --jobs 2
+"""
+from utils import startup  # 启动耗时报告，需在其他模块之前导入
+
+startup.enable_if_requested()
+
+import os
+import sys
+import logging
+import argparse
+
+from utils import pipeline
+from utils.budget import plan_ensemble
+from utils.chunked import check_output_format
+from utils.batch import DEFAULT_GROUP_SIZE, DEFAULT_SCRATCH_BYTES, JobState, collect_inputs, run_batch, run_model_major
+from utils.settings import load_settings
+from utils.backends import BACKENDS
+from utils.workers import format_worker_memory
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ENSEMBLE_METHODS = [
+    "avg_wave", "median_wave", "min_wave", "max_wave",
+    "avg_fft", "median_fft", "min_fft", "max_fft",
+]
+OUTPUT_FORMATS = ["wav", "flac", "mp3", "ogg", "opus", "m4a", "aiff", "ac3"]
+
+
+def parse_args():
+    # 默认值取自界面保存的用户设置
+    settings = load_settings()
+    single = settings["single_model"]
+    ensemble = settings["ensemble"]
+    output = settings["output"]
+
+    parser = argparse.ArgumentParser(description="Headless batch separation")
+    parser.add_argument("inputs", nargs="+", help="音频文件、目录或清单文件(每行一个路径)")
+    parser.add_argument("--recursive", action="store_true", help="递归查找目录中的音频")
+    parser.add_argument("--models", nargs="+", help="模型名称，多个模型时进行合成")
+    parser.add_argument("--method", choices=ENSEMBLE_METHODS, default=ensemble["method"], help="合成方法")
+    parser.add_argument("--only-instrumental", action="store_true", default=ensemble["only_instrumental"],
+                        help="合成时只输出伴奏")
+    parser.add_argument("--output-dir", default=output["output_dir"], help="输出目录")
+    parser.add_argument("--model-dir", default=output["model_dir"], help="模型文件目录")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=output["format"], help="输出格式")
+    parser.add_argument("--seg-size", type=int, help="分段大小")
+    parser.add_argument("--override-seg-size", action="store_true", help="覆盖模型默认分段大小(单模型)")
+    parser.add_argument("--overlap", type=int, help="重叠")
+    parser.add_argument("--pitch-shift", type=int, default=single["advanced"]["pitch_shift"], help="音高偏移(单模型)")
+    parser.add_argument("--single-stem", default="", help="仅输出单个音轨(单模型)")
+    parser.add_argument("--use-tta", action="store_true", default=ensemble["advanced"]["use_tta"],
+                        help="测试时增强(合成)")
+    parser.add_argument("--norm-thresh", type=float, help="归一化阈值")
+    parser.add_argument("--amp-thresh", type=float, help="放大阈值")
+    parser.add_argument("--batch-size", type=int, help="批处理大小")
+    parser.add_argument("--jobs", type=int, default=1, help="同时处理的文件数(工作进程数)")
+    parser.add_argument("--torch-threads", type=int, default=0, help="每个工作进程的torch线程数，0 表示自动分配")
+    parser.add_argument("--schedule", choices=["model", "song"], default="model",
+                        help="合成时的调度顺序: model 每组文件每个模型只加载一次，song 逐个文件处理")
+    parser.add_argument("--group-size", type=int, default=DEFAULT_GROUP_SIZE,
+                        help="按模型调度时每组最多的文件数，0 表示只按暂存空间分组")
+    parser.add_argument("--scratch-gb", type=float, default=DEFAULT_SCRATCH_BYTES / 1024**3,
+                        help="按模型调度时一组文件的中间音轨可占用的磁盘空间(GB)")
+    parser.add_argument("--chunk-seconds", type=float, default=single["advanced"]["chunk_seconds"],
+                        help="单模型分块分离的窗口长度(秒)，0 表示整段分离")
+    parser.add_argument("--chunk-overlap", type=float, default=single["advanced"]["chunk_overlap"],
+                        help="相邻窗口的重叠(秒)")
+    parser.add_argument("--chunk-workers", type=int, default=1,
+                        help="并行分离窗口的进程数(仅在 --jobs 1 时可用)")
+    parser.add_argument("--skip-silence", action="store_true", default=single["advanced"]["skip_silence"],
+                        help="单模型分离时跳过静音区域")
+    parser.add_argument("--silence-threshold", type=float, default=single["advanced"]["silence_threshold"],
+                        help="静音门限(dBFS)")
+    parser.add_argument("--budget-models", type=int, default=ensemble["advanced"]["budget_models"],
+                        help="合成时最多运行的模型数，按评测分数挑选，0 表示全部运行")
+    parser.add_argument("--backend", choices=BACKENDS, help="推理后端，onnx 用 ONNX Runtime、int8 用动态 int8 量化在 CPU 上运行 Roformer 模型")
+    parser.add_argument("--state", help="任务状态文件，默认为输出目录下的 batch_state.json")
+    parser.add_argument("--retry-failed", action="store_true", help="重新处理之前失败的文件")
+    parser.add_argument(startup.FLAG, action="store_true", help="结束时输出启动各阶段和最慢模块导入的耗时")
+    args = parser.parse_args()
+
+    if not args.models:
+        args.models = ensemble["models"] if len(ensemble["models"]) > 1 else [single["model"]]
+    # 未指定的参数使用对应模式的设置
+    advanced = (single if len(args.models) == 1 else ensemble)["advanced"]
+    for name in ("seg_size", "overlap", "norm_thresh", "amp_thresh", "batch_size", "backend"):
+        if getattr(args, name) is None:
+            key = {"norm_thresh": "norm_threshold", "amp_thresh": "amp_threshold"}.get(name, name)
+            setattr(args, name, advanced[key])
+    if args.chunk_workers > 1 and args.jobs > 1:
+        parser.error("--chunk-workers requires --jobs 1")
+    return args
+
+
+def main():
+    args = parse_args()
+    startup.mark("arguments parsed")
+    if startup.requested():
+        # 无论成功失败都在退出前输出报告
+        startup.print_report_at_exit()
+    models = pipeline.load_models(config_path="models_info/models.json")
+    for model_key in args.models:
+        if pipeline.find_model(models, model_key) is None:
+            raise SystemExit(f"Model '{model_key}' not found in models_info/models.json")
+    missing = models.missing(args.models, args.model_dir)
+    if missing:
+        print(
+            f"Not in {args.model_dir} yet, will be downloaded on first use: {', '.join(missing)} "
+            f"(python model_downloader_cn.py --models ... fetches them in advance)"
+        )
+    mode = "single" if len(args.models) == 1 else "ensemble"
+    if mode == "single" and (args.chunk_seconds or args.skip_silence):
+        # 分块和跳过静音的结果由本程序拼接写出，在处理任何文件之前确认能写出该格式
+        try:
+            check_output_format(args.format)
+        except ValueError as e:
+            raise SystemExit(str(e))
+    if mode == "ensemble" and args.budget_models:
+        # 所有文件使用同一组模型，按模型调度时仍然每个模型只加载一次
+        selected, plan = plan_ensemble(
+            [(model_key, pipeline.find_model(models, model_key)) for model_key in args.models],
+            None, args.only_instrumental, max_models=args.budget_models,
+        )
+        if plan is not None:
+            args.models = [model_key for model_key, _ in selected]
+            print(
+                f"Budget: running {len(args.models)} models, "
+                f"{plan['passes_saved']} inference passes saved per file "
+                f"(pruned: {', '.join(plan['pruned_models']) or '-'}; "
+                f"no scores: {', '.join(plan['unscored_models']) or '-'})"
+            )
+            if not plan["scores_available"]:
+                print("Budget: no benchmark scores for the selected models, kept the first ones in the given order")
+
+    spec = {
+        "mode": mode,
+        "model_keys": args.models,
+        "method": args.method,
+        "only_instrumental": args.only_instrumental,
+        "model_dir": args.model_dir,
+        "output_dir": args.output_dir,
+        "output_format": args.format,
+        "seg_size": args.seg_size,
+        "override_seg_size": args.override_seg_size,
+        "overlap": args.overlap,
+        "pitch_shift": args.pitch_shift,
+        "single_stem": args.single_stem,
+        "use_tta": args.use_tta,
+        "norm_thresh": args.norm_thresh,
+        "amp_thresh": args.amp_thresh,
+        "batch_size": args.batch_size,
+        "chunk_seconds": args.chunk_seconds,
+        "chunk_overlap": args.chunk_overlap,
+        "chunk_workers": args.chunk_workers,
+        "skip_silence": args.skip_silence,
+        "silence_threshold": args.silence_threshold,
+        "backend": args.backend,
+    }
+
+    inputs = collect_inputs(args.inputs, recursive=args.recursive)
+    state = JobState(args.state or os.path.join(args.output_dir, "batch_state.json"), config=spec)
+    todo = state.pending(inputs, retry_failed=args.retry_failed)
+    startup.mark("inputs collected")
+    print(f"{len(inputs)} inputs, {len(inputs) - len(todo)} already finished, {len(todo)} to process")
+    if not todo:
+        return 0
+
+    progress = {"count": 0}
+
+    def on_result(audio, job):
+        progress["count"] += 1
+        status = job["status"]
+        detail = f"{job['wall_time']:.1f}s" if status == "done" else job["error"]
+        print(f"[{progress['count']}/{len(todo)}] {status:6s} {os.path.basename(audio)}  {detail}")
+
+    try:
+        if spec["mode"] == "ensemble" and args.schedule == "model":
+            summary = run_model_major(
+                todo, spec, models, state, jobs=args.jobs, torch_threads=args.torch_threads,
+                on_result=on_result, group_size=args.group_size, scratch_bytes=int(args.scratch_gb * 1024**3),
+            )
+        else:
+            summary = run_batch(
+                todo, spec, models, state, jobs=args.jobs, torch_threads=args.torch_threads, on_result=on_result
+            )
+    except KeyboardInterrupt:
+        print(f"Interrupted, progress saved to {state.path}")
+        return 130
+
+    print(
+        f"Done: {summary['done']} succeeded, {summary['failed']} failed in {summary['wall_time']:.1f}s"
+    )
+    if summary["done"]:
+        print(
+            f"Throughput: {summary['audio_duration']:.0f}s of audio, "
+            f"{summary['throughput']:.2f}x realtime, "
+            f"{summary['done'] / summary['wall_time'] * 3600:.1f} files/hour"
+        )
+    if "model_loads" in summary:
+        print(
+            f"Model loads: {summary['model_loads']} in {summary['groups']} groups "
+            f"({summary['loads_avoided']} avoided by model-major scheduling)"
+        )
+    if summary.get("worker_memory"):
+        print("Worker memory (model weights are shared between workers):")
+        print(format_worker_memory(summary["worker_memory"]))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
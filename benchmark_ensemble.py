@@ -0,0 +1,252 @@
+"""
+合成算法基准测试 / Ensemble Benchmark
+
+此脚本用合成的立体声音轨测试 utils/ensemble.py 中各合成算法的性能，
+结果保存为 JSON，可与之前的结果对比，超出允许的变慢比例时以非零状态退出。
+This script benchmarks the ensemble algorithms in utils/ensemble.py on synthetic stereo stems.
+Results are saved as JSON and can be compared against a baseline; the run fails when any case
+slows down beyond the threshold.
+
+测试维度 / Sweep:
+1. 音轨长度(秒) / Track length in seconds
+2. 模型数量 / Number of models
+3. 合成算法(--type 的全部八种) / All eight --type algorithms
+4. 合成引擎: batch(average_waveforms) 或 stream(ensemble_stream) / Engine
+
+记录 / Reports:
+- wall_time: 最快一次的耗时(秒) / Best wall time
+- cpu_time: 对应的CPU时间 / CPU time of that run
+- throughput: 每秒处理的音频秒数 / Seconds of audio per second
+- peak_rss: 进程峰值内存(字节) / Peak RSS of the process
+
+使用方法 / Usage:
+    python benchmark_ensemble.py --quick --output bench.json
+    python benchmark_ensemble.py --output new.json --baseline bench.json --threshold 0.2
+    python benchmark_ensemble.py --compare bench.json new.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+ALGORITHMS = [
+    "avg_wave", "median_wave", "min_wave", "max_wave",
+    "avg_fft", "median_fft", "min_fft", "max_fft",
+]
+ENGINES = ["batch", "stream"]
+SAMPLE_RATE = 44100
+
+# 默认测试范围(30 秒到 60 分钟，2 到 8 个模型)
+DEFAULT_LENGTHS = [30, 120, 600, 1800, 3600]
+DEFAULT_MODELS = [2, 4, 8]
+QUICK_LENGTHS = [30, 120]
+QUICK_MODELS = [2, 4]
+
+
+def make_stems(num_models, seconds, seed=0):
+    """生成 (models, 2, length) 的合成立体声音轨: 共同的乐音加上每个模型各自的噪声"""
+    rng = np.random.default_rng(seed)
+    length = int(seconds * SAMPLE_RATE)
+    t = np.arange(length, dtype=np.float32) / SAMPLE_RATE
+    base = 0.3 * np.sin(2 * np.pi * 220.0 * t) + 0.2 * np.sin(2 * np.pi * 331.0 * t)
+    stems = np.empty((num_models, 2, length), dtype=np.float32)
+    for m in range(num_models):
+        for c in range(2):
+            stems[m, c] = base + 0.05 * rng.standard_normal(length, dtype=np.float32)
+    return stems
+
+
+def peak_rss():
+    """当前进程的峰值内存(字节)，无法获取时返回 None"""
+    try:
+        import resource
+
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 单位为字节，Linux 为 KB
+        return usage if sys.platform == "darwin" else usage * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    except ImportError:
+        return None
+
+
+def run_case(case):
+    """
+    在独立进程中运行一个测试用例，保证峰值内存互不影响
+
+    参数:
+        case: 包含 engine、algorithm、seconds、models、repeat、fft_backend 的字典
+
+    返回:
+        测试结果字典
+    """
+    from utils import ensemble, spectral
+
+    if case.get("fft_backend"):
+        spectral.configure(backend=case["fft_backend"])
+    stems = make_stems(case["models"], case["seconds"])
+    weights = np.ones(case["models"])
+    rss_before = peak_rss()
+
+    wall_times = []
+    cpu_times = []
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "out.wav")
+        for _ in range(case["repeat"]):
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            if case["engine"] == "stream":
+                ensemble.ensemble_stream(
+                    list(stems), output, case["algorithm"], weights, sr=SAMPLE_RATE
+                )
+            else:
+                ensemble.average_waveforms(stems, weights, case["algorithm"])
+            wall_times.append(time.perf_counter() - wall_start)
+            cpu_times.append(time.process_time() - cpu_start)
+
+    best = int(np.argmin(wall_times))
+    rss = peak_rss()
+    return dict(
+        case,
+        wall_time=wall_times[best],
+        cpu_time=cpu_times[best],
+        throughput=case["seconds"] / wall_times[best] if wall_times[best] > 0 else None,
+        peak_rss=rss,
+        peak_rss_delta=rss - rss_before if rss is not None and rss_before is not None else None,
+    )
+
+
+def case_key(result):
+    return (result["engine"], result["algorithm"], result["seconds"], result["models"])
+
+
+def input_bytes(seconds, models):
+    return int(seconds * SAMPLE_RATE) * 2 * models * 4
+
+
+def run_benchmark(args):
+    """按参数组合依次运行所有用例"""
+    cases = []
+    for engine in args.engines:
+        for seconds in args.lengths:
+            for models in args.models:
+                for algorithm in args.algorithms:
+                    cases.append(dict(
+                        engine=engine,
+                        algorithm=algorithm,
+                        seconds=seconds,
+                        models=models,
+                        repeat=args.repeat,
+                        fft_backend=args.fft_backend,
+                    ))
+
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for i, case in enumerate(cases, 1):
+        label = f"[{i}/{len(cases)}] {case['engine']:6s} {case['algorithm']:11s} {case['seconds']:>5}s x {case['models']}"
+        if args.max_input_mb and input_bytes(case["seconds"], case["models"]) > args.max_input_mb * 1024**2:
+            print(f"{label}  skipped (input exceeds {args.max_input_mb} MB)")
+            results.append(dict(case, skipped=True))
+            continue
+        # 每个用例使用新进程，峰值内存只反映该用例
+        with ctx.Pool(1) as pool:
+            result = pool.apply(run_case, (case,))
+        rss = f"{result['peak_rss'] / 1024**2:8.0f} MB" if result["peak_rss"] else "       n/a"
+        print(f"{label}  {result['wall_time']:8.3f}s  {result['throughput']:9.1f}x realtime  {rss}")
+        results.append(result)
+
+    from utils import spectral
+
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+            "fft_backend": args.fft_backend or spectral.get_backend()[0],
+            "sample_rate": SAMPLE_RATE,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    对比两次结果
+
+    返回:
+        变慢超过阈值的用例列表 [(key, 基准耗时, 当前耗时, 变化比例)]
+    """
+    base = {case_key(r): r for r in baseline["results"] if not r.get("skipped")}
+    regressions = []
+    print(f"{'engine':6s} {'algorithm':11s} {'length':>6s} {'models':>6s} {'base':>9s} {'current':>9s} {'change':>8s}")
+    for result in current["results"]:
+        if result.get("skipped") or case_key(result) not in base:
+            continue
+        old = base[case_key(result)]["wall_time"]
+        new = result["wall_time"]
+        change = new / old - 1 if old > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append((case_key(result), old, new, change))
+            flag = "  SLOWER"
+        engine, algorithm, seconds, models = case_key(result)
+        print(f"{engine:6s} {algorithm:11s} {seconds:>5}s {models:>6} {old:8.3f}s {new:8.3f}s {change:+7.1%}{flag}")
+    return regressions
+
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ensemble algorithms on synthetic stems")
+    parser.add_argument("--lengths", type=float, nargs="+", help="音轨长度(秒)")
+    parser.add_argument("--models", type=int, nargs="+", help="模型数量")
+    parser.add_argument("--algorithms", nargs="+", choices=ALGORITHMS, default=ALGORITHMS, help="合成算法")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=["batch"], help="合成引擎")
+    parser.add_argument("--fft-backend", help="fft类算法使用的STFT后端(numpy/scipy/torch)")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例重复次数，取最快一次")
+    parser.add_argument("--quick", action="store_true", help="只运行较短的音轨和较少的模型")
+    parser.add_argument("--max-input-mb", type=int, default=4096, help="跳过输入音轨超过该大小(MB)的用例，0 表示不限制")
+    parser.add_argument("--output", help="保存结果的JSON文件")
+    parser.add_argument("--baseline", help="用于对比的基准结果JSON文件")
+    parser.add_argument("--threshold", type=float, default=0.2, help="允许的变慢比例，超过时退出码为 1")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="只对比两个已有结果文件")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(load_results(args.compare[0]), load_results(args.compare[1]), args.threshold)
+    else:
+        args.lengths = args.lengths or (QUICK_LENGTHS if args.quick else DEFAULT_LENGTHS)
+        args.models = args.models or (QUICK_MODELS if args.quick else DEFAULT_MODELS)
+        current = run_benchmark(args)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(current, f, indent=2)
+            print(f"Results saved to {args.output}")
+        if not args.baseline:
+            return 0
+        regressions = compare(load_results(args.baseline), current, args.threshold)
+
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than the {args.threshold:.0%} threshold")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -83,9 +83,12 @@ def create_launcher():
             f.write('python app.py\n')
             f.write('if errorlevel 1 pause\n')
         
+        # 预先编译模型分数索引，首次打开推荐页时不用再解析完整的分数文件
+        subprocess.run([sys.executable, "build_score_index.py"], check=True)
+
         # 复制项目文件
         print("Copying project files...")
-        shutil.copytree(".", "dist/app", ignore=shutil.ignore_patterns('dist', 'env', '__pycache__', '*.pyc', '.git', 'pip-cache', 'models', 'output', 'user_settings.json'))
+        shutil.copytree(".", "dist/app", ignore=shutil.ignore_patterns('dist', 'env', '__pycache__', '*.pyc', '.git', 'pip-cache', 'models', 'output', 'cache', 'logs', 'user_settings.json'))
         
         # 创建一键安装脚本
         with open("dist/1.Install.bat", "w", encoding="utf-8") as f:
@@ -0,0 +1,43 @@
+"""
+编译模型分数索引 / Build the Model Score Index
+
+把 models_info/models-scores.json 编译为紧凑的分数索引(每个模型、每类音轨的中位数、均值和分位数)，
+界面和推荐接口以内存映射读取，不再解析完整的 JSON。
+Compiles models_info/models-scores.json into a compact index of per-model, per-stem median/mean/percentile
+scores that the UI and recommendation API memory-map instead of parsing the full JSON.
+
+索引缺失或过期时程序会自动重新编译，打包发布前运行此脚本可以省去首次编译。
+The app rebuilds a missing or stale index on first use; run this before packaging to ship it prebuilt.
+
+使用方法 / Usage:
+    python build_score_index.py
+    python build_score_index.py --stem vocals --metric SDR
+"""
+import sys
+import logging
+import argparse
+
+from utils import pipeline
+from utils.scores import INDEX_FILE, METRICS, SCORES_FILE, ScoreIndex, build_index, recommendation_markdown
+
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the model score index")
+    parser.add_argument("--scores", default=SCORES_FILE, help="评测分数文件")
+    parser.add_argument("--output", default=INDEX_FILE, help="索引路径(不含扩展名)")
+    parser.add_argument("--stem", help="编译后输出该音轨类型的推荐")
+    parser.add_argument("--metric", choices=METRICS, default="SDR", help="推荐使用的指标")
+    args = parser.parse_args()
+
+    meta = build_index(args.scores, args.output)
+    print(f"Indexed {len(meta['models'])} models, stems: {', '.join(meta['stems'])}")
+    if args.stem:
+        models = pipeline.load_models(config_path="models_info/models.json")
+        print(recommendation_markdown(ScoreIndex(args.scores, args.output), models, args.stem, args.metric))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
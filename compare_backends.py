@@ -0,0 +1,167 @@
+"""
+推理后端对比 / Backend Comparison
+
+此脚本在一段参考音频上分别用 torch(fp32) 和其他推理后端(int8 量化、ONNX Runtime)运行模型，
+报告各后端的加速比以及输出相对 fp32 结果的 SDR 偏差，用于按模型决定是否使用更快的后端。
+This script runs models on a reference clip with torch (fp32) and the faster backends (int8 quantization,
+ONNX Runtime), and reports each backend's speedup and the SDR drift of its output against the fp32 result,
+so the trade-off can be judged per model.
+
+记录 / Reports:
+- seconds: 分离耗时(不含加载、量化和导出) / Separation time, excluding load, quantization and export
+- speedup: torch 耗时 / 后端耗时 / torch time divided by backend time
+- sdr: 每个音轨相对 fp32 输出的 SDR(dB)，越高偏差越小 / Per-stem SDR against the fp32 output, higher means less drift
+
+使用方法 / Usage:
+    python compare_backends.py --audio song.wav --models "MelBand Roformer | INSTV7 by Gabox"
+    python compare_backends.py --audio song.wav --models "A" "B" --backends int8 onnx --seconds 20 --output drift.json
+"""
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+
+import soundfile as sf
+
+from utils import pipeline, profiling
+from utils.backends import BACKENDS
+from utils.quantize import sdr
+from utils.settings import load_settings
+from utils.workers import separate_stems
+
+logging.basicConfig(level=logging.WARNING)
+
+# 低于该 SDR(dB) 的输出标记为偏差过大
+DEFAULT_MIN_SDR = 30.0
+
+
+def cut_clip(audio, start, seconds, directory):
+    """截取参考片段写入临时 wav，返回路径"""
+    info = sf.info(audio)
+    frames = int(seconds * info.samplerate) if seconds else -1
+    data, sample_rate = sf.read(audio, start=int(start * info.samplerate), frames=frames, dtype="float32")
+    path = os.path.join(directory, "reference.wav")
+    sf.write(path, data, sample_rate)
+    return path
+
+
+def run(model_filename, clip, backend, args, spill_dir):
+    """
+    用指定后端分离参考片段
+
+    返回:
+        (Stem 列表, 分离耗时, 实际使用的后端)
+    """
+    stems, stages = profiling.run_profiled(
+        "compare", separate_stems, model_filename, clip,
+        model_dir=args.model_dir,
+        norm_thresh=args.norm_thresh,
+        amp_thresh=args.amp_thresh,
+        seg_size=args.seg_size,
+        override_seg_size=False,
+        overlap=args.overlap,
+        batch_size=args.batch_size,
+        use_autocast=pipeline.use_autocast(),
+        spill_dir=spill_dir,
+        backend=backend,
+    )
+    separate = [stage for stage in stages if stage["name"] == "separate"]
+    return stems, separate[0]["wall"], separate[0].get("backend", backend)
+
+
+def release(stems):
+    """释放音轨数据(内存映射的临时文件随临时目录一起删除)"""
+    for stem in stems:
+        stem.release()
+
+
+def compare_model(model_key, model_filename, clip, args, spill_dir):
+    """对一个模型比较 torch 和各后端"""
+    # 第一次运行包含模型加载之外的预热开销，先跑一次 torch 再计时
+    release(run(model_filename, clip, "torch", args, spill_dir)[0])
+    reference, torch_seconds, _ = run(model_filename, clip, "torch", args, spill_dir)
+    results = []
+    for backend in args.backends:
+        # 第一次切换时量化或导出，第二次运行才计时
+        release(run(model_filename, clip, backend, args, spill_dir)[0])
+        stems, seconds, used = run(model_filename, clip, backend, args, spill_dir)
+        if used != backend:
+            release(stems)
+            print(f"  {model_key}: {backend} is not available for this model, skipped")
+            continue
+        drift = {ref.name: sdr(ref.data, stem.data) for ref, stem in zip(reference, stems)}
+        release(stems)
+        results.append({
+            "model": model_key,
+            "backend": backend,
+            "torch_seconds": torch_seconds,
+            "seconds": seconds,
+            "speedup": torch_seconds / seconds if seconds else None,
+            "sdr": drift,
+            "acceptable": min(drift.values()) >= args.min_sdr,
+        })
+    release(reference)
+    return results
+
+
+def print_report(results, min_sdr):
+    print(f"{'model':40s} {'backend':8s} {'torch s':>8s} {'s':>8s} {'speedup':>8s} {'min SDR':>8s}")
+    for result in results:
+        worst = min(result["sdr"].values())
+        speedup = f"{result['speedup']:7.2f}x" if result["speedup"] is not None else f"{'-':>8s}"
+        print(
+            f"{result['model'][:40]:40s} {result['backend']:8s} {result['torch_seconds']:8.2f} "
+            f"{result['seconds']:8.2f} {speedup} {worst:8.1f}"
+            + ("" if result["acceptable"] else f"  < {min_sdr:.0f} dB, drift too large")
+        )
+
+
+def parse_args():
+    settings = load_settings()
+    advanced = settings["single_model"]["advanced"]
+    parser = argparse.ArgumentParser(description="Compare inference backends against torch fp32")
+    parser.add_argument("--audio", required=True, help="参考音频")
+    parser.add_argument("--models", nargs="+", default=[settings["single_model"]["model"]], help="模型名称")
+    parser.add_argument("--backends", nargs="+", choices=[b for b in BACKENDS if b != "torch"], default=["int8"],
+                        help="与 torch 对比的后端")
+    parser.add_argument("--start", type=float, default=0, help="参考片段的起点(秒)")
+    parser.add_argument("--seconds", type=float, default=30, help="参考片段长度(秒)，0 表示整段")
+    parser.add_argument("--model-dir", default=settings["output"]["model_dir"], help="模型文件目录")
+    parser.add_argument("--seg-size", type=int, default=advanced["seg_size"], help="分段大小")
+    parser.add_argument("--overlap", type=int, default=advanced["overlap"], help="重叠")
+    parser.add_argument("--batch-size", type=int, default=advanced["batch_size"], help="批处理大小")
+    parser.add_argument("--norm-thresh", type=float, default=advanced["norm_threshold"], help="归一化阈值")
+    parser.add_argument("--amp-thresh", type=float, default=advanced["amp_threshold"], help="放大阈值")
+    parser.add_argument("--min-sdr", type=float, default=DEFAULT_MIN_SDR, help="可接受的最低 SDR(dB)")
+    parser.add_argument("--output", help="结果保存为 JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    models = pipeline.load_models(config_path="models_info/models.json")
+    directory = tempfile.mkdtemp(prefix="compare_backends_")
+    results = []
+    try:
+        clip = cut_clip(args.audio, args.start, args.seconds, directory)
+        for model_key in args.models:
+            model_filename = pipeline.find_model(models, model_key) or model_key
+            print(f"Comparing {model_key}...")
+            results.extend(compare_model(model_key, model_filename, clip, args, directory))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print_report(results, args.min_sdr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"audio": args.audio, "start": args.start, "seconds": args.seconds, "results": results}, f,
+                      ensure_ascii=False, indent=2)
+        print(f"Saved {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,115 +1,170 @@
 """
 模型下载器 / Model Downloader
 
-此脚本用于从 GitHub 上下载音频分离模型。用户可以选择要下载的模型，脚本会生成下载链接并在浏览器中打开。
-This script is used to download audio separation models from GitHub. Users can select the model to download, and the script will generate a download link and open it in the browser.
+此脚本用于下载音频分离模型及其配置文件。可以交互选择模型，也可以一次同步 models.json 中的全部模型。
+This script downloads audio separation models and their config files. Pick models interactively, or sync every model referenced in models.json at once.
 
 功能 / Features:
-1. 加载模型信息 / Load model information
-2. 显示可用模型列表 / Display available model list
-3. 生成下载链接并在浏览器中打开 / Generate download link and open in browser
+1. 多个文件同时下载，支持 Range 的服务器按分段并行下载 / Concurrent files, parallel HTTP range downloads where supported
+2. 中断后再次运行从已下载的位置继续 / Interrupted downloads resume where they stopped
+3. 可指定镜像、本地 HTTP 服务或本地目录作为下载源 / Configurable mirror, local HTTP server or local directory as the source
+4. 校验大小和 SHA-256 后原子地写入模型目录 / Size and SHA-256 are verified before files are moved atomically into the model dir
 
 使用方法 / Usage:
-1. 运行脚本 / Run the script
-2. 选择要下载的模型 / Select the model to download
-3. 在浏览器中完成下载并将文件保存到指定目录 / Complete the download in the browser and save the file to the specified directory
+    python model_downloader_cn.py                                  # 交互选择 / interactive
+    python model_downloader_cn.py --sync                           # 同步全部模型 / sync all models
+    python model_downloader_cn.py --models "BS-Roformer-Viperx-1297"
+    python model_downloader_cn.py --sync --base-url http://10.0.0.2:8000/models/
+    python model_downloader_cn.py --sync --base-url /mnt/share/models
+    python model_downloader_cn.py --write-manifest /mnt/share/models  # 为镜像生成校验清单 / checksum a mirror
 """
-import json
 import os
-import webbrowser
+import sys
+import json
+import logging
+import argparse
+import threading
+
 from tqdm import tqdm
 
-# 模型下载基础URL
-BASE_URL = "https://gitproxy.click/https://github.com/nomadkaraoke/python-audio-separator/releases/download/model-configs/"
+from utils import downloader
+
+logging.basicConfig(level=logging.WARNING)
+
 
 def load_models_info():
     """加载模型信息"""
     with open("models_info/models.json", "r", encoding="utf-8") as f:
         return json.load(f)
 
+
 def display_models(models_info):
     """显示所有模型并返回模型索引映射"""
     model_index = 1
     model_map = {}
-    print("使用 gitproxy.click 访问 GitHub 上的模型文件")
     print("可用模型列表：")
     print("-" * 80)
-    
+
     for category, models in models_info.items():
         print(f"\n{category}:")
         for display_name, actual_name in models.items():
             print(f"  [{model_index}] {display_name}")
             model_map[model_index] = (display_name, actual_name, category)
             model_index += 1
-    
+
     return model_map
 
-def open_download_link(model_filename, save_dir="models"):
-    """生成下载链接并使用浏览器打开"""
-    # 创建保存目录
-    os.makedirs(save_dir, exist_ok=True)
-    
-    url = BASE_URL + model_filename
-    save_path = os.path.join(save_dir, model_filename)
-    
-    print(f"正在打开浏览器下载链接: {url}")
-    print(f"请将下载的文件保存到: {os.path.abspath(save_dir)} 目录")
-    
-    # 打开浏览器下载
-    webbrowser.open(url)
-    
-    print(f"已打开浏览器，请在浏览器中完成下载。")
-    return True
+
+def download_models(model_filenames, args):
+    """下载模型并输出汇总，返回失败的文件数"""
+    lock = threading.Lock()
+    bar = tqdm(unit="B", unit_scale=True, unit_divisor=1024, desc="Downloading")
+
+    def progress(count):
+        with lock:
+            bar.update(count)
+
+    def on_result(filename, result):
+        if result["status"] == "failed":
+            detail = result["error"]
+        elif result["status"] == "downloaded":
+            detail = f"{result['bytes'] / 1024**2:.1f} MB in {result['wall_time']:.1f}s"
+        else:
+            detail = "already present"
+        with lock:
+            bar.write(f"{result['status']:10s} {filename}  {detail}")
+
+    try:
+        summary = downloader.sync_models(
+            model_filenames,
+            model_dir=args.model_dir,
+            urls=args.base_url,
+            jobs=args.jobs,
+            connections=args.connections,
+            verify=args.verify,
+            progress=progress,
+            on_result=on_result,
+        )
+    finally:
+        bar.close()
+    print(
+        f"Done: {summary['downloaded']} downloaded, {summary['skipped']} already present, "
+        f"{summary['failed']} failed; {summary['bytes'] / 1024**2:.1f} MB in {summary['wall_time']:.1f}s "
+        f"({summary['throughput'] / 1024**2:.2f} MB/s)"
+    )
+    return summary["failed"]
+
+
+def interactive(models_info, args):
+    """交互选择要下载的模型"""
+    model_map = display_models(models_info)
+    print(f"\n模型将保存到: {os.path.abspath(args.model_dir)}")
+
+    while True:
+        print("\n" + "-" * 80)
+        choice = input("请输入要下载的模型序号，多个用空格分隔 (输入a下载全部，q退出): ")
+
+        if choice.lower() == 'q':
+            print("程序已退出。")
+            break
+        if choice.lower() == 'a':
+            download_models([actual_name for _, actual_name, _ in model_map.values()], args)
+            continue
+
+        try:
+            choices = [int(item) for item in choice.split()]
+        except ValueError:
+            print("请输入有效的数字序号。")
+            continue
+        invalid = [item for item in choices if item not in model_map]
+        if invalid or not choices:
+            print(f"无效的选择: {choice}，请输入有效的序号。")
+            continue
+        for item in choices:
+            display_name, actual_name, category = model_map[item]
+            print(f"您选择了: {display_name} (类别: {category}) -> {actual_name}")
+        download_models([model_map[item][1] for item in choices], args)
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Download separation models")
+    parser.add_argument("--sync", action="store_true", help="下载 models.json 中的全部模型")
+    parser.add_argument("--models", nargs="+", help="要下载的模型名称或文件名")
+    parser.add_argument("--model-dir", default="models", help="模型文件目录")
+    parser.add_argument("--base-url", action="append",
+                        help=f"下载源(URL 或本地目录)，可多次指定，依次尝试；默认读取 {downloader.BASE_URL_ENV} 环境变量")
+    parser.add_argument("--jobs", type=int, default=downloader.DEFAULT_JOBS, help="同时下载的文件数")
+    parser.add_argument("--connections", type=int, default=downloader.DEFAULT_CONNECTIONS,
+                        help="每个文件的分段连接数")
+    parser.add_argument("--verify", action="store_true", help="对已存在的文件也校验 SHA-256")
+    parser.add_argument("--write-manifest", metavar="DIR", help="为镜像目录生成 checksums.json 后退出")
+    args = parser.parse_args()
+
+    if args.write_manifest:
+        print(f"Wrote {downloader.write_manifest(args.write_manifest)}")
+        return 0
+
     try:
-        # 加载模型信息
         models_info = load_models_info()
-        
-        # 显示模型列表并获取映射
-        model_map = display_models(models_info)
-        
-        # 创建模型目录提示
-        models_dir = os.path.abspath("models")
-        if not os.path.exists(models_dir):
-            os.makedirs(models_dir)
-        print(f"\n下载的模型应保存在: {models_dir}")
-        print("下载后请确保模型文件放在上述目录中，以便程序正确加载")
-        
-        while True:
-            # 用户输入
-            print("\n" + "-" * 80)
-            choice = input("请输入要下载的模型序号 (输入q退出): ")
-            
-            if choice.lower() == 'q':
-                print("程序已退出。")
-                break
-            
-            try:
-                choice = int(choice)
-                if choice not in model_map:
-                    print(f"无效的选择: {choice}，请输入有效的序号。")
-                    continue
-                
-                display_name, actual_name, category = model_map[choice]
-                print(f"\n您选择了: {display_name} (类别: {category})")
-                print(f"对应的模型文件: {actual_name}")
-                
-                # 下载确认
-                confirm = input("确认使用浏览器下载？ (y/n): ")
-                if confirm.lower() == 'y':
-                    open_download_link(actual_name)
-                    print("\n请等待浏览器下载完成。下载后请确认文件名正确，并将文件放入模型目录。")
-                    input("按回车键继续...")
-                else:
-                    print("下载已取消。")
-            
-            except ValueError:
-                print("请输入有效的数字序号。")
-    
+        if args.sync:
+            filenames = [actual_name for models in models_info.values() for actual_name in models.values()]
+        elif args.models:
+            lookup = {display_name: actual_name for models in models_info.values() for display_name, actual_name in models.items()}
+            filenames = [lookup.get(name, name) for name in args.models]
+        else:
+            interactive(models_info, args)
+            return 0
+        return 1 if download_models(filenames, args) else 0
+
+    except KeyboardInterrupt:
+        print("\n已中断，再次运行将从中断处继续下载。")
+        return 130
     except Exception as e:
         print(f"发生错误: {str(e)}")
-        input("按回车键退出...")
+        if not (args.sync or args.models):
+            input("按回车键退出...")
+        return 1
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
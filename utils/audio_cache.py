@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from utils import profiling
+from utils.result_cache import file_digest
+
+logger = logging.getLogger(__name__)
+
+# 解码缓存目录和容量，可通过环境变量或命令行参数覆盖，容量为 0 时禁用
+DEFAULT_CACHE_DIR = os.environ.get("DECODED_AUDIO_CACHE_DIR", os.path.join("cache", "decoded"))
+DEFAULT_MAX_BYTES = int(os.environ.get("DECODED_AUDIO_CACHE_MAX_BYTES", 2 * 1024**3))
+# 分离器默认的采样率，合成前按此采样率预先解码
+DEFAULT_SAMPLE_RATE = 44100
+
+DECODE_VERSION = 1
+
+
+class DecodedAudioCache:
+    """
+    解码后的输入音频缓存
+
+    输入按 librosa.load(mono=False, sr=采样率) 解码一次，保存为原始 float32 文件，
+    之后以只读内存映射打开。同一进程和不同工作进程共享操作系统页缓存中的同一份数据，
+    内容相同的后续任务也直接复用。超出容量时按最近使用时间淘汰。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        self._lock = threading.Lock()
+        self._decoding = {}  # 键 -> Event，同一进程内同一输入只解码一次
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, cache_dir=None, max_bytes=None):
+        """调整缓存目录和容量，max_bytes 为 0 时禁用"""
+        if cache_dir is not None:
+            self.cache_dir = cache_dir
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+            self.enabled = max_bytes > 0
+
+    def make_key(self, path, sample_rate):
+        payload = f"{DECODE_VERSION}:{file_digest(path)}:{int(sample_rate)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def load(self, path, sample_rate=DEFAULT_SAMPLE_RATE):
+        """
+        返回解码后的只读音频数组，形状与 librosa.load(mono=False) 相同
+
+        返回:
+            通常是缓存文件的只读 np.memmap；单个输入大于缓存容量或缓存文件无法打开时
+            不经过缓存，返回内存中的只读 np.ndarray(没有 filename)；缓存禁用时返回 None。
+            需要文件路径的调用方(例如把输入交给工作进程映射)要自行写入临时文件。
+        """
+        if not self.enabled:
+            return None
+        key = self.make_key(path, sample_rate)
+
+        while True:
+            data = self._open(key)
+            if data is not None:
+                with self._lock:
+                    self.hits += 1
+                return data
+            with self._lock:
+                pending = self._decoding.get(key)
+                if pending is None:
+                    pending = self._decoding[key] = threading.Event()
+                    self.misses += 1
+                    break
+            pending.wait()
+
+        try:
+            with profiling.stage("decode"):
+                data = self._decode(path, sample_rate)
+            data.flags.writeable = False
+            if data.nbytes > self.max_bytes:
+                # 超过整个缓存容量的输入写入后会被立即淘汰，直接使用内存中的数据
+                logger.info(
+                    f"Decoded {os.path.basename(path)} ({data.nbytes / 1024**2:.0f} MB) exceeds the cache size, "
+                    f"not caching it"
+                )
+                return data
+            self._store(key, data)
+            self.evict(keep=key)
+            cached = self._open(key)
+            return data if cached is None else cached
+        finally:
+            with self._lock:
+                self._decoding.pop(key, None)
+            pending.set()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return f"{base}.f32", f"{base}.json"
+
+    def _open(self, key):
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            data = np.memmap(data_path, dtype=np.float32, mode="r", shape=tuple(meta["shape"]))
+        except (OSError, ValueError, KeyError):
+            return None
+        # 更新访问时间用于 LRU
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        return data
+
+    def _decode(self, path, sample_rate):
+        import librosa
+
+        logger.info(f"Decoding {os.path.basename(path)} at {sample_rate} Hz")
+        data, _ = librosa.load(path, mono=False, sr=sample_rate)
+        return np.ascontiguousarray(data, dtype=np.float32)
+
+    def _store(self, key, data):
+        """先写临时文件再替换，多个进程同时写入同一键也不会读到不完整的数据"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        data_path, meta_path = self._paths(key)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        data.tofile(data_path + suffix)
+        os.replace(data_path + suffix, data_path)
+        with open(meta_path + suffix, "w", encoding="utf-8") as f:
+            json.dump({"shape": list(data.shape), "created": time.time()}, f)
+        os.replace(meta_path + suffix, meta_path)
+
+    def evict(self, keep=None):
+        """
+        按最近使用时间淘汰，直到总大小不超过预算
+
+        参数:
+            keep: 不淘汰的键(刚写入、马上要打开的条目)
+        """
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            data_path, meta_path = self._paths(key)
+            try:
+                size = os.path.getsize(data_path)
+                entries.append((os.path.getmtime(meta_path), size, key))
+            except OSError:
+                continue
+            total += size
+
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            # 先删除元数据，其他进程随后不会再打开该条目
+            for entry_path in reversed(self._paths(key)):
+                try:
+                    os.remove(entry_path)
+                except OSError:
+                    # Windows 上仍被映射的文件无法删除，下次再淘汰
+                    pass
+            total -= size
+            with self._lock:
+                self.evictions += 1
+            logger.info(f"Decoded audio cache evicted: {key[:12]}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "enabled": self.enabled,
+                "max_bytes": self.max_bytes,
+            }
+
+
+@contextmanager
+def shared_decoding(separator, cache=None):
+    """
+    在上下文中让分离器从解码缓存读取输入，而不是每个模型各自重新解码
+
+    分离器会原地归一化输入，因此每次交给模型的是缓存数据的一份拷贝。
+    """
+    cache = cache or decoded_audio
+    instance = separator.model_instance
+    original = instance.prepare_mix
+
+    def prepare_mix(mix):
+        if isinstance(mix, str):
+            data = cache.load(mix, instance.sample_rate)
+            if data is not None:
+                if not np.any(data):
+                    raise ValueError(f"Audio file {mix} is empty or not valid")
+                # prepare_mix 会把数组转置为 (channels, samples)
+                return original(np.array(data).T)
+        return original(mix)
+
+    instance.prepare_mix = prepare_mix
+    try:
+        yield
+    finally:
+        del instance.prepare_mix
+
+
+# 进程级共享的解码缓存
+decoded_audio = DecodedAudioCache()
@@ -0,0 +1,46 @@
+import logging
+
+from utils import onnx_backend, quantize
+
+logger = logging.getLogger(__name__)
+
+# 推理后端: torch 为 audio-separator 默认的 PyTorch 推理，onnx 用 ONNX Runtime 在 CPU 上运行，
+# int8 为线性层动态 int8 量化的 PyTorch CPU 推理
+BACKENDS = ("torch", "onnx", "int8")
+_BUILDERS = {"onnx": onnx_backend.build, "int8": quantize.build}
+
+
+def select(separator, backend):
+    """
+    切换已加载分离器的推理后端
+
+    第一次使用 onnx/int8 时才创建对应的模型(导出或量化，结果缓存在模型目录)，之后切换不再有开销；
+    原模型保留，随时可以切回 torch。模型不是 Roformer、在 GPU 上运行或创建失败时使用 torch。
+
+    返回:
+        实际使用的后端
+    """
+    instance = separator.model_instance
+    if not hasattr(instance, "_torch_model"):
+        instance._torch_model = instance.model_run
+        instance._backend_models = {}
+    instance.model_run = instance._torch_model
+    if backend not in _BUILDERS:
+        return "torch"
+    if backend not in instance._backend_models:
+        instance._backend_models[backend] = _BUILDERS[backend](instance) if _supported(instance, backend) else None
+    runner = instance._backend_models[backend]
+    if runner is None:
+        return "torch"
+    instance.model_run = runner
+    return backend
+
+
+def _supported(instance, backend):
+    if not getattr(instance, "is_roformer", False):
+        logger.warning(f"The {backend} backend only supports Roformer models, using torch for {instance.model_name}")
+        return False
+    if instance.torch_device.type != "cpu":
+        logger.warning(f"The {backend} backend runs on the CPU, using torch on {instance.torch_device}")
+        return False
+    return True
@@ -0,0 +1,484 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from concurrent.futures import as_completed
+
+from utils import pipeline, profiling
+from utils.chunked import DEFAULT_CHUNK_OVERLAP
+from utils.silence import DEFAULT_SILENCE_THRESHOLD
+from utils.clean_up import cleanup_temp_files
+from utils.model_pool import model_pool
+from utils.stems import Stem
+from utils.workers import get_executor, separate_stems, share_weights, worker_memory
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".opus", ".m4a", ".aiff", ".aif", ".ac3", ".wma", ".aac")
+STATE_VERSION = 1
+# 按模型顺序调度时每组的文件数，0 表示按暂存空间预算分组；组内所有文件的中间音轨同时保存在磁盘上
+DEFAULT_GROUP_SIZE = 0
+# 中间音轨可占用的暂存空间(字节)，同时不超过暂存目录所在磁盘剩余空间的 90%
+DEFAULT_SCRATCH_BYTES = int(os.environ.get("BATCH_SCRATCH_MAX_BYTES", 8 * 1024**3))
+# 每个模型每秒音频的中间音轨大小: 44.1kHz 立体声 float32，两个音轨
+STEM_BYTES_PER_SECOND = 44100 * 2 * 4 * 2
+# 无法读取时长的文件按此时长(秒)估计
+UNKNOWN_DURATION = 600
+
+
+def collect_inputs(paths, recursive=False):
+    """
+    展开输入: 目录中的音频文件、清单文件(每行一个路径，# 开头为注释)或单个音频文件
+
+    返回:
+        去重后的音频文件绝对路径列表，保持输入顺序
+    """
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                found = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+            else:
+                found = [os.path.join(path, name) for name in os.listdir(path)]
+            inputs.extend(sorted(f for f in found if f.lower().endswith(AUDIO_EXTENSIONS)))
+        elif path.lower().endswith(AUDIO_EXTENSIONS):
+            inputs.append(path)
+        elif os.path.isfile(path):
+            # 清单中的相对路径相对于清单文件所在目录
+            base_dir = os.path.dirname(os.path.abspath(path))
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        inputs.append(os.path.join(base_dir, line))
+        else:
+            raise ValueError(f"Input not found: {path}")
+
+    seen = set()
+    result = []
+    for path in inputs:
+        path = os.path.abspath(path)
+        if path not in seen:
+            seen.add(path)
+            result.append(path)
+    return result
+
+
+class JobState:
+    """
+    批处理任务状态文件，每个任务结束后原子写入，崩溃后可从中断处继续
+
+    任务状态: pending / done / failed，崩溃时正在执行的任务按 pending 处理。
+    """
+
+    def __init__(self, path, config=None):
+        self.path = path
+        self.config = config or {}
+        self.jobs = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.jobs = data.get("jobs", {})
+            if config is not None and data.get("config") not in (None, config):
+                logger.warning(f"Batch settings differ from {path}, finished jobs are still skipped")
+            logger.info(f"Resuming batch from {path}: {len(self.jobs)} jobs recorded")
+
+    def pending(self, inputs, retry_failed=False):
+        """返回还需要处理的输入"""
+        todo = []
+        for audio in inputs:
+            job = self.jobs.get(audio)
+            if job is None:
+                todo.append(audio)
+            elif job["status"] == "done":
+                # 输出文件被删除时重新处理
+                if not all(os.path.exists(p) for p in job.get("outputs", []) if p):
+                    todo.append(audio)
+            elif job["status"] != "failed" or retry_failed:
+                todo.append(audio)
+        return todo
+
+    def update(self, audio, **fields):
+        self.update_many({audio: fields})
+
+    def update_many(self, updates):
+        """一次更新多个任务并只写一次状态文件"""
+        with self._lock:
+            for audio, fields in updates.items():
+                self.jobs.setdefault(audio, {}).update(fields)
+            self.save()
+
+    def save(self):
+        """先写临时文件再替换，避免写到一半时崩溃损坏状态文件"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": STATE_VERSION, "config": self.config, "jobs": self.jobs}, f,
+                      ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def run_job(audio, spec, models):
+    """
+    处理一个输入文件，可在工作进程中执行
+
+    参数:
+        audio: 输入音频路径
+        spec: 批处理参数(mode、model_keys 以及分离/合成参数)
+        models: 模型配置
+
+    返回:
+        任务结果字典(输出文件、耗时、音频时长)
+    """
+    if spec["mode"] == "single":
+        stem1, stem2, profile = pipeline.roformer_separator(
+            audio,
+            spec["model_keys"][0],
+            spec["seg_size"],
+            spec["override_seg_size"],
+            spec["overlap"],
+            spec["pitch_shift"],
+            spec["model_dir"],
+            spec["output_dir"],
+            spec["output_format"],
+            spec["norm_thresh"],
+            spec["amp_thresh"],
+            spec["batch_size"],
+            spec["single_stem"],
+            chunk_seconds=spec.get("chunk_seconds", 0),
+            chunk_overlap=spec.get("chunk_overlap", DEFAULT_CHUNK_OVERLAP),
+            parallel_workers=spec.get("chunk_workers", 1),
+            skip_silence=spec.get("skip_silence", False),
+            silence_threshold=spec.get("silence_threshold", DEFAULT_SILENCE_THRESHOLD),
+            backend=spec.get("backend", "torch"),
+            models=models,
+        )
+        outputs = [stem1, stem2]
+    else:
+        vocals, instrumental, profile = pipeline.auto_ensemble_process(
+            audio,
+            spec["model_keys"],
+            spec["seg_size"],
+            spec["overlap"],
+            spec["output_format"],
+            spec["use_tta"],
+            spec["model_dir"],
+            spec["output_dir"],
+            spec["norm_thresh"],
+            spec["amp_thresh"],
+            spec["batch_size"],
+            spec["method"],
+            spec["only_instrumental"],
+            backend=spec.get("backend", "torch"),
+            models=models,
+        )
+        outputs = [vocals, instrumental]
+    return {
+        "outputs": [p for p in outputs if p],
+        "wall_time": profile.wall_time,
+        "audio_duration": profile.duration,
+    }
+
+
+def run_batch(inputs, spec, models, state, jobs=1, torch_threads=0, on_result=None):
+    """
+    处理所有输入，jobs 大于 1 时在进程池中同时处理多个文件
+
+    每个工作进程保留自己的模型池，连续的任务复用已加载的模型。
+
+    参数:
+        inputs: 待处理的输入路径列表
+        spec: 批处理参数
+        models: 模型配置
+        state: JobState
+        jobs: 同时处理的文件数
+        torch_threads: 每个进程的torch线程数，0 表示自动分配
+        on_result: 每个任务结束时的回调 on_result(audio, job)
+
+    返回:
+        汇总统计字典
+    """
+    summary = {"done": 0, "failed": 0, "audio_duration": 0.0}
+    start = time.perf_counter()
+
+    def finish(audio, result=None, error=None):
+        if error is None:
+            state.update(audio, status="done", error=None, finished=time.time(), **result)
+            summary["done"] += 1
+            summary["audio_duration"] += result["audio_duration"] or 0.0
+        else:
+            state.update(audio, status="failed", error=str(error), finished=time.time())
+            summary["failed"] += 1
+            logger.error(f"Failed: {audio}: {error}")
+        if on_result:
+            on_result(audio, state.jobs[audio])
+
+    if jobs <= 1:
+        for audio in inputs:
+            try:
+                result = run_job(audio, spec, models)
+            except Exception as e:
+                finish(audio, error=e)
+            else:
+                finish(audio, result)
+    else:
+        share_weights([pipeline.find_model(models, model_key) for model_key in spec["model_keys"]], spec["model_dir"])
+        executor = get_executor(jobs, torch_threads)
+        futures = {executor.submit(run_job, audio, spec, models): audio for audio in inputs}
+        try:
+            for future in as_completed(futures):
+                audio = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    finish(audio, error=e)
+                else:
+                    finish(audio, result)
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+        summary["worker_memory"] = worker_memory()
+
+    summary["wall_time"] = time.perf_counter() - start
+    summary["throughput"] = (
+        summary["audio_duration"] / summary["wall_time"] if summary["wall_time"] > 0 else 0.0
+    )
+    return summary
+
+
+def _separate_kwargs(spec, spill_dir):
+    return dict(
+        model_dir=spec["model_dir"],
+        norm_thresh=spec["norm_thresh"],
+        amp_thresh=spec["amp_thresh"],
+        seg_size=spec["seg_size"],
+        override_seg_size=False,
+        overlap=spec["overlap"],
+        batch_size=spec["batch_size"],
+        use_autocast=pipeline.use_autocast(),
+        use_tta=spec["use_tta"],
+        spill_dir=spill_dir,
+        memory_budget=0,
+        backend=spec.get("backend", "torch"),
+    )
+
+
+def reserve_pool(model_count):
+    """
+    让模型池至少能同时保留 model_count 个模型，返回原来的容量
+
+    按模型顺序调度时下一组文件从上一组最后的模型开始，池能放下所有模型时每个模型只加载一次。
+    内存预算(max_bytes)仍然有效。
+    """
+    previous = model_pool.max_models
+    if previous and previous < model_count:
+        model_pool.configure(max_models=model_count)
+    return previous
+
+
+def plan_groups(inputs, model_count, spill_dir, group_size=DEFAULT_GROUP_SIZE, scratch_bytes=DEFAULT_SCRATCH_BYTES):
+    """
+    把输入分组，使一组文件所有模型的中间音轨不超过暂存空间预算
+
+    参数:
+        model_count: 合成的模型数
+        group_size: 每组最多的文件数，0 表示不限
+        scratch_bytes: 暂存空间预算(字节)
+
+    返回:
+        [[输入, ...], ...]，每组至少一个文件
+    """
+    directory = os.path.abspath(spill_dir)
+    while not os.path.isdir(directory) and os.path.dirname(directory) != directory:
+        directory = os.path.dirname(directory)
+    try:
+        scratch_bytes = min(scratch_bytes, int(shutil.disk_usage(directory).free * 0.9))
+    except OSError:
+        pass
+
+    groups = []
+    group = []
+    total = 0
+    for audio in inputs:
+        size = (profiling.audio_duration(audio) or UNKNOWN_DURATION) * STEM_BYTES_PER_SECOND * model_count
+        if group and (total + size > scratch_bytes or (group_size and len(group) >= group_size)):
+            groups.append(group)
+            group, total = [], 0
+        group.append(audio)
+        total += size
+    if group:
+        groups.append(group)
+    logger.info(
+        f"{len(inputs)} files in {len(groups)} groups within {scratch_bytes / 1024**3:.1f} GB of scratch space"
+    )
+    return groups
+
+
+def separate_songs(model, inputs, spec, spill_dir):
+    """
+    用一个模型依次分离多个文件，模型只加载一次，可在工作进程中执行
+
+    音轨全部写入 spill_dir 下的临时文件。
+
+    返回:
+        ({输入: (Stem 列表, 耗时)}, {输入: 错误信息}, 实际加载模型的次数)
+    """
+    # 工作进程的模型池只服务批处理，保留所有模型供后续分组复用
+    reserve_pool(len(spec["model_keys"]))
+    loads = model_pool.stats()["misses"]
+    kwargs = _separate_kwargs(spec, spill_dir)
+    results = {}
+    errors = {}
+    for audio in inputs:
+        start = time.perf_counter()
+        try:
+            results[audio] = (separate_stems(model, audio, **kwargs), time.perf_counter() - start)
+        except Exception as e:
+            logger.error(f"Separation failed: {audio} with {model}: {e}")
+            errors[audio] = f"{model}: {e}"
+    return results, errors, model_pool.stats()["misses"] - loads
+
+
+def run_model_major(inputs, spec, models, state, jobs=1, torch_threads=0, on_result=None,
+                    group_size=DEFAULT_GROUP_SIZE, scratch_bytes=DEFAULT_SCRATCH_BYTES):
+    """
+    按模型顺序处理多模型合成: 每组文件先用第一个模型全部分离，再换下一个模型，
+    最后逐个文件合成
+
+    逐个文件处理时每个文件都要依次加载所有模型，按模型顺序时模型池保留所有模型，
+    整个批次每个模型只加载一次；池的内存预算放不下所有模型时，相邻两组按相反的模型顺序运行，
+    复用上一组最后仍在池中的模型。jobs 大于 1 时不同模型在不同工作进程中同时运行。
+    已分离的音轨记录在状态文件中，中断后继续时不会重新分离。
+
+    参数:
+        group_size: 每组最多的文件数，0 表示只按暂存空间分组
+        scratch_bytes: 一组文件的中间音轨可占用的磁盘空间(字节)
+
+    返回:
+        汇总统计字典，包含实际加载模型次数和避免的加载次数
+    """
+    spill_dir = os.path.join(spec["output_dir"], "tmp", "batch")
+    summary = {"done": 0, "failed": 0, "audio_duration": 0.0, "model_loads": 0, "loads_avoided": 0}
+    start = time.perf_counter()
+
+    if jobs > 1:
+        share_weights([pipeline.find_model(models, model_key) for model_key in spec["model_keys"]], spec["model_dir"])
+    groups = plan_groups(inputs, len(spec["model_keys"]), spill_dir, group_size, scratch_bytes)
+    summary["groups"] = len(groups)
+    max_models = reserve_pool(len(spec["model_keys"])) if jobs <= 1 else None
+    try:
+        for index, group in enumerate(groups):
+            _run_group(group, spec, models, state, jobs, torch_threads, on_result, spill_dir, summary,
+                       reverse=index % 2 == 1)
+    finally:
+        if max_models is not None:
+            model_pool.configure(max_models=max_models)
+    if jobs > 1:
+        summary["worker_memory"] = worker_memory()
+
+    summary["wall_time"] = time.perf_counter() - start
+    summary["throughput"] = (
+        summary["audio_duration"] / summary["wall_time"] if summary["wall_time"] > 0 else 0.0
+    )
+    logger.info(
+        f"Model loads: {summary['model_loads']} "
+        f"(file-by-file scheduling would need {summary['model_loads'] + summary['loads_avoided']})"
+    )
+    return summary
+
+
+def _run_group(group, spec, models, state, jobs, torch_threads, on_result, spill_dir, summary, reverse=False):
+    """按模型顺序处理一组文件，reverse 时从最后一个模型开始"""
+    model_keys = spec["model_keys"]
+
+    # 恢复上次已完成的 (文件, 模型) 分离结果
+    separated = {audio: {} for audio in group}
+    seconds = {audio: 0.0 for audio in group}
+    errors = {audio: [] for audio in group}
+    loads = [0]
+    for audio in group:
+        for model_key, infos in state.jobs.get(audio, {}).get("stems", {}).items():
+            if all(os.path.exists(info["path"]) for info in infos):
+                separated[audio][model_key] = infos
+
+    def record(model_key, results, errs, model_loads):
+        loads[0] += model_loads
+        for audio, (stems, elapsed) in results.items():
+            separated[audio][model_key] = [stem.to_dict() for stem in stems]
+            seconds[audio] += elapsed
+            for stem in stems:
+                stem.release()
+        for audio, error in errs.items():
+            errors[audio].append(error)
+        state.update_many({
+            audio: {"status": "separating", "stems": separated[audio]} for audio in results
+        })
+
+    tasks = []
+    for model_key in model_keys:
+        songs = [audio for audio in group if model_key not in separated[audio]]
+        if songs:
+            tasks.append((model_key, pipeline.find_model(models, model_key), songs))
+    if reverse:
+        tasks.reverse()
+
+    if jobs <= 1:
+        for model_key, model, songs in tasks:
+            logger.info(f"Separating {len(songs)} files with {model_key}")
+            record(model_key, *separate_songs(model, songs, spec, spill_dir))
+    else:
+        executor = get_executor(jobs, torch_threads)
+        futures = {
+            executor.submit(separate_songs, model, songs, spec, spill_dir): model_key
+            for model_key, model, songs in tasks
+        }
+        try:
+            for future in as_completed(futures):
+                record(futures[future], *future.result())
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+    # 逐个文件处理时每个文件都要加载每个模型
+    summary["model_loads"] += loads[0]
+    summary["loads_avoided"] += sum(len(songs) for _, _, songs in tasks) - loads[0]
+
+    # 所有模型完成后逐个文件合成
+    for audio in group:
+        stems = [info for model_key in model_keys for info in separated[audio].get(model_key, [])]
+        outputs = []
+        error = "; ".join(errors[audio]) or None
+        ensemble_start = time.perf_counter()
+        if error is None:
+            collector = pipeline.StemCollector(spec["method"], spec["only_instrumental"])
+            try:
+                for model_key in model_keys:
+                    collector.add([Stem.from_dict(info) for info in separated[audio][model_key]])
+                base_name = os.path.splitext(os.path.basename(audio))[0]
+                outputs = collector.write_outputs(base_name, spec["output_dir"], spec["output_format"])
+            except Exception as e:
+                error = str(e)
+            finally:
+                collector.release()
+        cleanup_temp_files([info["path"] for info in stems])
+
+        if error is None:
+            duration = profiling.audio_duration(audio)
+            wall_time = seconds[audio] + time.perf_counter() - ensemble_start
+            state.update(
+                audio, status="done", error=None, stems={}, finished=time.time(),
+                outputs=[p for p in outputs if p], wall_time=wall_time, audio_duration=duration,
+            )
+            summary["done"] += 1
+            summary["audio_duration"] += duration or 0.0
+        else:
+            state.update(audio, status="failed", error=error, stems={}, finished=time.time())
+            summary["failed"] += 1
+            logger.error(f"Failed: {audio}: {error}")
+        if on_result:
+            on_result(audio, state.jobs[audio])
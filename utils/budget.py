@@ -0,0 +1,192 @@
+import os
+import json
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+from utils import profiling
+from utils.scores import score_index
+
+logger = logging.getLogger(__name__)
+
+# 估计耗时时读取的指标日志最近记录数
+HISTORY_RECORDS = 2000
+# 没有任何耗时记录时假定的实时率(处理耗时 / 音频时长)
+DEFAULT_RTF = 1.0
+
+
+class RuntimeHistory:
+    """
+    从 profiling 的指标日志统计各模型实际的实时率，按推理后端分开统计
+
+    日志文件变化(大小或修改时间)后才重新读取。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._signature = None
+        self._rtf = {}
+        self._lock = threading.Lock()
+
+    def rtf(self, backend="torch"):
+        """{模型显示名称: 实时率中位数}，只统计使用 backend 的任务，没有日志时返回空字典"""
+        path = self.path or profiling.metrics_log_path()
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            return {}
+        signature = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if signature != self._signature:
+                self._rtf = self._read(path)
+                self._signature = signature
+            return dict(self._rtf.get(backend, {}))
+
+    @staticmethod
+    def _read(path):
+        samples = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = deque(f, maxlen=HISTORY_RECORDS)
+        except OSError as e:
+            logger.warning(f"Failed to read metrics log {path}: {e}")
+            return {}
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("error") or record.get("cached"):
+                # 缓存命中的记录几乎不耗时，不代表实际推理速度
+                continue
+            # 加入推理后端之前的记录都是 torch
+            backend_samples = samples.setdefault(record.get("backend", "torch"), {})
+            if record.get("job") == "separation" and record.get("rtf"):
+                backend_samples.setdefault(record["model"], []).append(record["rtf"])
+            elif record.get("job") == "ensemble":
+                for stage in record.get("stages", []):
+                    if stage.get("name") == "separate_model" and stage.get("rtf"):
+                        backend_samples.setdefault(stage["model"], []).append(stage["rtf"])
+        return {
+            backend: {model: float(np.median(values)) for model, values in backend_samples.items()}
+            for backend, backend_samples in samples.items()
+        }
+
+
+def estimate_rtf(selected_models, history=None, backend="torch"):
+    """
+    估计每个模型的实时率
+
+    优先使用本机该后端的历史记录，其次是评测数据中的处理速度，都没有时使用已知模型的中位数。
+
+    参数:
+        selected_models: [(显示名称, 模型文件名), ...]
+        backend: 推理后端
+
+    返回:
+        {显示名称: 实时率}
+    """
+    observed = (history or runtime_history).rtf(backend)
+    estimates = {}
+    for model_key, model_filename in selected_models:
+        if model_key in observed:
+            estimates[model_key] = observed[model_key]
+        else:
+            speed = score_index.seconds_per_minute(model_filename)
+            estimates[model_key] = speed / 60 if speed else None
+    known = [value for value in estimates.values() if value]
+    fallback = float(np.median(known)) if known else DEFAULT_RTF
+    return {model_key: value or fallback for model_key, value in estimates.items()}
+
+
+def plan_ensemble(selected_models, audio, only_instrumental, max_models=0, max_seconds=0, metric="SDR",
+                  backend="torch"):
+    """
+    在预算内挑选要运行的模型
+
+    参数:
+        selected_models: 用户选择的模型 [(显示名称, 模型文件名), ...]
+        audio: 输入音频路径，用于按时长估计耗时
+        only_instrumental: 只输出伴奏时按伴奏分数挑选，否则按人声分数挑选
+        max_models: 最多运行的模型数，0 表示不限
+        max_seconds: 估计总耗时上限(秒)，0 表示不限
+        backend: 推理后端，按该后端的历史耗时估计
+
+    返回:
+        (要运行的模型列表, 挑选结果)，未设置预算时返回全部模型和 None。
+        选中的模型都没有评测分数时按选择顺序保留预算内的前几个，
+        耗时预算内放不下任何组合时只保留估计最快的一个，始终不超出预算。
+    """
+    if not (max_models or max_seconds) or len(selected_models) < 2:
+        return selected_models, None
+
+    costs = None
+    if max_seconds:
+        duration = profiling.audio_duration(audio)
+        if duration:
+            costs = {model_key: rtf * duration for model_key, rtf in estimate_rtf(selected_models, backend=backend).items()}
+        else:
+            logger.warning("Unknown audio duration, ignoring the runtime budget")
+            if not max_models:
+                return selected_models, None
+
+    # 有评测数据的模型都有人声分数，伴奏分数只有部分模型有，同时输出两者时按人声挑选
+    stems = ["instrumental"] if only_instrumental else ["vocals"]
+    unscored = {
+        model_key for model_key, model in selected_models
+        if any(score_index.score(model, stem, metric) is None for stem in stems)
+    }
+    chosen, estimate = score_index.best_subset(
+        stems,
+        dict(selected_models),
+        max_models=max_models or None,
+        max_cost=max_seconds if costs else None,
+        costs=costs,
+        metric=metric,
+    )
+    if chosen:
+        selection = "score"
+    elif len(unscored) == len(selected_models):
+        # 没有评测数据，按用户选择的顺序保留
+        selection = "order"
+        chosen, total = [], 0.0
+        for model_key, _ in selected_models:
+            if max_models and len(chosen) >= max_models:
+                break
+            if costs and total + costs[model_key] > max_seconds:
+                continue
+            chosen.append(model_key)
+            total += costs[model_key] if costs else 0.0
+        if chosen:
+            logger.warning(f"No benchmark scores for the selected models, keeping the first {len(chosen)} that fit")
+    if not chosen:
+        # 耗时预算内放不下任何组合
+        selection = "cheapest"
+        chosen = [min(selected_models, key=lambda item: costs[item[0]])[0]]
+        logger.warning(f"No models fit the runtime budget, keeping the fastest one {chosen[0]}")
+
+    kept = [(model_key, model) for model_key, model in selected_models if model_key in chosen]
+    skipped = [model_key for model_key, _ in selected_models if model_key not in chosen]
+    plan = {
+        "budget_models": max_models,
+        "budget_seconds": max_seconds,
+        "selection": selection,
+        "scores_available": len(unscored) < len(selected_models),
+        "passes_saved": len(skipped),
+        # 按分数或耗时被去掉的模型，和因为没有评测分数而没有参与挑选的模型分开记录
+        "pruned_models": [model_key for model_key in skipped if model_key not in unscored],
+        "unscored_models": [model_key for model_key in skipped if model_key in unscored],
+        "estimated_score": estimate,
+        "estimated_seconds_saved": sum(costs[model_key] for model_key in skipped) if costs else None,
+    }
+    logger.info(
+        f"Ensemble budget: running {len(kept)} of {len(selected_models)} models by {selection}, "
+        f"pruned {plan['pruned_models']}, no scores {plan['unscored_models']}"
+    )
+    return kept, plan
+
+
+# 进程级共享的历史耗时统计
+runtime_history = RuntimeHistory()
@@ -0,0 +1,438 @@
+import os
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import soundfile as sf
+
+from utils import profiling
+from utils.audio_cache import decoded_audio, DEFAULT_SAMPLE_RATE
+from utils.clean_up import cleanup_temp_files
+from utils.ensemble import _output_subtype
+from utils.model_pool import model_pool, configure_separator
+from utils.silence import DEFAULT_SILENCE_THRESHOLD, find_active_regions
+from utils.stems import Stem, capture_stems, spill_to_disk
+from utils.workers import get_executor, separate_file, share_weights
+
+logger = logging.getLogger(__name__)
+
+# 默认窗口长度和相邻窗口的重叠(秒)，窗口长度为 0 表示不分块
+DEFAULT_CHUNK_SECONDS = 120
+DEFAULT_CHUNK_OVERLAP = 5
+# 读写拼接结果时每块的采样点数
+BLOCK_SIZE = 1 << 18
+# 拼接结果直接用 soundfile 写出的格式，其他格式与整段分离一样交给 pydub(ffmpeg) 编码
+SOUNDFILE_FORMATS = ("wav", "flac", "aiff")
+
+
+def plan_windows(length, chunk, overlap):
+    """
+    把 length 个采样点切分为相互重叠的窗口
+
+    返回:
+        [(起点, 终点), ...]，相邻窗口重叠 overlap 个采样点
+    """
+    if chunk <= overlap:
+        raise ValueError("Chunk length must be larger than chunk overlap.")
+    windows = []
+    start = 0
+    while True:
+        stop = min(start + chunk, length)
+        windows.append((start, stop))
+        if stop >= length:
+            return windows
+        start += chunk - overlap
+
+
+def crossfade_curves(length):
+    """等功率淡入/淡出曲线，两者平方和恒为 1"""
+    t = (np.arange(length, dtype=np.float32) + 0.5) / max(length, 1)
+    return np.sin(t * np.pi / 2), np.cos(t * np.pi / 2)
+
+
+def _peak(data):
+    """分块计算最大绝对值，不把内存映射数组整体读入内存"""
+    peak = 0.0
+    for start in range(0, data.shape[-1], BLOCK_SIZE):
+        block = np.asarray(data[..., start:start + BLOCK_SIZE])
+        if block.size:
+            peak = max(peak, float(np.abs(block).max()))
+    return peak
+
+
+def _normalize_gain(peak, max_peak, min_peak):
+    """与 spec_utils.normalize 相同的缩放规则，返回缩放系数"""
+    if peak > max_peak:
+        return max_peak / peak
+    if min_peak and 0 < peak < min_peak:
+        return min_peak / peak
+    return 1.0
+
+
+@contextmanager
+def window_input(separator, window):
+    """在上下文中让分离器忽略输入路径，改为分离给定的 (channels, length) 窗口"""
+    instance = separator.model_instance
+    original = instance.prepare_mix
+
+    def prepare_mix(mix):
+        # prepare_mix 会把数组转置为 (channels, samples)
+        return original(window.T)
+
+    instance.prepare_mix = prepare_mix
+    try:
+        yield
+    finally:
+        del instance.prepare_mix
+
+
+def separate_window(
+    model_filename,
+    source,
+    start,
+    stop,
+    gain,
+    audio,
+    model_dir,
+    output_format,
+    seg_size,
+    override_seg_size,
+    overlap,
+    batch_size,
+    use_autocast,
+    pitch_shift=0,
+    single_stem=None,
+    spill_dir=None,
+    backend="torch",
+):
+    """
+    分离输入的一个窗口，音轨以内存映射临时文件返回
+
+    输入已在主进程按整段音频归一化(gain)，窗口内不再归一化，
+    避免各窗口的音量不一致；输出音轨的归一化在拼接后统一进行。
+
+    参数:
+        source: 解码后的输入 Stem(只传递文件路径)
+        start, stop: 窗口的采样点范围
+        gain: 输入的缩放系数
+        audio: 原始输入路径，只用于生成音轨文件名
+
+    返回:
+        Stem 列表
+    """
+    window = np.array(source.data[..., start:stop], dtype=np.float32)
+    window *= gain
+    with model_pool.acquire(
+        model_filename,
+        model_dir,
+        segment_size=seg_size,
+        override_segment_size=override_seg_size,
+        batch_size=batch_size,
+        use_autocast=use_autocast,
+    ) as separator:
+        if separator.model_instance.sample_rate != source.sample_rate:
+            raise ValueError(
+                f"Model sample rate {separator.model_instance.sample_rate} does not match "
+                f"decoded input {source.sample_rate}"
+            )
+        configure_separator(
+            separator,
+            output_dir=None,
+            output_format=output_format,
+            normalization_threshold=float("inf"),
+            amplification_threshold=0,
+            output_single_stem=single_stem,
+            overlap=overlap,
+            pitch_shift=pitch_shift,
+            backend=backend,
+        )
+        with capture_stems(separator, spill_dir, memory_budget=0) as capture, window_input(separator, window), \
+                profiling.stage("separate", backend=separator.backend):
+            separator.separate(audio)
+    return capture.stems
+
+
+class _Stitcher:
+    """
+    把各窗口的音轨按顺序叠加到磁盘上的完整音轨中
+
+    重叠部分前一个窗口等功率淡出、后一个窗口淡入，同一时刻只读取一个窗口。
+    没有窗口覆盖的部分(跳过的静音)保持为零。
+    """
+
+    def __init__(self, windows, length, spill_dir):
+        self.windows = windows
+        self.spill_dir = spill_dir
+        self.length = length
+        self.tracks = {}  # 音轨名 -> (内存映射数组, 路径)
+
+    def add(self, index, stems):
+        start, stop = self.windows[index]
+        fade_in = max(0, self.windows[index - 1][1] - start) if index > 0 else 0
+        fade_out = max(0, stop - self.windows[index + 1][0]) if index + 1 < len(self.windows) else 0
+        for stem in stems:
+            data = np.array(stem.data[..., :stop - start], dtype=np.float32)
+            length = data.shape[-1]
+            if fade_in:
+                data[..., :fade_in] *= crossfade_curves(fade_in)[0][:length]
+            if fade_out and length > stop - start - fade_out:
+                # 模型输出比窗口略短时只淡出实际存在的部分
+                curve = crossfade_curves(fade_out)[1]
+                data[..., stop - start - fade_out:] *= curve[:length - (stop - start - fade_out)]
+            track = self._track(stem.name, data.shape[0])
+            track[..., start:start + length] += data
+
+    def _track(self, name, channels):
+        if name not in self.tracks:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = os.path.join(self.spill_dir, f"{os.getpid()}_{len(self.tracks)}_{name}.f32")
+            track = np.memmap(path, dtype=np.float32, mode="w+", shape=(channels, self.length))
+            self.tracks[name] = (track, path)
+        return self.tracks[name][0]
+
+    def write(self, output_dir, sample_rate, max_peak, min_peak):
+        """归一化并写出每个音轨，返回输出文件路径列表"""
+        outputs = []
+        for name, (track, path) in self.tracks.items():
+            track.flush()
+            gain = _normalize_gain(_peak(track), max_peak, min_peak)
+            output = os.path.join(output_dir, name)
+            if _format(output) in SOUNDFILE_FORMATS:
+                self._write_wave(track, output, sample_rate, gain, _output_subtype(output))
+            else:
+                # 与 audio-separator 的 pydub 写出方式相同: 16 位 PCM 交给 ffmpeg 编码
+                wave_path = f"{path}.wav"
+                try:
+                    self._write_wave(track, wave_path, sample_rate, gain, "PCM_16")
+                    _encode(wave_path, output)
+                finally:
+                    cleanup_temp_files([wave_path])
+            outputs.append(output)
+        return outputs
+
+    def _write_wave(self, track, output, sample_rate, gain, subtype):
+        with sf.SoundFile(output, "w", samplerate=sample_rate, channels=track.shape[0], subtype=subtype) as writer:
+            for start in range(0, self.length, BLOCK_SIZE):
+                block = np.asarray(track[:, start:start + BLOCK_SIZE]) * gain
+                if subtype == "PCM_16":
+                    block = np.clip(block, -1.0, 1.0)
+                writer.write(block.T)
+
+    def release(self):
+        paths = [path for _, path in self.tracks.values()]
+        self.tracks = {}
+        return paths
+
+
+def _format(path):
+    """输出文件的格式名，aif 按 aiff 处理"""
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    return "aiff" if ext == "aif" else ext
+
+
+def check_output_format(output_format):
+    """
+    在分离开始前确认拼接结果能以 output_format 写出
+
+    soundfile 不能写出的格式需要 pydub 和 ffmpeg，缺少时抛出 ValueError，避免推理结束后才失败。
+    """
+    if output_format.lower() in SOUNDFILE_FORMATS:
+        return
+    try:
+        from pydub.utils import get_encoder_name, which
+    except ImportError:
+        raise ValueError(f"Writing {output_format} output from chunked separation requires pydub")
+    if which(get_encoder_name()) is None:
+        raise ValueError(f"Writing {output_format} output from chunked separation requires ffmpeg")
+
+
+def _encode(wave_path, output):
+    """用 pydub 把 wav 编码为输出格式，格式名和码率与 audio-separator 写出音轨时一致"""
+    from pydub import AudioSegment
+
+    file_format = _format(output)
+    if file_format == "m4a":
+        file_format = "mp4"
+    bitrate = "320k" if file_format == "mp3" else None
+    AudioSegment.from_wav(wave_path).export(output, format=file_format, bitrate=bitrate).close()
+
+
+def _report_skipped(profile, skipped, processed, separate_wall):
+    """按实际分离速度估算跳过静音节省的时间，记入任务信息"""
+    skipped_seconds = skipped / DEFAULT_SAMPLE_RATE
+    time_saved = separate_wall / processed * skipped if processed else 0.0
+    share = skipped / (skipped + processed)
+    logger.info(f"Skipped {share:.1%} silence ({skipped_seconds:.1f}s of audio), saved about {time_saved:.1f}s")
+    if profile is not None:
+        profile.info.update(silence_skipped=share, skipped_seconds=skipped_seconds, time_saved=time_saved)
+
+
+def separate_chunked(
+    model_filename,
+    audio,
+    model_dir,
+    output_dir,
+    output_format,
+    norm_thresh,
+    amp_thresh,
+    seg_size,
+    override_seg_size,
+    overlap,
+    batch_size,
+    use_autocast,
+    pitch_shift=0,
+    single_stem=None,
+    backend="torch",
+    chunk_seconds=DEFAULT_CHUNK_SECONDS,
+    chunk_overlap=DEFAULT_CHUNK_OVERLAP,
+    skip_silence=False,
+    silence_threshold=DEFAULT_SILENCE_THRESHOLD,
+    workers=1,
+    torch_threads=0,
+    progress=None,
+):
+    """
+    把长音频切分为重叠窗口分别分离，再用等功率交叉淡化拼接为完整音轨
+
+    workers 大于 1 时窗口在进程池中并行分离，每个工作进程的模型池保持模型常驻。
+    输入解码后以内存映射共享，每个进程一次只处理一个窗口，峰值内存取决于窗口长度
+    而不是音频长度；拼接结果也保存在磁盘上的临时文件中。
+
+    skip_silence 为 True 时先用能量门限找出有声区域，只把这些区域(含边距)交给模型，
+    其余部分在输出音轨中直接写入静音。跳过的比例和估计节省的时间记入当前任务。
+
+    参数与 workers.separate_file 相同，另外:
+        chunk_seconds: 窗口长度(秒)，0 表示每个有声区域作为一个窗口
+        chunk_overlap: 相邻窗口的重叠(秒)
+        skip_silence: 是否跳过静音
+        silence_threshold: 静音门限(dBFS)
+        workers: 并行分离的进程数，1 表示在当前进程依次分离
+        torch_threads: 每个进程的torch线程数，0 表示自动分配
+        progress: 进度回调 progress(已完成窗口数, 窗口总数)
+
+    返回:
+        输出音轨文件路径列表
+    """
+    check_output_format(output_format)
+    spill_dir = os.path.join(output_dir, "tmp")
+    temp_files = []
+
+    data = decoded_audio.load(audio, DEFAULT_SAMPLE_RATE)
+    if data is None:
+        import librosa
+
+        with profiling.stage("decode"):
+            data, _ = librosa.load(audio, mono=False, sr=DEFAULT_SAMPLE_RATE)
+    if not isinstance(data, np.memmap):
+        # 缓存禁用或输入大于缓存容量时写入临时文件，供工作进程映射
+        data, path = spill_to_disk(np.ascontiguousarray(data, dtype=np.float32), spill_dir)
+        temp_files.append(path)
+    source = Stem("input", data, DEFAULT_SAMPLE_RATE, data.filename)
+
+    length = data.shape[-1]
+    regions = [(0, length)]
+    if skip_silence:
+        with profiling.stage("silence_gate"):
+            regions = find_active_regions(data, DEFAULT_SAMPLE_RATE, silence_threshold)
+        if not regions:
+            # 整段都是静音时仍分离开头一小段，用于得到输出音轨
+            regions = [(0, min(length, DEFAULT_SAMPLE_RATE))]
+
+    windows = []
+    for region_start, region_stop in regions:
+        if not chunk_seconds:
+            windows.append((region_start, region_stop))
+            continue
+        windows.extend(
+            (region_start + start, region_start + stop)
+            for start, stop in plan_windows(
+                region_stop - region_start,
+                int(chunk_seconds * DEFAULT_SAMPLE_RATE),
+                int(chunk_overlap * DEFAULT_SAMPLE_RATE),
+            )
+        )
+    if windows == [(0, length)]:
+        # 音频不超过一个窗口且没有可跳过的静音时与不分块相同
+        source.release()
+        cleanup_temp_files(temp_files)
+        return separate_file(
+            model_filename, audio, model_dir, output_dir, output_format, norm_thresh, amp_thresh,
+            seg_size, override_seg_size, overlap, batch_size, use_autocast,
+            pitch_shift=pitch_shift, single_stem=single_stem, backend=backend,
+        )
+
+    processed = sum(stop - start for start, stop in regions)
+    logger.info(
+        f"Separating {os.path.basename(audio)} in {len(windows)} chunks with {workers} workers"
+        + (f", skipping {1 - processed / length:.1%} silence" if skip_silence else "")
+    )
+    with profiling.stage("input_peak"):
+        gain = _normalize_gain(_peak(data), norm_thresh, amp_thresh)
+    kwargs = dict(
+        model_dir=model_dir,
+        output_format=output_format,
+        seg_size=seg_size,
+        override_seg_size=override_seg_size,
+        overlap=overlap,
+        batch_size=batch_size,
+        use_autocast=use_autocast,
+        pitch_shift=pitch_shift,
+        single_stem=single_stem,
+        spill_dir=spill_dir,
+        backend=backend,
+    )
+    profile = profiling.current()
+    stitcher = _Stitcher(windows, length, spill_dir)
+    pending = deque()  # 已提交但尚未拼接的窗口
+    separate_wall = [0.0]  # 各窗口分离耗时之和
+
+    def consume(index, result):
+        stems, stages = result
+        temp_files.extend(stem.path for stem in stems if stem.path)
+        separate_wall[0] += stages[0]["wall"]
+        if profile is not None:
+            profile.merge(stages)
+        with profiling.stage("stitch"):
+            stitcher.add(index, stems)
+        for stem in stems:
+            stem.release()
+        cleanup_temp_files([stem.path for stem in stems if stem.path])
+        if progress is not None:
+            progress(index + 1, len(windows))
+
+    try:
+        if workers > 1:
+            share_weights([model_filename], model_dir)
+            executor = get_executor(workers, torch_threads)
+            # 最多同时提交两轮窗口，按顺序拼接并及时删除已拼接窗口的临时文件
+            for index, (start, stop) in enumerate(windows):
+                pending.append(executor.submit(
+                    profiling.run_profiled, "separate_chunk", separate_window,
+                    model_filename, source, start, stop, gain, audio, **kwargs,
+                ))
+                if len(pending) >= workers * 2:
+                    consume(index + 1 - len(pending), pending.popleft().result())
+            while pending:
+                consume(len(windows) - len(pending), pending.popleft().result())
+        else:
+            for index, (start, stop) in enumerate(windows):
+                consume(index, profiling.run_profiled(
+                    "separate_chunk", separate_window,
+                    model_filename, source, start, stop, gain, audio, **kwargs,
+                ))
+
+        if skip_silence:
+            _report_skipped(profile, length - processed, processed, separate_wall[0])
+        with profiling.stage("encode"):
+            return stitcher.write(output_dir, DEFAULT_SAMPLE_RATE, norm_thresh, amp_thresh)
+    except Exception:
+        # 等待已提交的窗口结束，以便清理它们的临时文件
+        for future in pending:
+            if future.exception() is None:
+                temp_files.extend(stem.path for stem in future.result()[0] if stem.path)
+        raise
+    finally:
+        source.release()
+        temp_files.extend(stitcher.release())
+        cleanup_temp_files(temp_files, spill_dir)
@@ -0,0 +1,529 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from importlib.util import find_spec
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 依次尝试的下载源，与 audio-separator 自身查找模型和配置文件的顺序一致
+DEFAULT_BASE_URLS = (
+    "https://gitproxy.click/https://github.com/nomadkaraoke/python-audio-separator/releases/download/model-configs/",
+    "https://gitproxy.click/https://github.com/TRvlvr/model_repo/releases/download/all_public_uvr_models/",
+    "https://gitproxy.click/https://github.com/TRvlvr/model_repo/releases/download/all_public_uvr_models/mdx_model_data/mdx_c_configs/",
+)
+# 用逗号分隔的下载源，可以是镜像 URL、本地 HTTP 服务或本地目录
+BASE_URL_ENV = "MODEL_BASE_URL"
+# 已校验文件的大小和 SHA-256，镜像根目录下的同名文件也会被读取
+CHECKSUMS_FILE = os.path.join("models_info", "checksums.json")
+MANIFEST_NAME = "checksums.json"
+# audio-separator 加载模型时读取的模型列表，离线环境需要提前下载
+DOWNLOAD_CHECKS = "download_checks.json"
+DOWNLOAD_CHECKS_BASE_URL = "https://gitproxy.click/https://raw.githubusercontent.com/TRvlvr/application_data/main/filelists/"
+
+DEFAULT_JOBS = 4  # 同时下载的文件数
+DEFAULT_CONNECTIONS = 4  # 每个文件的分段连接数
+MIN_PART_SIZE = 16 << 20  # 小于该大小的分段不再拆分
+BLOCK_SIZE = 1 << 20
+TIMEOUT = 30
+RETRIES = 3
+CHECKPOINT_INTERVAL = 2.0  # 保存分段进度的最小间隔(秒)
+USER_AGENT = "Audio-Separator-UI downloader"
+
+
+class _NotFound(RuntimeError):
+    """下载源中没有该文件，继续尝试下一个源"""
+
+
+def base_urls(urls=None):
+    """
+    下载源列表: 参数优先，其次是 MODEL_BASE_URL 环境变量，最后是默认源
+    """
+    if urls:
+        return list(urls)
+    env = os.environ.get(BASE_URL_ENV, "")
+    if env.strip():
+        return [url.strip() for url in env.split(",") if url.strip()]
+    return list(DEFAULT_BASE_URLS)
+
+
+def _local_dir(base):
+    """本地目录或 file:// 源返回目录路径，HTTP 源返回 None"""
+    parsed = urllib.parse.urlparse(base)
+    if parsed.scheme in ("http", "https"):
+        return None
+    if parsed.scheme == "file":
+        return urllib.request.url2pathname(parsed.path)
+    return base
+
+
+def _join(base, filename):
+    return base.rstrip("/") + "/" + urllib.parse.quote(filename)
+
+
+def _request(url, **headers):
+    return urllib.request.Request(url, headers={"User-Agent": USER_AGENT, **headers})
+
+
+def config_files(model_dir="models"):
+    """
+    {模型文件名: 配置文件名}，Roformer 和 MDX23C 模型需要对应的 yaml 配置
+
+    来自 audio-separator 自带的模型列表和它缓存在模型目录中的 download_checks.json，
+    只读取文件，不导入 audio_separator。
+    """
+    sources = [os.path.join(model_dir, DOWNLOAD_CHECKS)]
+    spec = find_spec("audio_separator")
+    if spec is not None and spec.submodule_search_locations:
+        sources.append(os.path.join(list(spec.submodule_search_locations)[0], "models.json"))
+    configs = {}
+    for path in sources:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lists = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name in ("mdx23c_download_list", "roformer_download_list"):
+            for files in lists.get(name, {}).values():
+                if isinstance(files, dict):
+                    configs.update(files)
+    return configs
+
+
+def model_files(model_filenames, model_dir="models"):
+    """模型需要的全部文件(模型文件和配置文件)，保持顺序并去重"""
+    configs = config_files(model_dir)
+    files = []
+    for model_filename in model_filenames:
+        for filename in (model_filename, configs.get(model_filename)):
+            if filename and filename not in files:
+                files.append(filename)
+    return files
+
+
+class Checksums:
+    """
+    文件大小和 SHA-256 清单
+
+    本地清单记录每次下载后校验过的结果，镜像提供的清单只补充本地没有的条目。
+    """
+
+    def __init__(self, path=CHECKSUMS_FILE):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def load_mirror(self, base):
+        """读取下载源根目录下的 checksums.json，不存在时忽略"""
+        try:
+            directory = _local_dir(base)
+            if directory is not None:
+                with open(os.path.join(directory, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            else:
+                with urllib.request.urlopen(_request(_join(base, MANIFEST_NAME)), timeout=TIMEOUT) as r:
+                    entries = json.loads(r.read().decode("utf-8"))
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            for filename, entry in entries.items():
+                self.entries.setdefault(filename, entry)
+
+    def get(self, filename):
+        with self._lock:
+            return self.entries.get(filename)
+
+    def record(self, filename, size, sha256):
+        with self._lock:
+            if self.entries.get(filename) != {"size": size, "sha256": sha256}:
+                self.entries[filename] = {"size": size, "sha256": sha256}
+                self._dirty = True
+
+    def save(self):
+        """写回本地清单(先写临时文件再替换)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_manifest(directory):
+    """
+    为镜像目录生成 checksums.json，其他机器同步时据此校验
+
+    返回:
+        清单路径
+    """
+    entries = {}
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if filename == MANIFEST_NAME or not os.path.isfile(path) or filename.endswith((".part", ".part.json", ".tmp")):
+            continue
+        entries[filename] = {"size": os.path.getsize(path), "sha256": file_sha256(path)}
+    manifest = os.path.join(directory, MANIFEST_NAME)
+    tmp_path = f"{manifest}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest)
+    return manifest
+
+
+class _PartState:
+    """
+    未完成下载的分段进度，保存在 <文件>.part.json 中用于断点续传
+
+    parts 为 [[起点, 终点(含), 下一个要写入的位置], ...]
+    """
+
+    def __init__(self, path, url, size, etag, connections):
+        self.path = path
+        self._lock = threading.Lock()
+        self._saved = 0.0
+        state = None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if state and state.get("size") == size and state.get("etag") == etag and state.get("parts"):
+            self.parts = state["parts"]
+        else:
+            count = max(1, min(connections, size // MIN_PART_SIZE))
+            step = -(-size // count)
+            self.parts = [[start, min(start + step, size) - 1, start] for start in range(0, size, step)]
+        self.state = {"url": url, "size": size, "etag": etag, "parts": self.parts}
+
+    @property
+    def done(self):
+        with self._lock:
+            return sum(pos - start for start, _, pos in self.parts)
+
+    def advance(self, part, count):
+        with self._lock:
+            part[2] += count
+        if time.monotonic() - self._saved >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            self._saved = time.monotonic()
+            tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _probe(url):
+    """
+    查询文件大小和是否支持分段下载
+
+    返回:
+        (大小或 None, 是否支持 Range, ETag)
+    """
+    try:
+        with urllib.request.urlopen(_request(url, Range="bytes=0-0"), timeout=TIMEOUT) as r:
+            etag = r.headers.get("ETag")
+            if r.status == 206:
+                total = r.headers.get("Content-Range", "").rpartition("/")[2]
+                return (int(total) if total.isdigit() else None), True, etag
+            length = r.headers.get("Content-Length")
+            return (int(length) if length and length.isdigit() else None), False, etag
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            raise _NotFound(url)
+        if e.code == 416:
+            # 空文件不能请求第一个字节
+            return 0, False, None
+        raise
+
+
+def _fetch_part(url, part_path, state, part, progress):
+    """下载一个分段，失败时从已写入的位置重试"""
+    start, end, _ = part
+    for attempt in range(RETRIES + 1):
+        if part[2] > end:
+            return
+        try:
+            request = _request(url, Range=f"bytes={part[2]}-{end}")
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as r, open(part_path, "r+b") as f:
+                if r.status != 206:
+                    raise RuntimeError("Server ignored the range request")
+                f.seek(part[2])
+                while part[2] <= end:
+                    block = r.read(min(BLOCK_SIZE, end + 1 - part[2]))
+                    if not block:
+                        break
+                    f.write(block)
+                    state.advance(part, len(block))
+                    progress(len(block))
+            if part[2] > end:
+                return
+            raise RuntimeError(f"Connection closed at byte {part[2]} of {start}-{end}")
+        except (OSError, RuntimeError) as e:
+            if attempt == RETRIES:
+                raise
+            logger.warning(f"Retrying {os.path.basename(part_path)} bytes {part[2]}-{end}: {e}")
+            time.sleep(2 ** attempt)
+
+
+def _download_http(url, part_path, connections, progress):
+    """HTTP 下载到 .part 文件，支持 Range 时分段并行并可断点续传"""
+    size, ranges, etag = _probe(url)
+    state_path = part_path + ".json"
+    if not os.path.exists(part_path) and os.path.exists(state_path):
+        # 进度文件对应的数据已不存在
+        os.remove(state_path)
+    if size and ranges:
+        state = _PartState(state_path, url, size, etag, connections)
+        if not os.path.exists(part_path) or state.done == 0:
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+        resumed = state.done
+        if resumed:
+            logger.info(f"Resuming {os.path.basename(part_path)} at {resumed / size:.0%}")
+        state.save()
+        try:
+            with ThreadPoolExecutor(len(state.parts)) as executor:
+                futures = [
+                    executor.submit(_fetch_part, url, part_path, state, part, progress)
+                    for part in state.parts
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            state.save()
+        state.remove()
+        return size - resumed
+
+    # 不支持分段下载时整个文件顺序下载，中断后只能从头开始
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    for attempt in range(RETRIES + 1):
+        written = 0
+        try:
+            with urllib.request.urlopen(_request(url), timeout=TIMEOUT) as r, open(part_path, "wb") as f:
+                for block in iter(lambda: r.read(BLOCK_SIZE), b""):
+                    f.write(block)
+                    written += len(block)
+                    progress(len(block))
+            if size is not None and written != size:
+                raise RuntimeError(f"Expected {size} bytes, got {written}")
+            return written
+        except (OSError, RuntimeError) as e:
+            if attempt == RETRIES:
+                raise
+            logger.warning(f"Retrying {os.path.basename(part_path)}: {e}")
+            time.sleep(2 ** attempt)
+
+
+def _copy_local(path, part_path, progress):
+    """从本地目录复制到 .part 文件，已复制的部分不再重复读取"""
+    if not os.path.isfile(path):
+        raise _NotFound(path)
+    size = os.path.getsize(path)
+    done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if done > size:
+        done = 0
+    with open(path, "rb") as src, open(part_path, "r+b" if done else "wb") as dst:
+        src.seek(done)
+        dst.seek(done)
+        dst.truncate()
+        for block in iter(lambda: src.read(BLOCK_SIZE), b""):
+            dst.write(block)
+            progress(len(block))
+    return size - done
+
+
+def download_file(filename, model_dir, urls, checksums=None, connections=DEFAULT_CONNECTIONS, progress=None):
+    """
+    下载单个文件，校验后原子地移动到模型目录
+
+    依次尝试每个下载源，源中没有该文件时尝试下一个。下载写入 <文件>.part，
+    中断后再次运行会从已下载的位置继续。
+
+    参数:
+        filename: 文件名
+        model_dir: 模型目录
+        urls: 下载源列表
+        checksums: Checksums 清单，有对应条目时校验大小和 SHA-256，否则记录下载结果
+        connections: 每个文件的分段连接数
+        progress: 进度回调，参数为新下载的字节数
+
+    返回:
+        (本次传输的字节数, 使用的下载源)
+    """
+    progress = progress or (lambda count: None)
+    os.makedirs(model_dir, exist_ok=True)
+    path = os.path.join(model_dir, filename)
+    part_path = path + ".part"
+
+    transferred = None
+    for base in urls:
+        directory = _local_dir(base)
+        try:
+            if directory is not None:
+                transferred = _copy_local(os.path.join(directory, filename), part_path, progress)
+            else:
+                transferred = _download_http(_join(base, filename), part_path, connections, progress)
+            break
+        except _NotFound:
+            logger.debug(f"{filename} not found at {base}")
+    if transferred is None:
+        raise RuntimeError(f"{filename} not found at any source")
+
+    size = os.path.getsize(part_path)
+    digest = file_sha256(part_path)
+    expected = checksums.get(filename) if checksums is not None else None
+    if expected and (expected.get("size") != size or expected.get("sha256") != digest):
+        # 内容不对，续传也无法修复，删除后下次重新下载
+        os.remove(part_path)
+        raise RuntimeError(f"Checksum mismatch for {filename} (got {size} bytes, sha256 {digest[:12]}...)")
+    os.replace(part_path, path)
+    if checksums is not None:
+        checksums.record(filename, size, digest)
+    return transferred, base
+
+
+def verify_existing(filename, model_dir, checksums, full=False):
+    """
+    已存在的文件是否完整
+
+    清单中有条目时比较大小，full 为 True 时同时比较 SHA-256；没有条目时视为完整，
+    full 为 True 时记录其校验值。
+    """
+    path = os.path.join(model_dir, filename)
+    if not os.path.isfile(path):
+        return False
+    expected = checksums.get(filename)
+    size = os.path.getsize(path)
+    if expected and expected.get("size") != size:
+        return False
+    if full:
+        digest = file_sha256(path)
+        if expected:
+            return expected.get("sha256") == digest
+        checksums.record(filename, size, digest)
+    return True
+
+
+def sync(
+    filenames,
+    model_dir="models",
+    urls=None,
+    jobs=DEFAULT_JOBS,
+    connections=DEFAULT_CONNECTIONS,
+    checksums_path=CHECKSUMS_FILE,
+    verify=False,
+    progress=None,
+    on_result=None,
+):
+    """
+    下载模型目录中缺少的文件
+
+    参数:
+        filenames: 文件名列表(通常来自 model_files)
+        model_dir: 模型目录
+        urls: 下载源列表，None 时使用 base_urls()
+        jobs: 同时下载的文件数
+        connections: 每个文件的分段连接数
+        checksums_path: 本地校验清单路径
+        verify: 对已存在的文件也计算 SHA-256 校验
+        progress: 进度回调，参数为新下载的字节数(可能在多个线程中调用)
+        on_result: 每个文件完成时调用 on_result(文件名, 结果字典)
+
+    返回:
+        汇总字典: downloaded、skipped、failed、bytes、wall_time、throughput(字节/秒)和 files
+    """
+    urls = base_urls(urls)
+    start = time.perf_counter()
+    checksums = Checksums(checksums_path)
+    for base in urls:
+        checksums.load_mirror(base)
+
+    results = {}
+
+    def run(filename):
+        file_start = time.perf_counter()
+        try:
+            if verify_existing(filename, model_dir, checksums, full=verify):
+                result = {"status": "skipped", "bytes": 0}
+            else:
+                transferred, source = download_file(filename, model_dir, urls, checksums, connections, progress)
+                result = {"status": "downloaded", "bytes": transferred, "source": source}
+        except Exception as e:
+            logger.error(f"Failed to download {filename}: {e}")
+            result = {"status": "failed", "bytes": 0, "error": str(e)}
+        result["wall_time"] = time.perf_counter() - file_start
+        results[filename] = result
+        if on_result is not None:
+            on_result(filename, result)
+
+    try:
+        with ThreadPoolExecutor(max(1, jobs)) as executor:
+            list(executor.map(run, filenames))
+    finally:
+        checksums.save()
+
+    wall_time = time.perf_counter() - start
+    total = sum(result["bytes"] for result in results.values())
+    return {
+        "downloaded": sum(result["status"] == "downloaded" for result in results.values()),
+        "skipped": sum(result["status"] == "skipped" for result in results.values()),
+        "failed": sum(result["status"] == "failed" for result in results.values()),
+        "bytes": total,
+        "wall_time": wall_time,
+        "throughput": total / wall_time if wall_time > 0 else 0.0,
+        "files": results,
+    }
+
+
+def sync_models(model_filenames, model_dir="models", urls=None, **kwargs):
+    """
+    下载模型及其配置文件
+
+    先获取 audio-separator 的 download_checks.json(离线加载模型需要，也用于查找配置文件名)，
+    再同步 model_files 列出的全部文件。参数同 sync。
+    """
+    urls = base_urls(urls)
+    if not os.path.isfile(os.path.join(model_dir, DOWNLOAD_CHECKS)):
+        # 该文件会随上游更新，不记录校验值
+        # 只有使用默认源时才访问上游地址，自定义镜像可能处于离线环境
+        sources = urls + [DOWNLOAD_CHECKS_BASE_URL] if urls == list(DEFAULT_BASE_URLS) else urls
+        try:
+            download_file(DOWNLOAD_CHECKS, model_dir, sources)
+        except Exception as e:
+            logger.warning(f"Could not fetch {DOWNLOAD_CHECKS}, config files of some models may be missing: {e}")
+    return sync(model_files(model_filenames, model_dir), model_dir, urls, **kwargs)
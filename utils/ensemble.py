@@ -3,26 +3,18 @@ __author__ = 'Roman Solovyev (ZFTurbo): https://github.com/ZFTurbo/'
 # modified by uy: https://github.com/youyang-617/Audio-Separator-UI
 
 import os
-import librosa
 import soundfile as sf
 import numpy as np
 import argparse
 
+from utils import spectral
+
 def stft(wave, nfft, hl):
-    wave_left = np.asfortranarray(wave[0])
-    wave_right = np.asfortranarray(wave[1])
-    spec_left = librosa.stft(wave_left, n_fft=nfft, hop_length=hl)
-    spec_right = librosa.stft(wave_right, n_fft=nfft, hop_length=hl)
-    spec = np.asfortranarray([spec_left, spec_right])
-    return spec
+    # 所有声道(以及所有模型)在一次批量调用中完成
+    return spectral.stft(wave, nfft=nfft, hl=hl)
 
 def istft(spec, hl, length):
-    spec_left = np.asfortranarray(spec[0])
-    spec_right = np.asfortranarray(spec[1])
-    wave_left = librosa.istft(spec_left, hop_length=hl, length=length)
-    wave_right = librosa.istft(spec_right, hop_length=hl, length=length)
-    wave = np.asfortranarray([wave_left, wave_right])
-    return wave
+    return spectral.istft(spec, hl=hl, length=length)
 
 def absmax(a, *, axis):
     dims = list(a.shape)
@@ -71,25 +63,18 @@ def average_waveforms(pred_track, weights, algorithm):
     :param algorithm: One of avg_wave, median_wave, min_wave, max_wave, avg_fft, median_fft, min_fft, max_fft
     :return: averaged waveform in shape (channels, length)
     """
-    pred_track = np.array(pred_track)
+    pred_track = np.asarray(pred_track)
     final_length = pred_track.shape[-1]
 
-    mod_track = []
-    for i in range(pred_track.shape[0]):
-        if algorithm == 'avg_wave':
-            mod_track.append(pred_track[i] * weights[i])
-        elif algorithm in ['median_wave', 'min_wave', 'max_wave']:
-            mod_track.append(pred_track[i])
-        elif algorithm in ['avg_fft', 'min_fft', 'max_fft', 'median_fft']:
-            spec = stft(pred_track[i], nfft=2048, hl=1024)
-            if algorithm in ['avg_fft']:
-                mod_track.append(spec * weights[i])
-            else:
-                mod_track.append(spec)
-    pred_track = np.array(mod_track)
+    if algorithm in ['avg_fft', 'min_fft', 'max_fft', 'median_fft']:
+        # 所有模型 x 声道一次完成 STFT: (num, channels, bins, frames)
+        spec = stft(pred_track, nfft=2048, hl=1024)
+        spec = _combine_spectra(spec, weights, algorithm)
+        return istft(spec, 1024, final_length)
 
     if algorithm in ['avg_wave']:
-        pred_track = pred_track.sum(axis=0)
+        weights = np.asarray(weights).reshape((-1,) + (1,) * (pred_track.ndim - 1))
+        pred_track = (pred_track * weights).sum(axis=0)
         pred_track /= np.array(weights).sum().T
     elif algorithm in ['median_wave']:
         pred_track = np.median(pred_track, axis=0)
@@ -97,29 +82,263 @@ def average_waveforms(pred_track, weights, algorithm):
         pred_track = lambda_min(pred_track, axis=0, key=np.abs)
     elif algorithm in ['max_wave']:
         pred_track = lambda_max(pred_track, axis=0, key=np.abs)
-    elif algorithm in ['avg_fft']:
-        pred_track = pred_track.sum(axis=0)
-        pred_track /= np.array(weights).sum()
-        pred_track = istft(pred_track, 1024, final_length)
-    elif algorithm in ['min_fft']:
-        pred_track = lambda_min(pred_track, axis=0, key=np.abs)
-        pred_track = istft(pred_track, 1024, final_length)
-    elif algorithm in ['max_fft']:
-        pred_track = absmax(pred_track, axis=0)
-        pred_track = istft(pred_track, 1024, final_length)
-    elif algorithm in ['median_fft']:
-        pred_track = np.median(pred_track, axis=0)
-        pred_track = istft(pred_track, 1024, final_length)
     return pred_track
 
+WAVE_ALGORITHMS = ['avg_wave', 'median_wave', 'min_wave', 'max_wave']
+FFT_ALGORITHMS = ['avg_fft', 'median_fft', 'min_fft', 'max_fft']
+
+# 流式合成每次处理的采样点数
+DEFAULT_BLOCK_SIZE = 1 << 18
+
+class _FileReader:
+    """按块读取音频文件"""
+    def __init__(self, path):
+        self.file = sf.SoundFile(path)
+        self.sr = self.file.samplerate
+        self.channels = self.file.channels
+        self.length = self.file.frames
+
+    def read(self, start, stop):
+        self.file.seek(start)
+        return self.file.read(stop - start, dtype='float32', always_2d=True).T
+
+    def close(self):
+        self.file.close()
+
+class _ArrayReader:
+    """按块读取 (channels, length) 数组，也适用于内存映射数组"""
+    def __init__(self, data, sr):
+        self.data = data
+        self.sr = sr
+        self.channels = data.shape[0]
+        self.length = data.shape[-1]
+
+    def read(self, start, stop):
+        return np.asarray(self.data[:, start:stop], dtype=np.float32)
+
+    def close(self):
+        pass
+
+def _read_padded(reader, start, stop, length):
+    """读取 [start, stop) 区间，超出 [0, length) 的部分补零"""
+    block = np.zeros((reader.channels, stop - start), dtype=np.float32)
+    lo, hi = max(start, 0), min(stop, length)
+    if hi > lo:
+        block[:, lo - start:hi - start] = reader.read(lo, hi)
+    return block
+
+def _combine_spectra(specs, weights, algorithm):
+    """在模型维度(axis 0)上合成频谱"""
+    if algorithm == 'avg_fft':
+        weights = np.asarray(weights, dtype=np.float32).reshape((-1,) + (1,) * (specs.ndim - 1))
+        return (specs * weights).sum(axis=0) / weights.sum()
+    if algorithm == 'min_fft':
+        return lambda_min(specs, axis=0, key=np.abs)
+    if algorithm == 'max_fft':
+        return absmax(specs, axis=0)
+    return np.median(specs, axis=0)
+
+def _stream_wave(readers, writer, weights, algorithm, length, block_size):
+    for start in range(0, length, block_size):
+        stop = min(start + block_size, length)
+        block = np.stack([reader.read(start, stop) for reader in readers])
+        writer.write(average_waveforms(block, weights, algorithm).T)
+
+def _stream_fft(readers, writer, weights, algorithm, length, block_size, nfft, hl):
+    """
+    逐块做 STFT -> 合成 -> ISTFT，块边界用重叠相加拼接
+
+    与 librosa.stft(center=True)/istft 的分帧方式一致: 信号两端各补 nfft//2 个零，
+    第 t 帧覆盖补零后信号的 [t*hl, t*hl+nfft)，共 1 + length//hl 帧。
+    """
+    window_sq = spectral.window(nfft) ** 2
+    pad = nfft // 2
+    n_frames = 1 + length // hl
+    frames_per_block = max(1, block_size // hl)
+    channels = readers[0].channels
+    tiny = np.finfo(np.float32).tiny
+
+    # 跨块延续的重叠相加缓冲(补零后信号坐标)
+    carry = np.zeros((channels, nfft - hl), dtype=np.float32)
+    carry_wsum = np.zeros(nfft - hl, dtype=np.float32)
+    written = 0
+
+    for f0 in range(0, n_frames, frames_per_block):
+        f1 = min(f0 + frames_per_block, n_frames)
+        count = f1 - f0
+        # 本块需要的输入区间(原始信号坐标)
+        start = f0 * hl - pad
+        stop = (f1 - 1) * hl + nfft - pad
+        block = np.stack([_read_padded(reader, start, stop, length) for reader in readers])
+
+        # (num, channels, frames, nfft)
+        frames = np.lib.stride_tricks.sliding_window_view(block, nfft, axis=-1)[..., ::hl, :]
+        specs = spectral.analyze(frames)
+        spec = _combine_spectra(specs, weights, algorithm)
+        del specs, frames, block
+        wave_frames = spectral.synthesize(spec, nfft)
+
+        span = (count - 1) * hl + nfft
+        ola = np.zeros((channels, span), dtype=np.float32)
+        wsum = np.zeros(span, dtype=np.float32)
+        ola[:, :nfft - hl] += carry
+        wsum[:nfft - hl] += carry_wsum
+        for i in range(count):
+            ola[:, i * hl:i * hl + nfft] += wave_frames[:, i]
+            wsum[i * hl:i * hl + nfft] += window_sq
+
+        # 之后的帧不会再影响 f1*hl 之前的位置，可以输出
+        done = count * hl if f1 < n_frames else span
+        carry = ola[:, done:done + nfft - hl].copy()
+        carry_wsum = wsum[done:done + nfft - hl].copy()
+        out, norm = ola[:, :done], wsum[:done]
+        nonzero = norm > tiny
+        out[:, nonzero] /= norm[nonzero]
+
+        # 转换为输出坐标并去掉两端的补零
+        lo = f0 * hl - pad
+        keep_lo = max(written - lo, 0)
+        keep_hi = min(done, length - lo)
+        if keep_hi > keep_lo:
+            writer.write(out[:, keep_lo:keep_hi].T)
+            written = lo + keep_hi
+
+    if written < length:
+        writer.write(np.zeros((length - written, channels), dtype=np.float32))
+
+def ensemble_stream(sources, output, algorithm='avg_wave', weights=None, sr=None,
+                    block_size=DEFAULT_BLOCK_SIZE, nfft=2048, hl=1024):
+    """
+    分块流式合成，峰值内存与音轨长度无关，结果边读边写入输出文件
+
+    :param sources: 音频文件路径，或 (channels, length) 数组(可为内存映射数组)
+    :param output: 输出文件路径
+    :param algorithm: One of avg_wave, median_wave, min_wave, max_wave, avg_fft, median_fft, min_fft, max_fft
+    :param weights: shape = (num, ), defaults to equal weights
+    :param sr: 采样率，输入为数组时必须提供
+    :param block_size: 每块的采样点数
+    :return: 输出文件路径
+    """
+    if algorithm not in WAVE_ALGORITHMS + FFT_ALGORITHMS:
+        raise ValueError('Unknown ensemble type: {}'.format(algorithm))
+    if weights is None:
+        weights = np.ones(len(sources))
+
+    readers = [
+        _FileReader(source) if isinstance(source, str) else _ArrayReader(source, sr)
+        for source in sources
+    ]
+    try:
+        sr = readers[0].sr
+        # 不同模型输出长度可能有细微差异，按最短对齐
+        length = min(reader.length for reader in readers)
+        channels = readers[0].channels
+        with sf.SoundFile(output, 'w', samplerate=sr, channels=channels,
+                          subtype=_output_subtype(output)) as writer:
+            if algorithm in WAVE_ALGORITHMS:
+                _stream_wave(readers, writer, weights, algorithm, length, block_size)
+            else:
+                _stream_fft(readers, writer, weights, algorithm, length, block_size, nfft, hl)
+    finally:
+        for reader in readers:
+            reader.close()
+    return output
+
+class EnsembleAccumulator:
+    """
+    在线合成: 每个模型完成后立即把结果折叠进累加器
+
+    avg 方法保存加权和，min/max 方法保存按绝对值挑选的当前结果，
+    内存只需要一条音轨加累加器。median 方法需要全部音轨，只能缓冲后统一计算。
+    与 average_waveforms 的结果一致(相同取值时保留先加入的模型，与 argmin/argmax 相同)。
+    """
+    ONLINE_ALGORITHMS = ['avg_wave', 'min_wave', 'max_wave', 'avg_fft', 'min_fft', 'max_fft']
+
+    def __init__(self, algorithm, nfft=2048, hl=1024):
+        if algorithm not in WAVE_ALGORITHMS + FFT_ALGORITHMS:
+            raise ValueError('Unknown ensemble type: {}'.format(algorithm))
+        self.algorithm = algorithm
+        self.nfft = nfft
+        self.hl = hl
+        self.count = 0
+        self.length = None
+        self.state = None
+        self.state_abs = None
+        self.weight_sum = 0.0
+        self.buffer = []  # median 方法的缓冲
+
+    def add(self, track, weight=1.0):
+        """加入一个模型的音轨，shape = (channels, length)"""
+        track = np.asarray(track, dtype=np.float32)
+        self.count += 1
+        if self.algorithm not in self.ONLINE_ALGORITHMS:
+            self.buffer.append(np.array(track))
+            return
+
+        # 不同模型输出长度可能有细微差异，按最短对齐
+        if self.length is None or track.shape[-1] < self.length:
+            self.length = track.shape[-1]
+        track = track[..., :self.length]
+        if self.algorithm in FFT_ALGORITHMS:
+            track = stft(track, nfft=self.nfft, hl=self.hl)
+
+        if self.state is None:
+            if self.algorithm in ['avg_wave', 'avg_fft']:
+                self.state = track * weight
+            else:
+                self.state = np.array(track)
+                self.state_abs = np.abs(self.state)
+            self.weight_sum = weight
+            return
+
+        # 已累加的结果可能比新音轨长，截到相同长度
+        frames = track.shape[-1]
+        self.state = self.state[..., :frames]
+        if self.state_abs is not None:
+            self.state_abs = self.state_abs[..., :frames]
+
+        if self.algorithm in ['avg_wave', 'avg_fft']:
+            self.state += track * weight
+            self.weight_sum += weight
+            return
+
+        track_abs = np.abs(track)
+        if self.algorithm in ['min_wave', 'min_fft']:
+            mask = track_abs < self.state_abs
+        else:
+            mask = track_abs > self.state_abs
+        self.state[mask] = track[mask]
+        self.state_abs[mask] = track_abs[mask]
+
+    def result(self):
+        """返回合成结果，shape = (channels, length)"""
+        if not self.count:
+            raise ValueError('No tracks to ensemble')
+        if self.algorithm not in self.ONLINE_ALGORITHMS:
+            return ensemble_arrays(self.buffer, self.algorithm)
+
+        result = self.state
+        if self.algorithm in ['avg_wave', 'avg_fft']:
+            result = result / self.weight_sum
+        if self.algorithm in FFT_ALGORITHMS:
+            result = istft(result, self.hl, self.length)
+        return result
+
 def ensemble_files(args):
     parser = argparse.ArgumentParser()
     parser.add_argument("--files", type=str, required=True, nargs='+', help="Path to all audio-files to ensemble")
     parser.add_argument("--type", type=str, default='avg_wave', help="One of avg_wave, median_wave, min_wave, max_wave, avg_fft, median_fft, min_fft, max_fft")
     parser.add_argument("--weights", type=float, nargs='+', help="Weights to create ensemble. Number of weights must be equal to number of files")
     parser.add_argument("--output", default="res.wav", type=str, help="Path to wav file where ensemble result will be stored")
+    parser.add_argument("--stream", action='store_true', help="Process files block by block with memory independent of track length")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="Samples per block in streaming mode")
+    parser.add_argument("--fft-backend", choices=spectral.BACKENDS, help="STFT backend for *_fft types")
+    parser.add_argument("--fft-workers", type=int, help="Number of threads used by the STFT backend")
     args = parser.parse_args(args) if isinstance(args, list) else parser.parse_args()
 
+    if args.fft_backend or args.fft_workers:
+        spectral.configure(backend=args.fft_backend, workers=args.fft_workers)
+
     print('Ensemble type: {}'.format(args.type))
     print('Number of input files: {}'.format(len(args.files)))
     if args.weights is not None:
@@ -128,6 +347,14 @@ def ensemble_files(args):
         weights = np.ones(len(args.files))
     print('Weights: {}'.format(weights))
     print('Output file: {}'.format(args.output))
+
+    if args.stream:
+        for f in args.files:
+            if not os.path.isfile(f):
+                print('Error. Can\'t find file: {}. Check paths.'.format(f))
+                return None
+        print('Streaming with block size: {}'.format(args.block_size))
+        return ensemble_stream(args.files, args.output, args.type, weights, block_size=args.block_size)
     
     data = []
     for f in args.files:
@@ -135,6 +362,8 @@ def ensemble_files(args):
             print('Error. Can\'t find file: {}. Check paths.'.format(f))
             return None
         print('Reading file: {}'.format(f))
+        import librosa
+
         wav, sr = librosa.load(f, sr=None, mono=False)
         print("Waveform shape: {} sample rate: {}".format(wav.shape, sr))
         data.append(wav)
@@ -142,17 +371,43 @@ def ensemble_files(args):
     data = np.array(data)
     res = average_waveforms(data, weights, args.type)
     print('Result shape: {}'.format(res.shape))
-    
+    write_audio(args.output, res, sr)
+    return args.output
+
+def ensemble_arrays(tracks, algorithm='avg_wave', weights=None):
+    """
+    直接对内存中的音轨做合成，不经过编码/解码
+
+    :param tracks: list of float32 arrays, each shape = (channels, length)
+    :param algorithm: One of avg_wave, median_wave, min_wave, max_wave, avg_fft, median_fft, min_fft, max_fft
+    :param weights: shape = (num, ), defaults to equal weights
+    :return: ensembled waveform in shape (channels, length)
+    """
+    if not tracks:
+        raise ValueError('No tracks to ensemble')
+    if weights is None:
+        weights = np.ones(len(tracks))
+    # 不同模型输出长度可能有细微差异，按最短对齐
+    length = min(track.shape[-1] for track in tracks)
+    data = np.stack([np.asarray(track[..., :length], dtype=np.float32) for track in tracks])
+    return average_waveforms(data, weights, algorithm)
+
+def _output_subtype(path):
     # 根据文件扩展名选择合适的子类型
-    ext = os.path.splitext(args.output)[1].lower()
+    ext = os.path.splitext(path)[1].lower()
     if ext == '.flac':
-        sf.write(args.output, res.T, sr, subtype='PCM_24')
+        return 'PCM_24'
     elif ext in ['.wav', '.aiff']:
-        sf.write(args.output, res.T, sr, subtype='FLOAT')
-    else:
-        # 对于其他格式，不指定子类型
-        sf.write(args.output, res.T, sr)
-    return args.output
+        return 'FLOAT'
+    # 对于其他格式，不指定子类型
+    return None
+
+def write_audio(path, data, sr):
+    """
+    把 (channels, length) 的波形写入文件，根据扩展名选择子类型
+    """
+    sf.write(path, data.T, sr, subtype=_output_subtype(path))
+    return path
 
 if __name__ == "__main__":
     ensemble_files(None)
\ No newline at end of file
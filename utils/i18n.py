@@ -3,6 +3,7 @@
 import os
 import json
 import logging
+import threading
 from pathlib import Path
 from locale import getdefaultlocale
 
@@ -94,5 +95,42 @@ class I18n:
         """获取所有可用语言"""
         return self._get_available_languages()
 
-# 创建全局翻译实例
-_ = I18n()
\ No newline at end of file
+class LazyI18n:
+    """
+    第一次翻译时才创建 I18n 实例的代理
+
+    导入本模块不会扫描语言目录和读取语言文件；在第一次调用之前
+    可以用 configure() 指定语言。
+    """
+
+    def __init__(self):
+        self._instance = None
+        self._options = {}
+        self._lock = threading.Lock()
+
+    def configure(self, language=None, config_path=None):
+        """指定语言，已经创建的实例会被替换"""
+        with self._lock:
+            self._options = {"language": language, "config_path": config_path}
+            self._instance = None
+
+    @property
+    def instance(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = I18n(**self._options)
+        return self._instance
+
+    def __call__(self, key):
+        """翻译函数，使用方式: _('key')"""
+        return self.instance(key)
+
+    def __getattr__(self, name):
+        # language、translations、get_languages 等转发给实际实例
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.instance, name)
+
+# 创建全局翻译实例(延迟加载)
+_ = LazyI18n()
\ No newline at end of file
@@ -0,0 +1,363 @@
+import os
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import profiling
+from utils.model_pool import model_pool
+from utils.result_cache import result_cache
+from utils.audio_cache import decoded_audio
+from utils.weight_cache import weight_cache
+from utils.workers import worker_memory
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 延迟(秒)和实时率的直方图分桶
+LATENCY_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+RTF_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """Prometheus 文本格式的指标基类，按标签值分组保存"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    瞬时值指标
+
+    可以传入 collect 回调，在每次抓取时返回 {标签值元组: 数值} 刷新全部取值。
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), collect=None):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        if self.collect is not None:
+            try:
+                values = self.collect()
+            except Exception as e:
+                logger.warning(f"Failed to collect {self.name}: {e}")
+                values = {}
+            with self._lock:
+                self._values = {key: value for key, value in values.items() if value is not None}
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_sample(self, key, state):
+        lines = []
+        for bound, count in zip(self.buckets, state["counts"]):
+            labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labels, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class _StatsCounter(_Metric):
+    """从 stats() 字典读取的计数"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, stats, field):
+        super().__init__(name, help_text)
+        self.stats = stats
+        self.field = field
+
+    def render(self):
+        with self._lock:
+            self._values = {(): self.stats()[self.field]}
+        return super().render()
+
+
+class Registry:
+    """指标集合，render() 输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _dir_size(path):
+    """目录下所有文件的总大小(字节)，目录不存在时返回 None"""
+    if not path or not os.path.isdir(path):
+        return None
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _rss():
+    """当前进程的常驻内存(字节)"""
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class ServiceMetrics:
+    """
+    分离服务的运行指标
+
+    任务数量、耗时和实时率来自 profiling 的任务记录；模型池和结果缓存的计数
+    在抓取时读取(只包含主进程，并行分离的工作进程各自维护模型池)。
+    """
+
+    def __init__(self):
+        self.registry = Registry()
+        self.temp_dirs = set()
+        self.queue_depth = None  # 返回排队任务数的回调
+        r = self.registry
+
+        self.jobs = r.register(Counter(
+            "separator_jobs_total", "Finished jobs by type and status", ("job", "status")))
+        r.register(Gauge(
+            "separator_jobs_in_flight", "Jobs currently running", ("job",),
+            collect=lambda: {(job,): count for job, count in profiling.active_jobs().items()}))
+        r.register(Gauge(
+            "separator_queue_depth", "Requests waiting in the UI queue",
+            collect=lambda: {(): self.queue_depth() if self.queue_depth else None}))
+        self.separation_seconds = r.register(Histogram(
+            "separator_separation_seconds", "Separation latency per model", ("model",)))
+        self.ensemble_seconds = r.register(Histogram(
+            "separator_ensemble_seconds", "Whole ensemble job latency by method", ("method",)))
+        self.skipped_audio = r.register(Counter(
+            "separator_silence_skipped_seconds_total", "Seconds of silent input not sent to the model"))
+        self.time_saved = r.register(Counter(
+            "separator_silence_time_saved_seconds_total", "Estimated processing time saved by skipping silence"))
+        self.rtf = r.register(Histogram(
+            "separator_realtime_factor", "Processing time divided by audio duration per model",
+            ("model",), buckets=RTF_BUCKETS))
+
+        sources = (
+            ("model_pool", model_pool.stats),
+            ("result_cache", result_cache.stats),
+            ("decoded_audio", decoded_audio.stats),
+        )
+        for source, stats in sources:
+            for field in ("hits", "misses", "evictions"):
+                r.register(_StatsCounter(
+                    f"separator_{source}_{field}_total", f"{source.replace('_', ' ').capitalize()} {field}",
+                    stats, field))
+        for field in ("hits", "misses"):
+            r.register(_StatsCounter(
+                f"separator_weight_cache_{field}_total", f"Weight cache {field} when loading checkpoints",
+                weight_cache.stats, field))
+        r.register(Gauge(
+            "separator_weight_load_seconds", "Latest checkpoint weight load time per model, cold or from cache",
+            ("model", "cache"),
+            collect=lambda: {
+                (model, kind): entry[kind]
+                for model, entry in weight_cache.stats()["models"].items()
+                for kind in ("cold", "warm") if kind in entry
+            }))
+        r.register(Gauge(
+            "separator_worker_memory_bytes", "Memory of each separation worker process by kind (rss, pss, shared, private)",
+            ("pid", "kind"),
+            collect=lambda: {
+                (str(pid), kind): value for pid, usage in worker_memory().items() for kind, value in usage.items()
+            }))
+        r.register(Gauge(
+            "separator_loaded_models", "Models loaded in the main process pool",
+            collect=lambda: {(): model_pool.stats()["loaded"]}))
+        r.register(Gauge(
+            "separator_loaded_model_bytes", "Size of model files loaded in the main process pool",
+            collect=lambda: {(): model_pool.stats()["loaded_bytes"]}))
+        r.register(Gauge(
+            "separator_disk_usage_bytes", "Disk usage of temporary and cache directories", ("dir",),
+            collect=self._disk_usage))
+        r.register(Gauge(
+            "process_resident_memory_bytes", "Resident memory of the UI process",
+            collect=lambda: {(): _rss()}))
+        r.register(Gauge(
+            "process_peak_resident_memory_bytes", "Peak resident memory of the UI process",
+            collect=lambda: {(): profiling.peak_rss()}))
+
+        profiling.add_listener(self.observe_job)
+
+    def watch_temp_dir(self, path):
+        """加入需要统计磁盘占用的临时目录"""
+        self.temp_dirs.add(os.path.abspath(path))
+
+    def _disk_usage(self):
+        values = {(path,): _dir_size(path) for path in sorted(self.temp_dirs)}
+        if result_cache.enabled:
+            values[(os.path.abspath(result_cache.cache_dir),)] = _dir_size(result_cache.cache_dir)
+        if decoded_audio.enabled:
+            values[(os.path.abspath(decoded_audio.cache_dir),)] = _dir_size(decoded_audio.cache_dir)
+        return values
+
+    def observe_job(self, record):
+        """根据 profiling 的任务记录更新计数和直方图"""
+        self.jobs.inc(job=record["job"], status="error" if record["error"] else "ok")
+        if record["error"] or record.get("cached"):
+            # 缓存命中没有运行推理，不计入耗时和实时率
+            return
+        duration = record.get("audio_duration")
+
+        if record["job"] == "separation":
+            self.separation_seconds.observe(record["wall_time"], model=record["model"])
+            if record["rtf"] is not None:
+                self.rtf.observe(record["rtf"], model=record["model"])
+            if record.get("skipped_seconds"):
+                self.skipped_audio.inc(record["skipped_seconds"])
+                self.time_saved.inc(record["time_saved"])
+        elif record["job"] == "ensemble":
+            self.ensemble_seconds.observe(record["wall_time"], method=record["method"])
+            for stage in record["stages"]:
+                if stage["name"] != "separate_model":
+                    continue
+                self.separation_seconds.observe(stage["wall"], model=stage["model"])
+                if duration:
+                    self.rtf.observe(stage["wall"] / duration, model=stage["model"])
+
+    def render(self):
+        return self.registry.render()
+
+
+def start_server(service, port, host="127.0.0.1"):
+    """
+    在后台线程中启动 /metrics 端点
+
+    参数:
+        service: ServiceMetrics 实例
+        port: 端口
+        host: 监听地址，默认只允许本机抓取
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = service.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info(f"Metrics endpoint: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def gradio_queue_depth(blocks):
+    """读取 Gradio 队列中等待的请求数，不同 Gradio 版本的内部结构不同，读取失败时返回 None"""
+    queue = getattr(blocks, "_queue", None)
+    if queue is None:
+        return None
+    per_concurrency = getattr(queue, "event_queue_per_concurrency_id", None)
+    if per_concurrency is not None:
+        return sum(len(getattr(q, "queue", q)) for q in list(per_concurrency.values()))
+    events = getattr(queue, "event_queue", None)
+    return len(events) if events is not None else None
+
+
+# 进程级共享的服务指标
+service_metrics = ServiceMetrics()
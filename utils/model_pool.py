@@ -0,0 +1,281 @@
+import os
+import gc
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from utils import backends, profiling
+from utils.registry import model_files
+from utils.weight_cache import weight_cache
+
+logger = logging.getLogger(__name__)
+
+# 默认池容量，可通过环境变量或命令行参数覆盖
+DEFAULT_MAX_MODELS = int(os.environ.get("SEPARATOR_POOL_MAX_MODELS", 2))
+# 按模型文件大小估算的内存预算(字节)，0 表示不限制
+DEFAULT_MAX_BYTES = int(os.environ.get("SEPARATOR_POOL_MAX_BYTES", 0))
+
+
+class _PoolEntry:
+    """池中的一个已加载分离器"""
+
+    def __init__(self, separator, size_bytes):
+        self.separator = separator
+        self.size_bytes = size_bytes
+        self.lock = threading.Lock()  # 同一实例同一时间只服务一个任务
+        self.in_use = 0
+
+
+class ModelPool:
+    """
+    进程级的已加载 Separator 实例池
+
+    以模型文件名和影响加载的参数(分段大小、批大小、autocast)作为键，
+    超出数量或内存预算时按 LRU 淘汰空闲实例。
+    """
+
+    def __init__(self, max_models=DEFAULT_MAX_MODELS, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}  # 正在加载的键 -> Event，避免重复加载
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_models=None, max_bytes=None):
+        """调整池容量，超出部分立即淘汰"""
+        with self._lock:
+            if max_models is not None:
+                self.max_models = max_models
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict_locked()
+
+    @staticmethod
+    def make_key(model_filename, model_dir, segment_size, override_segment_size, batch_size, use_autocast):
+        return (
+            model_filename,
+            os.path.abspath(model_dir),
+            int(segment_size),
+            bool(override_segment_size),
+            int(batch_size),
+            bool(use_autocast),
+        )
+
+    @contextmanager
+    def acquire(self, model_filename, model_dir, segment_size, override_segment_size, batch_size, use_autocast):
+        """
+        获取一个已加载模型的分离器，用完自动归还
+
+        参数:
+            model_filename: 模型文件名
+            model_dir: 模型文件目录
+            segment_size: 分段大小
+            override_segment_size: 是否覆盖模型默认分段大小
+            batch_size: 批处理大小
+            use_autocast: 是否启用autocast
+        """
+        key = self.make_key(
+            model_filename, model_dir, segment_size, override_segment_size, batch_size, use_autocast
+        )
+        with profiling.stage("acquire_model"):
+            entry = self._get_or_load(key)
+            entry.lock.acquire()
+        try:
+            yield entry.separator
+        finally:
+            entry.lock.release()
+            with self._lock:
+                entry.in_use -= 1
+                self._evict_locked()
+
+    def preload(self, model_filename, model_dir, segment_size, override_segment_size, batch_size, use_autocast,
+                warm=True):
+        """
+        提前加载模型(参数同 acquire)，warm 为 True 时再用一段静音跑一次推理
+
+        预热让 CUDA 初始化、算子选择和首次内存分配在任务开始前完成。
+        """
+        with self.acquire(
+            model_filename, model_dir, segment_size, override_segment_size, batch_size, use_autocast
+        ) as separator:
+            if warm:
+                _warm_up(separator)
+        logger.info(f"Preloaded {model_filename}")
+
+    def _get_or_load(self, key):
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    entry.in_use += 1
+                    self.hits += 1
+                    logger.info(f"Model pool hit: {key[0]} (hits={self.hits}, misses={self.misses})")
+                    return entry
+                pending = self._loading.get(key)
+                if pending is None:
+                    pending = self._loading[key] = threading.Event()
+                    self.misses += 1
+                    logger.info(f"Model pool miss: {key[0]} (hits={self.hits}, misses={self.misses})")
+                    break
+            # 其他线程正在加载同一模型，等待后重新查找
+            pending.wait()
+
+        try:
+            separator = _load_separator(*key)
+            size_bytes = _model_size(key[0], key[1])
+            entry = _PoolEntry(separator, size_bytes)
+            with self._lock:
+                entry.in_use += 1
+                self._entries[key] = entry
+                self._evict_locked()
+            return entry
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            pending.set()
+
+    def _evict_locked(self):
+        """按 LRU 顺序淘汰空闲实例，直到满足容量限制(调用方需持有锁)"""
+        for key in list(self._entries.keys()):
+            if not self._over_budget_locked():
+                break
+            entry = self._entries[key]
+            if entry.in_use:
+                continue
+            del self._entries[key]
+            self.evictions += 1
+            logger.info(f"Model pool evicted: {key[0]} (evictions={self.evictions})")
+            del entry
+            _release_memory()
+
+    def _over_budget_locked(self):
+        if self.max_models and len(self._entries) > self.max_models:
+            return True
+        if self.max_bytes and sum(e.size_bytes for e in self._entries.values()) > self.max_bytes:
+            return True
+        return False
+
+    def clear(self):
+        """清空池中所有空闲实例"""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if not e.in_use]:
+                del self._entries[key]
+                self.evictions += 1
+        _release_memory()
+
+    def stats(self):
+        """返回池的计数信息"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "loaded": len(self._entries),
+                "loaded_bytes": sum(e.size_bytes for e in self._entries.values()),
+                "max_models": self.max_models,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def _load_separator(model_filename, model_dir, segment_size, override_segment_size, batch_size, use_autocast):
+    """创建分离器并加载模型权重"""
+    from audio_separator.separator import Separator
+
+    with profiling.stage("init_separator"):
+        separator = Separator(
+            log_level=logging.INFO,
+            model_file_dir=model_dir,
+            use_autocast=use_autocast,
+            mdxc_params={
+                "segment_size": segment_size,
+                "override_model_segment_size": override_segment_size,
+                "batch_size": batch_size,
+                "overlap": 8,
+                "pitch_shift": 0,
+            },
+        )
+    # 检查点权重读取经过转换缓存，之后的加载直接映射缓存文件
+    with profiling.stage("load_model"), weight_cache.active(model_dir):
+        separator.load_model(model_filename=model_filename)
+        # 参数改为映射缓存文件，多个进程加载同一模型时共用一份权重内存
+        instance = separator.model_instance
+        module = getattr(instance, "model_run", None)
+        if hasattr(module, "named_parameters") and getattr(instance, "model_path", None):
+            weight_cache.share(module, instance.model_path)
+    return separator
+
+
+def _model_size(model_filename, model_dir):
+    return model_files.size(model_filename, model_dir) or 0
+
+
+def _warm_up(separator):
+    """用一个分段长度的静音跑一次推理，预热失败不影响使用"""
+    import numpy as np
+
+    model = separator.model_instance
+    try:
+        config = model.model_data_cfgdict
+        length = config.audio.hop_length * (config.inference.dim_t - 1)
+    except AttributeError:
+        length = getattr(model, "sample_rate", 44100)
+    try:
+        with profiling.stage("warm_up"):
+            model.demix(np.zeros((2, length), dtype=np.float32))
+    except Exception as e:
+        logger.warning(f"Warm-up inference failed: {e}")
+
+
+def _release_memory():
+    gc.collect()
+    try:
+        import torch
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+def configure_separator(
+    separator,
+    output_dir,
+    output_format,
+    normalization_threshold,
+    amplification_threshold,
+    output_single_stem=None,
+    backend="torch",
+    **arch_params,
+):
+    """
+    为本次任务设置不影响模型加载的参数
+
+    池中的分离器在创建时已固定模型，这里把输出目录、格式、阈值以及
+    overlap/pitch_shift 等推理参数同步到 Separator 和已实例化的模型上，
+    并切换推理后端；实际使用的后端(onnx 不可用时为 torch)记在 separator.backend。
+    """
+    common_params = {
+        "output_dir": output_dir,
+        "output_format": output_format,
+        "normalization_threshold": normalization_threshold,
+        "amplification_threshold": amplification_threshold,
+        "output_single_stem": output_single_stem,
+    }
+    for name, value in common_params.items():
+        setattr(separator, name, value)
+        setattr(separator.model_instance, name, value)
+
+    separator.arch_specific_params["MDXC"].update(arch_params)
+    for name, value in arch_params.items():
+        setattr(separator.model_instance, name, value)
+    separator.backend = backends.select(separator, backend)
+    return separator
+
+
+# 进程级共享的模型池
+model_pool = ModelPool()
@@ -0,0 +1,305 @@
+import os
+import json
+import logging
+import threading
+from importlib.util import find_spec
+
+from utils import profiling
+from utils.weight_cache import source_signature
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = find_spec("onnxruntime") is not None
+# 导出的 ONNX 模型保存在模型目录下的该子目录中
+CACHE_SUBDIR = ".onnx_cache"
+CACHE_VERSION = 2
+OPSET = 17
+# 导出后用随机输入比较 ONNX 与 torch 模型的输出，最大误差超过参考输出峰值的该比例时不使用 ONNX
+VERIFY_TOLERANCE = 1e-3
+# ONNX Runtime 的计算线程数，0 表示与当前进程的 torch 线程数一致(工作进程中已按核心数分配)
+THREADS = int(os.environ.get("ONNX_THREADS", "0"))
+
+
+class OnnxRoformer:
+    """
+    用 ONNX Runtime 运行 Roformer 模型
+
+    STFT/ISTFT 和复数掩码仍由 torch 计算，频带划分、Transformer 和掩码估计这部分
+    导出为固定时间帧数的 ONNX 图，在 CPU 会话中执行。可以直接替换 MDXC 分离器的
+    model_run: 输入输出与原模型相同，其他属性(parameters 等)转发给原模型，
+    分块、重叠和输出的处理因此与 torch 路径完全一致。
+    """
+
+    def __init__(self, model, session, frames):
+        self.model = model
+        self.session = session
+        self.frames = frames
+
+    def __call__(self, audio):
+        import torch
+
+        spectrum, features = _features(self.model, audio)
+        if features.shape[1] != self.frames:
+            # 比一个分块还短的输入帧数不同，交给原模型
+            return self.model(audio)
+        masks = self.session.run(None, {"features": features.numpy()})[0]
+        return _reconstruct(self.model, audio, spectrum, torch.from_numpy(masks))
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def build(instance):
+    """
+    为分离器的 Roformer 模型导出(或从缓存读取) ONNX 模型并创建会话，失败时返回 None
+
+    返回:
+        OnnxRoformer，可直接替换 model_run
+    """
+    if not AVAILABLE:
+        logger.warning("onnxruntime is not installed, using the torch backend")
+        return None
+    model = instance.model_run
+    try:
+        import torch
+
+        path, frames = export(model, instance.model_path, chunk_size(instance))
+        with profiling.stage("onnx_session"):
+            session = create_session(path, THREADS or torch.get_num_threads())
+    except Exception as e:
+        logger.warning(f"Failed to prepare the ONNX backend for {instance.model_name}, using torch: {e}")
+        return None
+    return OnnxRoformer(model, session, frames)
+
+
+def chunk_size(instance):
+    """分离器每次交给模型的采样点数，与 MDXC 分离器的分块方式一致"""
+    config = instance.model_data_cfgdict
+    dim_t = instance.segment_size if instance.override_model_segment_size else config.inference.dim_t
+    return config.audio.hop_length * (dim_t - 1)
+
+
+def cache_paths(checkpoint_path, frames):
+    directory = os.path.join(os.path.dirname(checkpoint_path), CACHE_SUBDIR)
+    base = os.path.join(directory, f"{os.path.basename(checkpoint_path)}.{frames}")
+    return base + ".json", base + ".onnx"
+
+
+def export(model, checkpoint_path, samples):
+    """
+    导出模型的主体部分为 ONNX，源检查点和 audio-separator 版本未变化时直接使用缓存
+
+    OnnxRoformer 在 audio-separator 之外重新实现了模型 forward 的前后处理，导出后用一段随机输入
+    比较 ONNX 路径与原模型 forward 的输出，不一致时不写入缓存并抛出 RuntimeError。
+
+    参数:
+        model: 已加载权重的 BSRoformer / MelBandRoformer
+        checkpoint_path: 检查点路径，用于缓存位置和失效判断
+        samples: 每个分块的采样点数
+
+    返回:
+        (ONNX 文件路径, 每个分块的时间帧数)
+    """
+    import torch
+
+    channels = 2 if model.stereo else 1
+    with torch.no_grad():
+        _, example = _features(model, torch.zeros(1, channels, samples))
+    frames = example.shape[1]
+    meta_path, onnx_path = cache_paths(checkpoint_path, frames)
+    if _cached(meta_path, onnx_path, checkpoint_path):
+        return onnx_path, frames
+
+    os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with profiling.stage("export_onnx"), torch.no_grad():
+        kwargs = dict(
+            input_names=["features"],
+            output_names=["masks"],
+            dynamic_axes={"features": {0: "batch"}, "masks": {0: "batch"}},
+            opset_version=OPSET,
+            do_constant_folding=True,
+        )
+        try:
+            # 新版 torch 默认使用依赖 onnxscript 的导出器，这里使用基于追踪的导出器
+            torch.onnx.export(_core(model), (example,), onnx_path + suffix, dynamo=False, **kwargs)
+        except TypeError:
+            torch.onnx.export(_core(model), (example,), onnx_path + suffix, **kwargs)
+    try:
+        with profiling.stage("verify_onnx"):
+            error = verify(model, onnx_path + suffix, frames, channels, samples)
+    except Exception:
+        os.remove(onnx_path + suffix)
+        raise
+    os.replace(onnx_path + suffix, onnx_path)
+    meta = {
+        "version": CACHE_VERSION,
+        "source": source_signature(checkpoint_path),
+        "frames": frames,
+        "opset": OPSET,
+        "torch": torch.__version__,
+        "audio_separator": _separator_version(),
+        "max_error": error,
+    }
+    with open(meta_path + suffix, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + suffix, meta_path)
+    logger.info(f"Exported {os.path.basename(checkpoint_path)} to {onnx_path}")
+    return onnx_path, frames
+
+
+def verify(model, onnx_path, frames, channels, samples):
+    """
+    用一段随机输入比较 ONNX 路径与原模型 forward 的输出
+
+    返回:
+        最大绝对误差与参考输出峰值之比，超过 VERIFY_TOLERANCE 时抛出 RuntimeError
+    """
+    import torch
+
+    session = create_session(onnx_path, THREADS or torch.get_num_threads())
+    generator = torch.Generator().manual_seed(0)
+    audio = torch.randn(1, channels, samples, generator=generator) * 0.1
+    with torch.no_grad():
+        reference = model(audio)
+        output = OnnxRoformer(model, session, frames)(audio)
+    if output.shape != reference.shape:
+        raise RuntimeError(f"ONNX output shape {tuple(output.shape)} differs from torch {tuple(reference.shape)}")
+    error = float((output - reference).abs().max() / reference.abs().max().clamp(min=1e-8))
+    if not error <= VERIFY_TOLERANCE:
+        raise RuntimeError(f"ONNX output differs from torch by {error:.2e} of the peak")
+    return error
+
+
+def _separator_version():
+    """audio-separator 的版本，模型内部实现可能随版本变化"""
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("audio-separator")
+    except PackageNotFoundError:
+        return None
+
+
+def _cached(meta_path, onnx_path, checkpoint_path):
+    if not os.path.exists(meta_path) or not os.path.exists(onnx_path):
+        return False
+    try:
+        import torch
+
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != CACHE_VERSION or meta.get("opset") != OPSET:
+            return False
+        # 导出时的验证只对当时的 audio-separator 和 torch 版本有效
+        if meta.get("audio_separator") != _separator_version() or meta.get("torch") != torch.__version__:
+            return False
+        source = source_signature(checkpoint_path, with_hash=False)
+        cached = meta["source"]
+        if source["size"] != cached["size"]:
+            return False
+        return source["mtime_ns"] == cached["mtime_ns"] or source_signature(checkpoint_path)["hash"] == cached["hash"]
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def create_session(path, threads):
+    """创建 CPU 推理会话: 开启全部图优化，算子内并行使用 threads 个线程，算子间串行执行"""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+def _features(model, audio):
+    """
+    计算模型输入的频谱特征(与模型 forward 开头的处理相同)
+
+    返回:
+        (完整频谱 [b, (f s), t, 2], 送入频带划分的特征 [b, t, (f c)])
+    """
+    import torch
+
+    if audio.ndim == 2:
+        audio = audio.unsqueeze(1)
+    batch, channels, length = audio.shape
+    window = model.stft_window_fn().to(audio.device)
+    spectrum = torch.stft(audio.reshape(batch * channels, length), **model.stft_kwargs, window=window,
+                          return_complex=True)
+    spectrum = torch.view_as_real(spectrum)
+    freqs, frames = spectrum.shape[1:3]
+    # b s f t c -> b (f s) t c
+    spectrum = spectrum.reshape(batch, channels, freqs, frames, 2).transpose(1, 2).reshape(
+        batch, freqs * channels, frames, 2)
+    selected = spectrum[:, model.freq_indices] if hasattr(model, "freq_indices") else spectrum
+    # b f t c -> b t (f c)
+    features = selected.permute(0, 2, 1, 3).reshape(batch, frames, -1)
+    return spectrum, features
+
+
+def _reconstruct(model, audio, spectrum, masks):
+    """把掩码作用到频谱上并做 ISTFT(与模型 forward 结尾的处理相同)"""
+    import torch
+
+    if audio.ndim == 2:
+        audio = audio.unsqueeze(1)
+    batch, channels, length = audio.shape
+    frames = spectrum.shape[2]
+    stems = masks.shape[1]
+    # b n t (f c) -> b n f t c
+    masks = masks.reshape(batch, stems, frames, -1, 2).transpose(2, 3)
+    spectrum = torch.view_as_complex(spectrum.contiguous()).unsqueeze(1)
+    masks = torch.view_as_complex(masks.contiguous())
+    if hasattr(model, "freq_indices"):
+        # 梅尔频带相互重叠，同一频点的掩码取各频带的平均
+        masks = masks.type(spectrum.dtype)
+        indices = model.freq_indices.view(1, 1, -1, 1).expand(batch, stems, -1, frames)
+        summed = torch.zeros(batch, stems, *spectrum.shape[2:], dtype=spectrum.dtype).scatter_add_(2, indices, masks)
+        denom = model.num_bands_per_freq.repeat_interleave(channels).unsqueeze(-1)
+        masks = summed / denom.clamp(min=1e-8)
+    spectrum = spectrum * masks
+    # b n (f s) t -> (b n s) f t
+    spectrum = spectrum.reshape(batch, stems, -1, channels, frames).transpose(2, 3).reshape(
+        batch * stems * channels, -1, frames)
+    match_length = hasattr(model, "freq_indices") and getattr(model, "match_input_audio_length", False)
+    window = model.stft_window_fn().to(audio.device)
+    recon = torch.istft(spectrum, **model.stft_kwargs, window=window, return_complex=False,
+                        length=length if match_length else None)
+    recon = recon.reshape(batch, stems, channels, -1)
+    return recon[:, 0] if stems == 1 else recon
+
+
+def _core(model):
+    """模型中频带划分到掩码估计的部分(导出为 ONNX 的部分)"""
+    import torch
+
+    class RoformerCore(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+            # BSRoformer 在掩码估计前做最终的归一化，MelBandRoformer 没有
+            self.final_norm = None if hasattr(model, "freq_indices") else model.final_norm
+
+        def forward(self, x):
+            x = self.model.band_split(x)
+            for block in self.model.layers:
+                batch, frames, bands, dim = x.shape
+                if len(block) == 3:
+                    linear_transformer, time_transformer, freq_transformer = block
+                    x = linear_transformer(x.reshape(batch, frames * bands, dim)).reshape(batch, frames, bands, dim)
+                else:
+                    time_transformer, freq_transformer = block
+                x = x.transpose(1, 2).reshape(batch * bands, frames, dim)
+                x = time_transformer(x)
+                x = x.reshape(batch, bands, frames, dim).transpose(1, 2).reshape(batch * frames, bands, dim)
+                x = freq_transformer(x)
+                x = x.reshape(batch, frames, bands, dim)
+            if self.final_norm is not None:
+                x = self.final_norm(x)
+            return torch.stack([fn(x) for fn in self.model.mask_estimators], dim=1)
+
+    return RoformerCore().eval()
@@ -0,0 +1,562 @@
+import os
+import time
+import logging
+from concurrent.futures import wait
+
+from utils.ensemble import EnsembleAccumulator, ensemble_arrays, ensemble_stream, write_audio  # 音轨合成功能
+from utils.clean_up import cleanup_temp_files  # 清理临时文件
+from utils.audio_cache import decoded_audio  # 解码后的输入音频缓存
+from utils.chunked import DEFAULT_CHUNK_OVERLAP, check_output_format, separate_chunked  # 长音频分块分离
+from utils.silence import DEFAULT_SILENCE_THRESHOLD  # 静音检测
+from utils import profiling  # 任务阶段耗时记录
+from utils.budget import plan_ensemble, runtime_history  # 按预算挑选合成模型
+from utils.registry import ModelRegistry, model_files  # 模型配置索引和模型文件索引
+from utils.metrics import service_metrics  # Prometheus指标
+from utils.result_cache import result_cache  # 分离结果缓存
+from utils.workers import get_executor, separate_file, separate_stems, share_weights, worker_memory  # 分离任务(可多进程执行)
+
+logger = logging.getLogger(__name__)
+
+# 分离与合成的核心流程，不依赖 gradio，Web 界面和命令行批处理共用
+
+_device = {}
+
+
+def use_autocast():
+    """有 CUDA 时启用 autocast(首次调用时才导入 torch)"""
+    if "autocast" not in _device:
+        import torch
+
+        _device["autocast"] = torch.cuda.is_available()
+    return _device["autocast"]
+
+
+def preload_backend():
+    """
+    导入 torch 和 audio_separator
+
+    它们只在第一次分离时才需要，界面启动后在后台线程中调用，
+    既不拖慢界面打开，又缩短第一次分离的等待。
+    """
+    start = time.perf_counter()
+    use_autocast()
+    import audio_separator.separator  # noqa: F401
+
+    logger.info(f"Model backend loaded in {time.perf_counter() - start:.1f}s")
+
+
+def _no_progress(*args, **kwargs):
+    pass
+
+
+def find_model(models, model_key):
+    """在模型配置中查找模型文件名，找不到时返回 None"""
+    if isinstance(models, ModelRegistry):
+        return models.filename(model_key)
+    for category, category_models in models.items():
+        if model_key in category_models:
+            return category_models[model_key]
+    return None
+
+
+def check_model_file(model_key, model_filename, model_dir):
+    """
+    模型文件是否已在模型目录中(查询缓存的文件索引，不逐个访问磁盘)
+
+    不存在时 audio-separator 会在加载时下载，这里提前记录日志，说明任务为何变慢。
+    """
+    if model_files.size(model_filename, model_dir) is not None:
+        return True
+    logger.warning(f"{model_key} ({model_filename}) is not in {model_dir}, it will be downloaded before separating")
+    return False
+
+
+def load_models(config_path="models.json"):
+    """从JSON文件加载可用的模型配置信息，返回带索引的 ModelRegistry"""
+    return ModelRegistry.from_file(config_path)
+
+
+def classify_stems(stems):
+    """
+    根据文件名把一个模型输出的音轨分为人声和伴奏
+
+    返回:
+        (人声轨道列表, 伴奏轨道列表)
+    """
+    vocal_stems = []
+    instrumental_stems = []
+    for stem in stems:
+        stem_lower = stem.lower()
+        stem_name = os.path.basename(stem_lower)
+
+        logger.info(f"Classifying stem: {stem_name}")
+
+        # 精确匹配伴奏关键词
+        if (
+            "(instrumental)" in stem_lower
+            or "(inst)" in stem_lower
+            or "(accompaniment)" in stem_lower
+        ):
+            instrumental_stems.append(stem)
+            logger.info("  -> Classified as INSTRUMENTAL (exact match)")
+        # 精确匹配人声关键词
+        elif (
+            "(vocals)" in stem_lower
+            or "(vocal)" in stem_lower
+            or "(voice)" in stem_lower
+        ):
+            vocal_stems.append(stem)
+            logger.info("  -> Classified as VOCAL (exact match)")
+        # 无法精确匹配时的推断策略
+        else:
+            logger.warning(
+                f"  -> Could not classify stem with certainty: {stem_name}"
+            )
+            if len(stems) > 1 and stem == stems[1]:
+                instrumental_stems.append(stem)
+                logger.info("  -> Assumed as INSTRUMENTAL (by position)")
+            else:
+                vocal_stems.append(stem)
+                logger.info("  -> Assumed as VOCAL (by position)")
+    return vocal_stems, instrumental_stems
+
+
+def ensemble_stems(stems, ensemble_method, output_file):
+    """
+    合成多个模型的同类音轨并写入文件
+
+    音轨都在内存中时直接合成；有音轨被写入内存映射临时文件(内存紧张)时，
+    使用流式合成，边读边写，峰值内存与音轨长度无关。
+    """
+    sample_rate = stems[0].sample_rate
+    if any(stem.path for stem in stems):
+        return ensemble_stream(
+            [stem.data for stem in stems], output_file, ensemble_method, sr=sample_rate
+        )
+    result = ensemble_arrays([stem.data for stem in stems], ensemble_method)
+    return write_audio(output_file, result, sample_rate)
+
+
+def release_stems(results):
+    """释放所有音轨数据的引用"""
+    for stems in results:
+        for stem in stems:
+            stem.release()
+
+
+class StemCollector:
+    """
+    按人声/伴奏收集各模型输出的音轨
+
+    avg/min/max 类方法在每个模型完成后立即折叠进累加器并释放该模型的音轨，
+    峰值内存与模型数量无关；median 类方法需要全部音轨，仍然缓冲后统一合成。
+    """
+
+    def __init__(self, ensemble_method, only_instrumental=False):
+        self.ensemble_method = ensemble_method
+        self.only_instrumental = only_instrumental
+        self.online = ensemble_method in EnsembleAccumulator.ONLINE_ALGORITHMS
+        self.accumulators = {
+            "vocals": EnsembleAccumulator(ensemble_method),
+            "instrumental": EnsembleAccumulator(ensemble_method),
+        }
+        self.buffers = {"vocals": [], "instrumental": []}
+        self.counts = {"vocals": 0, "instrumental": 0}
+        self.sample_rate = None
+
+    def add(self, stems):
+        """加入一个模型的全部音轨，在线合成时返回后即可删除其临时文件"""
+        with profiling.stage("ensemble_fold"):
+            self._add(stems)
+
+    def _add(self, stems):
+        by_name = {stem.name: stem for stem in stems}
+        vocals, instrumentals = classify_stems([stem.name for stem in stems])
+        for kind, names in (("vocals", vocals), ("instrumental", instrumentals)):
+            self.counts[kind] += len(names)
+            for name in names:
+                stem = by_name[name]
+                self.sample_rate = self.sample_rate or stem.sample_rate
+                if not self.online:
+                    self.buffers[kind].append(stem)
+                elif kind == "instrumental" or not self.only_instrumental:
+                    self.accumulators[kind].add(stem.data)
+
+        if self.online:
+            # 已折叠进累加器，释放内存映射后才能删除临时文件
+            for stem in stems:
+                stem.release()
+            cleanup_temp_files([stem.path for stem in stems if stem.path])
+
+    def write(self, kind, output_file):
+        """合成一类音轨并写入文件"""
+        with profiling.stage(f"ensemble_{kind}"):
+            if self.online:
+                return write_audio(output_file, self.accumulators[kind].result(), self.sample_rate)
+            return ensemble_stems(self.buffers[kind], self.ensemble_method, output_file)
+
+    def write_outputs(self, base_name, out_dir, out_format, progress=_no_progress):
+        """
+        合成并写出人声和伴奏
+
+        返回:
+            (人声文件路径, 伴奏文件路径)，未输出的一项为 None
+        """
+        ensemble_method = self.ensemble_method
+        only_instrumental = self.only_instrumental
+        vocal_count = self.counts["vocals"]
+        instrumental_count = self.counts["instrumental"]
+        logger.info(
+            f"Found {vocal_count} vocal stems and {instrumental_count} instrumental stems"
+        )
+
+        # 检查是否有足够的轨道进行合成
+        if (not vocal_count and not only_instrumental) or (
+            not instrumental_count and only_instrumental
+        ):
+            raise ValueError("No valid stems for ensemble.")
+
+        vocal_output = None
+        instrumental_output = None
+
+        # 合成人声轨道(如果需要)
+        if vocal_count and not only_instrumental:
+            progress(0.85, desc="Creating vocal ensemble...")
+            vocal_output_file = os.path.join(
+                out_dir, f"{base_name}_ensemble_vocals_{ensemble_method}.{out_format}"
+            )
+            vocal_output = self.write("vocals", vocal_output_file)
+            logger.info(f"Vocal ensemble saved to {vocal_output}")
+
+        # 合成伴奏轨道
+        if instrumental_count:
+            progress(0.95, desc="Creating instrumental ensemble...")
+            instrumental_output_file = os.path.join(
+                out_dir,
+                f"{base_name}_ensemble_instrumental_{ensemble_method}.{out_format}",
+            )
+            instrumental_output = self.write("instrumental", instrumental_output_file)
+            logger.info(f"Instrumental ensemble saved to {instrumental_output}")
+        return vocal_output, instrumental_output
+
+    def release(self):
+        """释放缓冲的音轨"""
+        release_stems(self.buffers.values())
+
+
+def roformer_separator(
+    audio,
+    model_key,
+    seg_size,
+    override_seg_size,
+    overlap,
+    pitch_shift,
+    model_dir,
+    out_dir,
+    out_format,
+    norm_thresh,
+    amp_thresh,
+    batch_size,
+    single_stem="",
+    chunk_seconds=0,
+    chunk_overlap=DEFAULT_CHUNK_OVERLAP,
+    parallel_workers=1,
+    torch_threads=0,
+    skip_silence=False,
+    silence_threshold=DEFAULT_SILENCE_THRESHOLD,
+    backend="torch",
+    models=None,
+    progress=_no_progress,
+):
+    """
+    使用RoFormer模型进行音频分离
+
+    参数:
+        audio: 输入音频文件路径
+        model_key: 选择的模型名称
+        seg_size: 分段大小
+        override_seg_size: 是否覆盖模型默认分段大小
+        overlap: 重叠比例
+        pitch_shift: 音高偏移
+        model_dir: 模型文件目录
+        out_dir: 输出目录
+        out_format: 输出格式
+        norm_thresh: 归一化阈值
+        amp_thresh: 放大阈值
+        batch_size: 批处理大小
+        single_stem: 仅输出单个音轨(可选)
+        chunk_seconds: 分块分离的窗口长度(秒)，0 表示整段分离
+        chunk_overlap: 相邻窗口的重叠(秒)
+        parallel_workers: 分块分离时并行的进程数
+        torch_threads: 每个进程的torch线程数，0 表示自动分配
+        skip_silence: 是否跳过静音区域(输出中对应部分为静音)
+        silence_threshold: 静音门限(dBFS)
+        backend: 推理后端(torch/onnx)
+        models: 模型配置(类别 -> 显示名称 -> 模型文件名)
+        progress: 进度回调
+
+    返回:
+        分离后的音轨文件路径(主音轨, 次音轨)和 JobProfile
+    """
+    if not audio:
+        raise ValueError("No audio file provided.")
+
+    base_name = os.path.splitext(os.path.basename(audio))[0]
+
+    # 从模型配置中查找指定模型
+    model = find_model(models, model_key)
+    if model is None:
+        raise ValueError(f"Model '{model_key}' not found.")
+
+    logger.info(f"Separating {base_name} with {model_key}")
+    if chunk_seconds or skip_silence:
+        # 拼接结果由 separate_chunked 写出，在加载模型之前确认能写出该格式
+        check_output_format(out_format)
+    check_model_file(model_key, model, model_dir)
+    try:
+        separate_kwargs = dict(
+            model_dir=model_dir,
+            output_dir=out_dir,
+            output_format=out_format,
+            norm_thresh=norm_thresh,
+            amp_thresh=amp_thresh,
+            seg_size=seg_size,
+            override_seg_size=override_seg_size,
+            overlap=overlap,
+            batch_size=batch_size,
+            use_autocast=use_autocast(),
+            pitch_shift=pitch_shift,
+            single_stem=single_stem if single_stem.strip() else None,
+            backend=backend,
+        )
+
+        computed = []
+
+        def separate():
+            computed.append(True)
+            if chunk_seconds or skip_silence:
+                # 长音频按窗口分离，可在多个进程中并行；静音区域不交给模型
+                return separate_chunked(
+                    model,
+                    audio,
+                    chunk_seconds=chunk_seconds,
+                    chunk_overlap=chunk_overlap,
+                    skip_silence=skip_silence,
+                    silence_threshold=silence_threshold,
+                    workers=parallel_workers,
+                    torch_threads=torch_threads,
+                    progress=lambda done, total: progress(
+                        done / total, desc=f"Separated chunk {done}/{total}"
+                    ),
+                    **separate_kwargs,
+                )
+            # 从模型池获取已加载的分离器，并设置本次任务的参数
+            return separate_file(model, audio, **separate_kwargs)
+
+        # 相同音频、模型和参数直接返回缓存结果
+        cache_key = result_cache.make_key(
+            audio,
+            model,
+            seg_size=seg_size,
+            override_seg_size=override_seg_size,
+            overlap=overlap,
+            pitch_shift=pitch_shift,
+            norm_thresh=norm_thresh,
+            amp_thresh=amp_thresh,
+            out_format=out_format,
+            single_stem=single_stem.strip(),
+            # 分块拼接的结果与整段分离略有不同，分块参数只在启用时计入缓存键
+            **({"chunk_seconds": chunk_seconds, "chunk_overlap": chunk_overlap} if chunk_seconds else {}),
+            **({"silence_threshold": silence_threshold} if skip_silence else {}),
+            # 其他后端的结果与 torch 略有差异
+            **({"backend": backend} if backend != "torch" else {}),
+        )
+        with profiling.job(
+            "separation", audio, model=model_key, chunk_seconds=chunk_seconds, workers=parallel_workers,
+            backend=backend,
+        ) as profile:
+            if backend != "torch":
+                # 与本机 torch 路径的历史实时率对比
+                profile.info["torch_rtf"] = runtime_history.rtf("torch").get(model_key)
+            stems = result_cache.get_or_compute(cache_key, base_name, out_dir, separate)
+            if not computed:
+                # 缓存命中的耗时不代表推理速度，指标和历史实时率中不计入
+                profile.info["cached"] = True
+
+        # 返回结果(通常为人声和伴奏)
+        return stems[0], (
+            stems[1] if len(stems) > 1 and not single_stem.strip() else None
+        ), profile
+    except Exception as e:
+        logger.error(f"Separation failed: {e}")
+        raise RuntimeError(f"Separation failed: {e}")
+
+def auto_ensemble_process(
+    audio,
+    model_keys,
+    seg_size,
+    overlap,
+    out_format,
+    use_tta,
+    model_dir,
+    out_dir,
+    norm_thresh,
+    amp_thresh,
+    batch_size,
+    ensemble_method,
+    only_instrumental,
+    parallel_workers=1,
+    torch_threads=0,
+    budget_models=0,
+    budget_seconds=0,
+    backend="torch",
+    models=None,
+    progress=_no_progress,
+):
+    """
+    使用多个模型进行分离并合成结果
+
+    参数:
+        audio: 输入音频文件路径
+        model_keys: 要使用的模型列表
+        seg_size: 分段大小
+        overlap: 重叠比例
+        out_format: 输出格式
+        use_tta: 是否使用测试时增强
+        model_dir: 模型文件目录
+        out_dir: 输出目录
+        norm_thresh: 归一化阈值
+        amp_thresh: 放大阈值
+        batch_size: 批处理大小
+        ensemble_method: 合成方法(mean/max)
+        only_instrumental: 是否只输出伴奏轨道
+        parallel_workers: 并行分离的进程数，1 表示依次执行
+        torch_threads: 每个进程的torch线程数，0 表示自动分配
+        budget_models: 最多运行的模型数，0 表示全部运行
+        budget_seconds: 估计总耗时上限(秒)，0 表示不限；设置预算时按评测分数挑选预算内效果最好的模型
+        backend: 推理后端(torch/onnx)
+        models: 模型配置(类别 -> 显示名称 -> 模型文件名)
+        progress: 进度回调
+
+    返回:
+        合成后的人声和伴奏文件路径和 JobProfile
+    """
+    if not audio or not model_keys:
+        raise ValueError("Audio or models missing.")
+    
+    base_name = os.path.splitext(os.path.basename(audio))[0]
+    logger.info(f"Ensemble for {base_name} with {model_keys}")
+
+    # 创建临时目录存放中间结果
+    temp_dir = os.path.join(out_dir, "tmp")
+    os.makedirs(temp_dir, exist_ok=True)
+    service_metrics.watch_temp_dir(temp_dir)
+    logger.info(f"Created temporary directory: {temp_dir}")
+
+    temp_files = []  # 用于跟踪需要清理的临时文件
+    collector = StemCollector(ensemble_method, only_instrumental)  # 人声/伴奏音轨的合成状态
+    total_models = len(model_keys)
+
+    with profiling.job(
+        "ensemble", audio, models=model_keys, method=ensemble_method, workers=parallel_workers, backend=backend
+    ) as profile:
+        try:
+            # 查找每个模型对应的文件，跳过未知模型
+            selected_models = []
+            for model_key in model_keys:
+                model = find_model(models, model_key)
+                if model is not None:
+                    selected_models.append((model_key, model))
+
+            # 按预算只运行估计效果最好的部分模型
+            selected_models, plan = plan_ensemble(
+                selected_models, audio, only_instrumental, budget_models, budget_seconds, backend=backend
+            )
+            if plan is not None:
+                profile.info.update(plan)
+            if backend != "torch":
+                torch_rtf = runtime_history.rtf("torch")
+                if all(model_key in torch_rtf for model_key, _ in selected_models):
+                    profile.info["torch_rtf"] = sum(torch_rtf[model_key] for model_key, _ in selected_models)
+            total_models = len(selected_models)
+            for model_key, model in selected_models:
+                check_model_file(model_key, model, model_dir)
+
+            separate_kwargs = dict(
+                model_dir=model_dir,
+                norm_thresh=norm_thresh,
+                amp_thresh=amp_thresh,
+                seg_size=seg_size,
+                override_seg_size=False,
+                overlap=overlap,
+                batch_size=batch_size,
+                use_autocast=use_autocast(),
+                use_tta=use_tta,
+                spill_dir=temp_dir,
+                backend=backend,
+            )
+
+            # 分离结果以 float32 数组交给合成，内存不足时写入内存映射临时文件，
+            # 只有最终合成结果才会编码成用户选择的格式
+            if parallel_workers > 1 and len(selected_models) > 1:
+                # 多进程并行分离，结果按模型顺序折叠，保证与串行输出一致
+                progress(0.1, desc=f"Separating with {len(selected_models)} models in parallel")
+                # 先在主进程解码一次，各工作进程直接映射同一份解码结果
+                decoded_audio.load(audio)
+                # 权重也只在主进程读取一次，工作进程映射同一份缓存
+                share_weights([model for _, model in selected_models], model_dir)
+                executor = get_executor(parallel_workers, torch_threads)
+                futures = [
+                    executor.submit(
+                        profiling.run_profiled, "separate_model", separate_stems, model, audio,
+                        memory_budget=0, **separate_kwargs,
+                    )
+                    for _, model in selected_models
+                ]
+                for i, ((model_key, _), future) in enumerate(zip(selected_models, futures)):
+                    try:
+                        stems, stages = future.result()
+                    except Exception as e:
+                        # 等待其余任务结束，记录它们的临时文件以便清理
+                        wait(futures)
+                        for other in futures:
+                            if other.exception() is None:
+                                temp_files.extend(stem.path for stem in other.result()[0] if stem.path)
+                        raise RuntimeError(f"{model_key}: {e}")
+                    profile.merge(stages, model=model_key)
+                    temp_files.extend(stem.path for stem in stems if stem.path)
+                    collector.add(stems)
+                    progress(0.1 + (0.8 / total_models) * (i + 1), desc=f"Separated with {model_key}")
+                profile.info["worker_memory"] = {str(pid): usage for pid, usage in worker_memory().items()}
+            else:
+                # 使用每个模型依次处理音频
+                for i, (model_key, model) in enumerate(selected_models):
+                    progress(
+                        0.1 + (0.8 / total_models) * i, desc=f"Separating with {model_key}"
+                    )
+                    stems, stages = profiling.run_profiled(
+                        "separate_model", separate_stems, model, audio, **separate_kwargs
+                    )
+                    profile.merge(stages, model=model_key)
+                    temp_files.extend(stem.path for stem in stems if stem.path)
+                    collector.add(stems)
+
+            vocal_output, instrumental_output = collector.write_outputs(
+                base_name, out_dir, out_format, progress
+            )
+
+            # 释放内存映射后才能删除临时文件
+            collector.release()
+            progress(0.98, desc="Cleaning up temporary files...")
+            progress(1.0, desc="Ensemble complete")
+            with profiling.stage("cleanup"):
+                cleanup_temp_files(temp_files, temp_dir)
+
+        except Exception as e:
+            logger.error(f"Ensemble failed: {e}")
+            collector.release()
+            cleanup_temp_files(temp_files, temp_dir)
+            raise RuntimeError(f"Ensemble failed: {e}")
+
+    # 返回处理结果
+    return vocal_output, instrumental_output, profile
@@ -0,0 +1,344 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 每个任务的阶段耗时以 JSON 行追加到该文件，设为空字符串时不写
+DEFAULT_METRICS_LOG = os.environ.get("SEPARATION_METRICS_LOG", os.path.join("logs", "metrics.jsonl"))
+
+_current = contextvars.ContextVar("job_profile", default=None)
+_log_lock = threading.Lock()
+_config = {"metrics_log": DEFAULT_METRICS_LOG}
+_listeners = []  # 任务结束时调用，参数为任务记录字典
+_active = {}  # 任务类型 -> 正在执行的数量
+
+
+def configure(metrics_log=None):
+    """设置任务指标日志路径，空字符串表示不写日志"""
+    if metrics_log is not None:
+        _config["metrics_log"] = metrics_log
+
+
+def metrics_log_path():
+    """当前的任务指标日志路径，空字符串表示不写日志"""
+    return _config["metrics_log"]
+
+
+def add_listener(callback):
+    """注册任务结束回调，callback(record) 在每个任务写完指标日志后调用"""
+    _listeners.append(callback)
+
+
+def active_jobs():
+    """各类型正在执行的任务数量"""
+    with _log_lock:
+        return dict(_active)
+
+
+def peak_rss():
+    """当前进程的峰值内存(字节)，无法获取时返回 None"""
+    try:
+        import resource
+
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 单位为字节，Linux 为 KB
+        return usage if sys.platform == "darwin" else usage * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    except ImportError:
+        return None
+
+
+def audio_duration(path):
+    """音频时长(秒)，无法读取时返回 None"""
+    try:
+        import soundfile as sf
+
+        return sf.info(path).duration
+    except Exception:
+        pass
+    try:
+        import librosa
+
+        return librosa.get_duration(path=path)
+    except Exception:
+        return None
+
+
+class JobProfile:
+    """
+    一个分离或合成任务的各阶段耗时记录
+
+    每个阶段记录墙钟时间、CPU 时间(执行该阶段的进程)和阶段结束时的进程峰值内存。
+    阶段可以嵌套，同名同层的阶段(例如每个音轨的编码)累加为一条，并记录次数。
+    """
+
+    def __init__(self, job_type, audio=None, **info):
+        self.job_type = job_type
+        self.audio = audio
+        self.info = info
+        self.duration = audio_duration(audio) if audio else None
+        self.stages = []
+        self._index = {}
+        self._depth = 0
+        self._lock = threading.Lock()
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.wall_time = None
+        self.cpu_time = None
+        self.error = None
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """记录一个阶段的耗时"""
+        with self._lock:
+            depth = self._depth
+            self._depth += 1
+            # 进入时登记，保证外层阶段排在内层阶段之前
+            self._entry(name, depth, labels)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._depth -= 1
+            self.add_stage(
+                name,
+                wall=time.perf_counter() - wall_start,
+                cpu=time.process_time() - cpu_start,
+                peak_rss=peak_rss(),
+                depth=depth,
+                **labels,
+            )
+
+    def _entry(self, name, depth, labels):
+        """查找或创建阶段记录(调用方需持有锁)"""
+        key = (name, depth, tuple(sorted(labels.items())))
+        stage = self._index.get(key)
+        if stage is None:
+            stage = dict(name=name, depth=depth, wall=0.0, cpu=0.0, peak_rss=None, count=0, **labels)
+            self._index[key] = stage
+            self.stages.append(stage)
+        return stage
+
+    def add_stage(self, name, wall, cpu, peak_rss=None, depth=0, count=1, **labels):
+        """加入一条阶段记录，同名同层同标签的记录累加"""
+        with self._lock:
+            stage = self._entry(name, depth, labels)
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+            stage["count"] += count
+            if peak_rss is not None:
+                stage["peak_rss"] = max(stage["peak_rss"] or 0, peak_rss)
+
+    def merge(self, stages, depth=0, **labels):
+        """合并其他进程记录的阶段，depth 为其外层阶段的层级"""
+        for stage in stages:
+            stage = dict(stage)
+            name = stage.pop("name")
+            wall = stage.pop("wall")
+            cpu = stage.pop("cpu")
+            rss = stage.pop("peak_rss")
+            count = stage.pop("count")
+            stage_depth = stage.pop("depth") + depth
+            stage.update(labels)
+            self.add_stage(name, wall, cpu, rss, stage_depth, count, **stage)
+
+    def finish(self, error=None):
+        """结束计时并写入指标日志"""
+        self.wall_time = time.perf_counter() - self.start
+        self.cpu_time = time.process_time() - self.cpu_start
+        self.error = str(error) if error is not None else None
+        record = self.to_dict()
+        path = _config["metrics_log"]
+        if path:
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                line = json.dumps(record, ensure_ascii=False, default=str)
+                with _log_lock, open(path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logger.warning(f"Failed to write metrics log {path}: {e}")
+        for callback in _listeners:
+            try:
+                callback(record)
+            except Exception as e:
+                logger.warning(f"Job listener failed: {e}")
+        logger.info(
+            f"{self.job_type} finished in {self.wall_time:.2f}s"
+            + (f" (RTF {record['rtf']:.3f})" if record["rtf"] is not None else "")
+        )
+        return record
+
+    def rtf(self, wall):
+        """实时率: 处理耗时 / 音频时长，小于 1 表示快于实时"""
+        if not self.duration or wall is None:
+            return None
+        return wall / self.duration
+
+    def to_dict(self):
+        return {
+            "job": self.job_type,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start_time)),
+            "audio": os.path.basename(self.audio) if self.audio else None,
+            "audio_duration": self.duration,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_rss": peak_rss(),
+            "rtf": self.rtf(self.wall_time),
+            "error": self.error,
+            **self.info,
+            "stages": [dict(stage, rtf=self.rtf(stage["wall"])) for stage in self.stages],
+        }
+
+    def summary_markdown(self):
+        """生成在界面中显示的耗时明细表"""
+        lines = []
+        if self.wall_time is not None:
+            total = f"**Total**: {self.wall_time:.2f}s"
+            if self.duration:
+                total += f" · audio {self.duration:.1f}s · RTF {self.rtf(self.wall_time):.3f}"
+            lines += [total, ""]
+        if self.info.get("cached"):
+            lines += ["**Cached**: result reused from the separation cache, no inference was run", ""]
+        if self.info.get("silence_skipped"):
+            lines += [
+                f"**Silence skipped**: {self.info['silence_skipped']:.1%} of audio"
+                f" · saved ~{self.info['time_saved']:.1f}s",
+                "",
+            ]
+        if self.info.get("passes_saved"):
+            budget = f"**Budget**: skipped {self.info['passes_saved']} inference passes"
+            skipped = []
+            if self.info.get("pruned_models"):
+                skipped.append(f"pruned: {', '.join(self.info['pruned_models'])}")
+            if self.info.get("unscored_models"):
+                skipped.append(f"no scores: {', '.join(self.info['unscored_models'])}")
+            budget += f" ({'; '.join(skipped)})"
+            if not self.info.get("scores_available", True):
+                budget += " · no benchmark scores, kept the first selected models"
+            if self.info.get("estimated_seconds_saved"):
+                budget += f" · saved ~{self.info['estimated_seconds_saved']:.1f}s"
+            lines += [budget, ""]
+        if self.info.get("backend", "torch") != "torch" and not self.info.get("cached"):
+            line = f"**Backend**: {self.info['backend']}"
+            rtf = self.rtf(self.wall_time)
+            if rtf:
+                line += f" · RTF {rtf:.3f}"
+                if self.info.get("torch_rtf"):
+                    line += f" vs {self.info['torch_rtf']:.3f} with torch ({self.info['torch_rtf'] / rtf:.2f}x)"
+                else:
+                    line += " (no torch runs of these models recorded yet)"
+            lines += [line, ""]
+        if self.info.get("worker_memory"):
+            usages = list(self.info["worker_memory"].values())
+            average = {key: sum(usage[key] for usage in usages) / len(usages) / 1024**2 for key in usages[0]}
+            lines += [
+                f"**Workers**: {len(usages)} processes · RSS {average['rss']:.0f} MB each"
+                f" ({average['shared']:.0f} MB shared, {average['private']:.0f} MB private)",
+                "",
+            ]
+        lines += [
+            "| Stage | Wall (s) | CPU (s) | Peak RSS (MB) | RTF |",
+            "|---|---:|---:|---:|---:|",
+        ]
+        for stage in self.stages:
+            label = "&nbsp;&nbsp;&nbsp;&nbsp;" * stage["depth"] + stage["name"]
+            if stage.get("model"):
+                label += f" ({stage['model']})"
+            if stage["count"] > 1:
+                label += f" ×{stage['count']}"
+            rss = f"{stage['peak_rss'] / 1024**2:.0f}" if stage["peak_rss"] else "-"
+            rtf = self.rtf(stage["wall"])
+            lines.append(
+                f"| {label} | {stage['wall']:.2f} | {stage['cpu']:.2f} | {rss} | "
+                + (f"{rtf:.3f}" if rtf is not None else "-")
+                + " |"
+            )
+        return "\n".join(lines)
+
+
+@contextmanager
+def job(job_type, audio=None, **info):
+    """
+    在上下文中记录一个任务，结束时写入指标日志
+
+    用法:
+        with job("separation", audio, model=model_key) as profile:
+            with stage("separate"):
+                ...
+        profile.summary_markdown()
+    """
+    profile = JobProfile(job_type, audio, **info)
+    token = _current.set(profile)
+    with _log_lock:
+        _active[job_type] = _active.get(job_type, 0) + 1
+    try:
+        yield profile
+    except BaseException as e:
+        profile.finish(error=e)
+        raise
+    else:
+        profile.finish()
+    finally:
+        with _log_lock:
+            _active[job_type] -= 1
+        _current.reset(token)
+
+
+def current():
+    """当前任务的 JobProfile，没有任务时返回 None"""
+    return _current.get()
+
+
+@contextmanager
+def stage(name, **labels):
+    """记录当前任务的一个阶段，没有任务时不做任何事"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    with profile.stage(name, **labels):
+        yield
+
+
+def timed(name, func):
+    """包装函数，每次调用都记为当前任务的一个阶段"""
+
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def run_profiled(name, func, *args, **kwargs):
+    """
+    执行函数并把整个调用记为一个阶段，可在工作进程中使用
+
+    返回:
+        (函数返回值, 阶段记录列表)，由主进程用 JobProfile.merge 合并
+    """
+    profile = JobProfile("worker")
+    token = _current.set(profile)
+    try:
+        with profile.stage(name):
+            result = func(*args, **kwargs)
+    finally:
+        _current.reset(token)
+    return result, profile.stages
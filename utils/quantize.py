@@ -0,0 +1,144 @@
+import os
+import copy
+import json
+import logging
+import threading
+import itertools
+
+from utils import profiling
+from utils.weight_cache import source_signature
+
+logger = logging.getLogger(__name__)
+
+# 量化后的模型保存在模型目录下的该子目录中
+CACHE_SUBDIR = ".quantized_cache"
+CACHE_VERSION = 1
+
+
+def build(instance):
+    """
+    为分离器的模型创建动态 int8 量化副本，失败时返回 None
+
+    返回:
+        量化后的模型，可直接替换 model_run
+    """
+    try:
+        return quantized_model(instance.model_run, instance.model_path)
+    except Exception as e:
+        logger.warning(f"Failed to quantize {instance.model_name}, using torch: {e}")
+        return None
+
+
+def cache_paths(checkpoint_path):
+    directory = os.path.join(os.path.dirname(checkpoint_path), CACHE_SUBDIR)
+    base = os.path.join(directory, os.path.basename(checkpoint_path) + ".int8")
+    return base + ".json", base + ".pt"
+
+
+def quantized_model(model, checkpoint_path):
+    """
+    返回模型的动态 int8 量化副本
+
+    所有线性层(包括注意力的 qkv、输出和门控投影)的权重以 int8 保存，激活在运行时按输入动态量化；
+    其余参数(归一化、旋转位置编码等)与原模型共用同一份张量，原模型不变，仍可用于 torch 后端。
+    第一次量化后把结果保存到 <模型目录>/.quantized_cache/，源检查点未变化时直接读取。
+
+    参数:
+        model: 已加载权重的 torch 模块
+        checkpoint_path: 检查点路径，用于缓存位置和失效判断
+    """
+    import torch
+
+    # 复制模块结构但不复制参数，线性层随后整体替换
+    shared = {id(tensor): tensor for tensor in itertools.chain(model.parameters(), model.buffers())}
+    quantized = copy.deepcopy(model, shared)
+    meta_path, data_path = cache_paths(checkpoint_path)
+    if _cached(meta_path, data_path, checkpoint_path):
+        try:
+            with profiling.stage("load_quantized"):
+                _swap_linear(quantized)
+                quantized.load_state_dict(torch.load(data_path, map_location="cpu", weights_only=True, mmap=True))
+            return quantized.eval()
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"Ignoring quantized cache of {os.path.basename(checkpoint_path)}: {e}")
+            quantized = copy.deepcopy(model, shared)
+
+    with profiling.stage("quantize"):
+        torch.ao.quantization.quantize_dynamic(quantized, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    try:
+        _save(quantized, meta_path, data_path, checkpoint_path)
+    except OSError as e:
+        logger.warning(f"Failed to cache quantized {os.path.basename(checkpoint_path)}: {e}")
+    return quantized.eval()
+
+
+def _swap_linear(module):
+    """
+    把线性层换成空的动态量化线性层，供 load_state_dict 读入缓存的量化权重
+
+    按 1x1 创建再改写形状属性，避免为每层打包一份全零权重；实际权重由缓存中已打包的参数替换。
+    """
+    import torch
+    from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+
+    for name, child in module.named_children():
+        if type(child) is torch.nn.Linear:
+            layer = DynamicQuantizedLinear(1, 1, bias_=child.bias is not None, dtype=torch.qint8)
+            layer.in_features, layer.out_features = child.in_features, child.out_features
+            setattr(module, name, layer)
+        else:
+            _swap_linear(child)
+
+
+def _cached(meta_path, data_path, checkpoint_path):
+    if not os.path.exists(meta_path) or not os.path.exists(data_path):
+        return False
+    try:
+        import torch
+
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        # 打包格式与 torch 版本和量化引擎有关
+        if meta.get("version") != CACHE_VERSION or meta.get("torch") != torch.__version__ \
+                or meta.get("engine") != torch.backends.quantized.engine:
+            return False
+        source = source_signature(checkpoint_path, with_hash=False)
+        cached = meta["source"]
+        if source["size"] != cached["size"]:
+            return False
+        return source["mtime_ns"] == cached["mtime_ns"] or source_signature(checkpoint_path)["hash"] == cached["hash"]
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def _save(quantized, meta_path, data_path, checkpoint_path):
+    """先写临时文件再替换"""
+    import torch
+
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    torch.save(quantized.state_dict(), data_path + suffix)
+    os.replace(data_path + suffix, data_path)
+    meta = {
+        "version": CACHE_VERSION,
+        "source": source_signature(checkpoint_path),
+        "torch": torch.__version__,
+        "engine": torch.backends.quantized.engine,
+    }
+    with open(meta_path + suffix, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(meta_path + suffix, meta_path)
+    logger.info(f"Cached quantized {os.path.basename(checkpoint_path)} ({os.path.getsize(data_path) / 1024**2:.0f} MB)")
+
+
+def sdr(reference, estimate):
+    """以 reference 为参考的信噪比(dB)，两者完全相同时为 inf"""
+    import numpy as np
+
+    reference = np.asarray(reference, dtype=np.float64)
+    length = min(reference.shape[-1], estimate.shape[-1])
+    reference = reference[..., :length]
+    error = np.sum((reference - np.asarray(estimate, dtype=np.float64)[..., :length]) ** 2)
+    if error == 0:
+        return float("inf")
+    return float(10 * np.log10(np.sum(reference ** 2) / error))
@@ -0,0 +1,172 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 模型配置: 类别 -> 显示名称 -> 模型文件名
+MODELS_FILE = os.path.join("models_info", "models.json")
+
+
+class ModelRegistry(dict):
+    """
+    模型配置(类别 -> {显示名称: 模型文件名})，同时维护显示名称到文件名和类别的索引
+
+    可以当作普通字典传给界面和流程函数；修改配置需调用 load()，以便重建索引。
+    """
+
+    def __init__(self, models=None):
+        super().__init__(models or {})
+        self._rebuild()
+
+    @classmethod
+    def from_file(cls, config_path=MODELS_FILE):
+        registry = cls()
+        registry.load(config_path)
+        return registry
+
+    def load(self, config_path=MODELS_FILE):
+        """从 JSON 文件(重新)加载模型配置"""
+        with open(config_path, "r", encoding="utf-8") as f:
+            models = json.load(f)
+        self.clear()
+        self.update(models)
+        self._rebuild()
+        return self
+
+    def _rebuild(self):
+        self._filenames = {}
+        self._categories = {}
+        for category, category_models in self.items():
+            for model_key, model_filename in category_models.items():
+                # 同名模型出现在多个类别时使用第一个，与逐个类别查找的结果一致
+                self._filenames.setdefault(model_key, model_filename)
+                self._categories.setdefault(model_key, category)
+
+    def filename(self, model_key):
+        """显示名称对应的模型文件名，找不到时返回 None"""
+        return self._filenames.get(model_key)
+
+    def category(self, model_key):
+        """显示名称所属的类别，找不到时返回 None"""
+        return self._categories.get(model_key)
+
+    def filenames(self):
+        """全部模型文件名(去重，保持配置中的顺序)"""
+        return list(dict.fromkeys(self._filenames.values()))
+
+    def available(self, model_dir):
+        """{显示名称: 文件大小}，只包含模型文件已存在的模型"""
+        present = model_files.scan(model_dir)
+        return {
+            model_key: present[model_filename]
+            for model_key, model_filename in self._filenames.items()
+            if model_filename in present
+        }
+
+    def missing(self, model_keys, model_dir):
+        """model_keys 中模型文件还不存在的模型"""
+        present = model_files.scan(model_dir)
+        return [model_key for model_key in model_keys if self.filename(model_key) not in present]
+
+
+class ModelFiles:
+    """
+    模型目录中已有文件及其大小的索引
+
+    按目录的修改时间缓存扫描结果，文件增删或改名(包括下载完成时的替换)后才重新扫描，
+    查询模型是否存在不必每次访问磁盘。
+    """
+
+    def __init__(self):
+        self._cache = {}  # 目录绝对路径 -> (目录修改时间, {文件名: 大小})
+        self._lock = threading.Lock()
+        self.scans = 0
+
+    def scan(self, model_dir):
+        """
+        返回:
+            {文件名: 大小}，目录不存在时为空字典
+        """
+        directory = os.path.abspath(model_dir)
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return {}
+        with self._lock:
+            cached = self._cache.get(directory)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+        files = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    # 下载中的 .part 文件不算已存在
+                    if entry.name.endswith((".part", ".tmp")):
+                        continue
+                    try:
+                        if entry.is_file():
+                            files[entry.name] = entry.stat().st_size
+                    except OSError:
+                        pass
+        except OSError:
+            return {}
+        with self._lock:
+            self._cache[directory] = (mtime, files)
+            self.scans += 1
+        return files
+
+    def size(self, model_filename, model_dir):
+        """模型文件大小，文件不存在时返回 None"""
+        return self.scan(model_dir).get(model_filename)
+
+    def invalidate(self, model_dir=None):
+        """丢弃缓存，下次查询时重新扫描"""
+        with self._lock:
+            if model_dir is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(os.path.abspath(model_dir), None)
+
+
+def preload(model_keys, models, model_dir, seg_size, override_seg_size, batch_size, warm=True):
+    """
+    把模型加载进模型池并用一段静音预热，之后使用相同参数的任务不必再加载
+
+    在调用线程中依次执行，启动时应放到后台线程中。模型文件不存在时
+    audio-separator 会先下载。
+
+    参数:
+        model_keys: 模型显示名称或文件名列表
+        models: 模型配置
+        model_dir: 模型文件目录
+        seg_size, override_seg_size, batch_size: 与任务一致的加载参数(模型池按它们区分实例)
+        warm: 加载后是否跑一次推理预热
+
+    返回:
+        成功加载的模型显示名称列表
+    """
+    from utils.model_pool import model_pool
+    from utils.pipeline import find_model, use_autocast
+
+    if model_pool.max_models and len(model_keys) > model_pool.max_models:
+        logger.warning(
+            f"Preloading {len(model_keys)} models but the pool keeps {model_pool.max_models}, "
+            f"the earliest ones will be evicted; raise --pool-size"
+        )
+    loaded = []
+    for model_key in model_keys:
+        model_filename = find_model(models, model_key) or model_key
+        try:
+            model_pool.preload(
+                model_filename, model_dir, seg_size, override_seg_size, batch_size, use_autocast(), warm=warm
+            )
+            loaded.append(model_key)
+        except Exception as e:
+            logger.warning(f"Failed to preload {model_key}: {e}")
+    return loaded
+
+
+# 进程级共享的模型文件索引
+model_files = ModelFiles()
@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 默认缓存目录和容量，可通过环境变量或命令行参数覆盖
+DEFAULT_CACHE_DIR = os.environ.get("SEPARATION_CACHE_DIR", os.path.join("cache", "results"))
+DEFAULT_MAX_BYTES = int(os.environ.get("SEPARATION_CACHE_MAX_BYTES", 4 * 1024**3))
+
+# 缓存格式版本，输出语义变化时递增使旧缓存失效
+CACHE_VERSION = 1
+META_FILE = "meta.json"
+
+
+# 已计算过的文件哈希，按路径、大小和修改时间记录，文件不变时不重复读取
+_digest_memo = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """计算文件内容的 SHA-256"""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        cached = _digest_memo.get(memo_key)
+    if cached is not None:
+        return cached
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    result = digest.hexdigest()
+    with _digest_lock:
+        _digest_memo[memo_key] = result
+    return result
+
+
+class ResultCache:
+    """
+    以内容哈希为键的分离结果磁盘缓存
+
+    键由输入音频内容、模型文件名和所有影响输出的参数组成，
+    超出容量时按最近访问时间淘汰。同一键的并发请求只计算一次。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        self._lock = threading.Lock()
+        self._inflight = {}  # 键 -> Event
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, cache_dir=None, max_bytes=None):
+        """调整缓存目录和容量，max_bytes 为 0 时禁用缓存"""
+        if cache_dir is not None:
+            self.cache_dir = cache_dir
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+            self.enabled = max_bytes > 0
+
+    def make_key(self, audio, model_filename, **params):
+        """根据音频内容、模型和输出参数生成缓存键"""
+        payload = {
+            "version": CACHE_VERSION,
+            "audio": file_digest(audio),
+            "model": model_filename,
+            "params": params,
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get_or_compute(self, key, base_name, out_dir, compute):
+        """
+        返回缓存的音轨，未命中时调用 compute 计算并写入缓存
+
+        参数:
+            key: make_key 生成的缓存键
+            base_name: 本次输入的文件名(不含扩展名)，用于命名输出
+            out_dir: 输出目录
+            compute: 无参函数，返回输出文件路径列表
+
+        返回:
+            输出文件路径列表
+        """
+        if not self.enabled:
+            return compute()
+
+        while True:
+            stems = self.get(key, base_name, out_dir)
+            if stems is not None:
+                return stems
+            with self._lock:
+                pending = self._inflight.get(key)
+                if pending is None:
+                    pending = self._inflight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # 相同任务正在计算，等待其完成后重新读取缓存
+            logger.info(f"Waiting for in-flight separation: {key[:12]}")
+            pending.wait()
+
+        try:
+            stems = compute()
+            self.put(key, base_name, stems)
+            return stems
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending.set()
+
+    def get(self, key, base_name, out_dir):
+        """命中时把缓存的音轨复制到输出目录并返回路径，否则返回 None"""
+        entry_dir = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(entry_dir, META_FILE)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        os.makedirs(out_dir, exist_ok=True)
+        stems = []
+        try:
+            for name in meta["stems"]:
+                target = os.path.join(out_dir, _rename_stem(name, meta["base_name"], base_name))
+                _copy_file(os.path.join(entry_dir, name), target)
+                stems.append(target)
+        except OSError as e:
+            logger.warning(f"Result cache entry {key[:12]} is damaged, dropping it: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        # 更新访问时间用于 LRU
+        os.utime(meta_path)
+        with self._lock:
+            self.hits += 1
+        logger.info(f"Result cache hit: {key[:12]} (hits={self.hits}, misses={self.misses})")
+        return stems
+
+    def put(self, key, base_name, stems):
+        """把输出音轨写入缓存，只有全部文件都存在时才缓存"""
+        if not stems or not all(os.path.isfile(stem) for stem in stems):
+            logger.info(f"Skip caching {key[:12]}: some stems were not written")
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry_dir = os.path.join(self.cache_dir, key)
+        staging_dir = f"{entry_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        try:
+            names = []
+            for stem in stems:
+                name = os.path.basename(stem)
+                _copy_file(stem, os.path.join(staging_dir, name))
+                names.append(name)
+            meta = {"base_name": base_name, "stems": names, "created": time.time()}
+            with open(os.path.join(staging_dir, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(staging_dir, entry_dir)
+        except OSError as e:
+            logger.warning(f"Failed to write result cache entry {key[:12]}: {e}")
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return
+
+        logger.info(f"Result cache stored: {key[:12]}")
+        self.evict()
+
+    def evict(self):
+        """按最近访问时间淘汰，直到总大小不超过预算"""
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            entry_dir = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(entry_dir, META_FILE)
+            if not os.path.isfile(meta_path):
+                continue
+            size = _dir_size(entry_dir)
+            entries.append((os.path.getmtime(meta_path), size, entry_dir))
+            total += size
+
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+            logger.info(f"Result cache evicted: {os.path.basename(entry_dir)[:12]}")
+
+    def stats(self):
+        """返回缓存的计数信息"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "enabled": self.enabled,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def _rename_stem(name, old_base, new_base):
+    """把缓存中的文件名前缀替换为本次输入的文件名"""
+    if old_base != new_base and name.startswith(old_base):
+        return new_base + name[len(old_base):]
+    return name
+
+
+def _copy_file(src, dst):
+    """
+    复制文件
+
+    不使用硬链接: 分离器会原地覆盖同名输出文件，共享 inode 会破坏缓存内容。
+    """
+    shutil.copyfile(src, dst)
+
+
+def _dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file():
+            total += entry.stat().st_size
+    return total
+
+
+# 进程级共享的结果缓存
+result_cache = ResultCache()
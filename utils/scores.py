@@ -0,0 +1,388 @@
+import os
+import json
+import math
+import itertools
+import time
+import logging
+import warnings
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 模型评测分数(各测试曲目的 SDR/SIR/SAR/ISR)和预编译的索引
+SCORES_FILE = os.path.join("models_info", "models-scores.json")
+INDEX_FILE = os.path.join("models_info", "scores_index")  # .json 元数据 + .f32 数据
+
+METRICS = ("SDR", "SIR", "SAR", "ISR")
+STATS = ("median", "mean", "p25", "p75", "count")
+INDEX_VERSION = 2
+# 组合推荐时至少需要的共同测试曲目数
+MIN_COMMON_TRACKS = 5
+# 按预算挑选组合时最多枚举的组合数，候选过多时只在单模型分数最高的几个中挑选
+MAX_SUBSETS = 4096
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def build_index(scores_path=SCORES_FILE, index_path=INDEX_FILE):
+    """
+    把 models-scores.json 编译为紧凑的分数索引
+
+    索引包含两个 float32 数组，写入同一个原始文件后以内存映射读取:
+        stats:  (模型, 音轨类型, 指标, 统计量)，统计量为 STATS 中的中位数、均值、分位数和曲目数
+        tracks: (模型, 测试曲目, 音轨类型, 指标)，每首测试曲目的分数，用于估计组合效果
+    缺失的分数为 NaN。元数据(名称列表、形状和源文件签名)写入 .json。
+
+    返回:
+        索引元数据
+    """
+    start = time.perf_counter()
+    with open(scores_path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+
+    models = sorted(raw)
+    stems = sorted({
+        stem
+        for info in raw.values()
+        for track in info["track_scores"]
+        for stem, scores in track["scores"].items()
+        if isinstance(scores, dict)
+    } | {
+        stem
+        for info in raw.values()
+        for stem, scores in info.get("median_scores", {}).items()
+        if isinstance(scores, dict)
+    })
+    tracks = sorted({track["track_name"] for info in raw.values() for track in info["track_scores"]})
+    stem_index = {stem: i for i, stem in enumerate(stems)}
+    track_index = {name: i for i, name in enumerate(tracks)}
+
+    per_track = np.full((len(models), len(tracks), len(stems), len(METRICS)), np.nan, dtype=np.float32)
+    for m, model in enumerate(models):
+        for track in raw[model]["track_scores"]:
+            t = track_index[track["track_name"]]
+            for stem, scores in track["scores"].items():
+                # 个别条目混有非分数字段(例如处理速度)
+                if not isinstance(scores, dict):
+                    continue
+                per_track[m, t, stem_index[stem]] = [scores.get(metric, np.nan) for metric in METRICS]
+
+    with warnings.catch_warnings():
+        # 没有曲目分数的模型/音轨组合是全 NaN 切片，结果为 NaN 即可
+        warnings.simplefilter("ignore", RuntimeWarning)
+        stats = np.stack([
+            np.nanmedian(per_track, axis=1),
+            np.nanmean(per_track, axis=1),
+            np.nanpercentile(per_track, 25, axis=1),
+            np.nanpercentile(per_track, 75, axis=1),
+            np.sum(~np.isnan(per_track), axis=1).astype(np.float32),
+        ], axis=-1).astype(np.float32)
+
+    # 只有汇总分数、没有逐曲目分数的模型使用原文件中的中位数
+    for m, model in enumerate(models):
+        for stem, scores in raw[model].get("median_scores", {}).items():
+            if not isinstance(scores, dict):
+                continue
+            s = stem_index[stem]
+            for k, metric in enumerate(METRICS):
+                if np.isnan(stats[m, s, k, 0]) and metric in scores:
+                    stats[m, s, k, 0] = scores[metric]
+
+    meta = {
+        "version": INDEX_VERSION,
+        "source": _source_signature(scores_path),
+        "models": models,
+        "names": [raw[model].get("model_name", model) for model in models],
+        "target_stems": [raw[model].get("target_stem") for model in models],
+        "stems": stems,
+        "tracks": tracks,
+        "metrics": list(METRICS),
+        "stats": list(STATS),
+        "stats_shape": list(stats.shape),
+        "tracks_shape": list(per_track.shape),
+        # 部分模型带有处理速度(每分钟音频的秒数)，用于估计耗时
+        "seconds_per_minute": {
+            model: raw[model]["median_scores"]["seconds_per_minute_m3"]
+            for model in models
+            if isinstance(raw[model].get("median_scores", {}).get("seconds_per_minute_m3"), (int, float))
+        },
+    }
+
+    # 先写临时文件再替换，读取方不会映射到不完整的索引
+    directory = os.path.dirname(index_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    suffix = f".{os.getpid()}.tmp"
+    with open(index_path + ".f32" + suffix, "wb") as f:
+        f.write(np.ascontiguousarray(stats).tobytes())
+        f.write(np.ascontiguousarray(per_track).tobytes())
+    os.replace(index_path + ".f32" + suffix, index_path + ".f32")
+    with open(index_path + ".json" + suffix, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(index_path + ".json" + suffix, index_path + ".json")
+    logger.info(
+        f"Built score index for {len(models)} models, {len(tracks)} tracks "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    return meta
+
+
+class ScoreIndex:
+    """
+    模型分数索引，第一次查询时才加载(以内存映射打开)
+
+    索引不存在或比 models-scores.json 旧时自动重新编译。
+    """
+
+    def __init__(self, scores_path=SCORES_FILE, index_path=INDEX_FILE):
+        self.scores_path = scores_path
+        self.index_path = index_path
+        self._meta = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._meta is not None:
+            return
+        with self._lock:
+            if self._meta is not None:
+                return
+            meta = self._read_meta()
+            if meta is None:
+                meta = build_index(self.scores_path, self.index_path)
+            stats_count = int(np.prod(meta["stats_shape"]))
+            self.stats = np.memmap(
+                self.index_path + ".f32", dtype=np.float32, mode="r", shape=tuple(meta["stats_shape"])
+            )
+            self.tracks = np.memmap(
+                self.index_path + ".f32", dtype=np.float32, mode="r",
+                offset=stats_count * 4, shape=tuple(meta["tracks_shape"]),
+            )
+            self._models = {model: i for i, model in enumerate(meta["models"])}
+            self._stems = {stem: i for i, stem in enumerate(meta["stems"])}
+            self._meta = meta
+
+    def _read_meta(self):
+        """读取索引元数据，索引缺失或已过期时返回 None"""
+        try:
+            with open(self.index_path + ".json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != INDEX_VERSION:
+                return None
+            if os.path.exists(self.scores_path) and meta["source"] != _source_signature(self.scores_path):
+                return None
+            if not os.path.exists(self.index_path + ".f32"):
+                return None
+            return meta
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @property
+    def stems(self):
+        self._load()
+        return list(self._meta["stems"])
+
+    def has_model(self, model_filename):
+        self._load()
+        return model_filename in self._models
+
+    def score(self, model_filename, stem, metric="SDR", stat="median"):
+        """单个模型某类音轨的分数，没有评测数据时返回 None"""
+        self._load()
+        m = self._models.get(model_filename)
+        s = self._stems.get(stem)
+        if m is None or s is None:
+            return None
+        value = float(self.stats[m, s, METRICS.index(metric), STATS.index(stat)])
+        return None if np.isnan(value) else value
+
+    def rank(self, stem, candidates, metric="SDR", stat="median"):
+        """
+        按分数从高到低排列候选模型
+
+        参数:
+            stem: 目标音轨类型，例如 vocals、instrumental
+            candidates: {显示名称: 模型文件名}
+
+        返回:
+            [(显示名称, 模型文件名, 分数), ...]，没有评测数据的模型不包含在内
+        """
+        ranked = []
+        for model_key, model_filename in candidates.items():
+            value = self.score(model_filename, stem, metric, stat)
+            if value is not None:
+                ranked.append((model_key, model_filename, value))
+        ranked.sort(key=lambda item: item[2], reverse=True)
+        return ranked
+
+    def seconds_per_minute(self, model_filename):
+        """评测数据中的处理速度(每分钟音频需要的秒数)，没有记录时返回 None"""
+        self._load()
+        return self._meta["seconds_per_minute"].get(model_filename)
+
+    def best_subset(self, stems, candidates, max_models=None, max_cost=None, costs=None, metric="SDR", min_gain=0.1):
+        """
+        在模型数量或耗时预算内选出估计分数最高的组合
+
+        组合分数的估计方法与 recommend_ensemble 相同(每首测试曲目上最好成员分数的中位数)，
+        多个音轨类型时取平均。估计分数相差不足 min_gain dB 的组合中选择模型更少、耗时更短的。
+
+        参数:
+            stems: 参与评分的音轨类型，例如 ["vocals"]
+            candidates: {显示名称: 模型文件名}
+            max_models: 最多使用的模型数，None 表示不限
+            max_cost: 组合总耗时上限，None 表示不限
+            costs: {显示名称: 估计耗时}，设置了 max_cost 时必须提供
+            min_gain: 更大的组合至少要高出的分数
+
+        返回:
+            ([显示名称, ...], 估计分数)，没有评测数据的候选不参与挑选；
+            没有可用候选或预算内放不下任何模型时返回 ([], None)
+        """
+        self._load()
+        scored = [
+            (model_key, model_filename) for model_key, model_filename in candidates.items()
+            if stems and all(self.score(model_filename, stem, metric) is not None for stem in stems)
+        ]
+        if not scored:
+            return [], None
+        k = METRICS.index(metric)
+        limit = len(scored) if max_models is None else max(1, min(max_models, len(scored)))
+        # 候选过多时只保留单模型分数最高的几个，限制枚举的组合数
+        scored.sort(key=lambda item: -sum(self.score(item[1], stem, metric) for stem in stems))
+        while len(scored) > limit and sum(math.comb(len(scored), r) for r in range(1, limit + 1)) > MAX_SUBSETS:
+            scored.pop()
+
+        per_stem = []
+        for stem in stems:
+            rows = np.stack([
+                np.asarray(self.tracks[self._models[model_filename], :, self._stems[stem], k])
+                for _, model_filename in scored
+            ])
+            medians = np.array([self.score(model_filename, stem, metric) for _, model_filename in scored])
+            per_stem.append((rows, medians, ~np.isnan(rows).any(axis=0)))
+
+        def estimate(subset):
+            total = 0.0
+            for rows, medians, common in per_stem:
+                # 优先在所有候选都有分数的曲目上比较，保证不同组合的估计可比
+                mask = common if common.sum() >= MIN_COMMON_TRACKS else ~np.isnan(rows[subset]).any(axis=0)
+                if mask.sum() >= MIN_COMMON_TRACKS:
+                    total += float(np.median(rows[subset][:, mask].max(axis=0)))
+                else:
+                    total += float(medians[subset].max())
+            return total / len(per_stem)
+
+        options = []
+        for size in range(1, limit + 1):
+            for subset in itertools.combinations(range(len(scored)), size):
+                cost = sum(costs[scored[i][0]] for i in subset) if max_cost is not None else 0.0
+                if max_cost is not None and cost > max_cost:
+                    continue
+                options.append((estimate(list(subset)), size, cost, subset))
+        if not options:
+            return [], None
+        best = max(option[0] for option in options)
+        value, _, _, subset = min(
+            (option for option in options if option[0] >= best - min_gain),
+            key=lambda option: (option[1], option[2], -option[0]),
+        )
+        return [scored[i][0] for i in subset], value
+
+    def recommend_ensemble(self, stem, candidates, metric="SDR", max_models=4, min_gain=0.1):
+        """
+        选出高分且尽量小的模型组合
+
+        没有组合本身的评测数据，这里以组合在每首测试曲目上的最好成员分数的中位数
+        估计组合的上限: 从单个最高分模型开始，每次加入让估计值提高最多的模型，
+        提高不足 min_gain dB 或达到 max_models 时停止。各模型擅长的曲目不同时
+        才会被选入组合。
+
+        返回:
+            ([(显示名称, 模型文件名), ...], 估计分数)，没有可用数据时返回 ([], None)
+        """
+        self._load()
+        ranked = self.rank(stem, candidates, metric)
+        if not ranked:
+            return [], None
+        s = self._stems[stem]
+        k = METRICS.index(metric)
+        rows = {model_filename: self.tracks[self._models[model_filename], :, s, k] for _, model_filename, _ in ranked}
+
+        chosen = [ranked[0][:2]]
+        best = ranked[0][2]
+        current = np.asarray(rows[ranked[0][1]])
+        while len(chosen) < max_models:
+            step = None
+            for model_key, model_filename, _ in ranked:
+                if (model_key, model_filename) in chosen:
+                    continue
+                combined = np.fmax(current, rows[model_filename])
+                # 只在所有成员都有分数的曲目上比较
+                common = ~np.isnan(current) & ~np.isnan(rows[model_filename])
+                if common.sum() < MIN_COMMON_TRACKS:
+                    continue
+                gain = float(np.median(combined[common]) - np.median(current[common]))
+                if step is None or gain > step[0]:
+                    step = (gain, model_key, model_filename, combined)
+            if step is None or step[0] < min_gain:
+                break
+            gain, model_key, model_filename, current = step
+            chosen.append((model_key, model_filename))
+            best += gain
+        return chosen, best
+
+
+def candidates_from_models(models, category=None):
+    """把 models.json 的 {类别: {显示名称: 文件名}} 展开为 {显示名称: 文件名}"""
+    return {
+        model_key: model_filename
+        for name, category_models in models.items()
+        if category is None or name == category
+        for model_key, model_filename in category_models.items()
+    }
+
+
+def _cell(text):
+    """转义表格单元格中的竖线(模型名称中常见)"""
+    return str(text).replace("|", "\\|")
+
+
+def recommendation_markdown(index, models, stem, metric="SDR", top=5):
+    """生成界面中显示的推荐结果"""
+    candidates = candidates_from_models(models)
+    ranked = index.rank(stem, candidates, metric)
+    if not ranked:
+        return f"No benchmark scores for **{stem}** among the available models."
+    lines = [
+        f"| # | Model | median {metric} | p25 | p75 | tracks |",
+        "|---:|---|---:|---:|---:|---:|",
+    ]
+    for i, (model_key, model_filename, value) in enumerate(ranked[:top], 1):
+        p25 = index.score(model_filename, stem, metric, "p25")
+        p75 = index.score(model_filename, stem, metric, "p75")
+        count = index.score(model_filename, stem, metric, "count")
+        lines.append(
+            f"| {i} | {_cell(model_key)} | {value:.2f} | "
+            + (f"{p25:.2f}" if p25 is not None else "-") + " | "
+            + (f"{p75:.2f}" if p75 is not None else "-") + " | "
+            + (f"{count:.0f}" if count else "-") + " |"
+        )
+    chosen, estimate = index.recommend_ensemble(stem, candidates, metric)
+    lines.append("")
+    if len(chosen) > 1:
+        lines.append(
+            f"**Ensemble**: {' + '.join(model_key for model_key, _ in chosen)} "
+            f"(estimated {metric} up to {estimate:.2f})"
+        )
+    else:
+        lines.append(f"**Ensemble**: no other model adds enough over {chosen[0][0]}, a single model is enough")
+    return "\n".join(lines)
+
+
+# 进程级共享的分数索引
+score_index = ScoreIndex()
@@ -1,6 +1,9 @@
 import os
+import copy
 import json
+import atexit
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +19,14 @@ DEFAULT_SETTINGS = {
             "norm_threshold": 0.9,
             "amp_threshold": 0.6,
             "batch_size": 1,
-            "override_seg_size": False
+            "override_seg_size": False,
+            "chunk_seconds": 0,
+            "chunk_overlap": 5,
+            "parallel_workers": 1,
+            "torch_threads": 0,
+            "skip_silence": False,
+            "silence_threshold": -60,
+            "backend": "torch"
         }
     },
     "ensemble": {
@@ -30,7 +40,12 @@ DEFAULT_SETTINGS = {
             "use_tta": False,
             "norm_threshold": 0.9,
             "amp_threshold": 0.6,
-            "batch_size": 1
+            "batch_size": 1,
+            "parallel_workers": 1,
+            "torch_threads": 0,
+            "budget_models": 0,
+            "budget_seconds": 0,
+            "backend": "torch"
         }
     },
     "output": {
@@ -42,72 +57,172 @@ DEFAULT_SETTINGS = {
 
 # 设置文件路径
 SETTINGS_FILE = "user_settings.json"
+# 合并界面连续修改的时间窗口(秒)，窗口内的多次修改只写一次文件
+SAVE_DELAY = float(os.environ.get("SETTINGS_SAVE_DELAY", 0.5))
 
 
-def load_settings():
-    """加载用户设置，如果不存在则返回默认设置"""
-    try:
-        if os.path.exists(SETTINGS_FILE):
-            with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
-                settings = json.load(f)
-                logger.info("User settings loaded successfully")
-                return settings
+def _merge_defaults(settings, defaults):
+    """用默认值补全缺失的键"""
+    merged = copy.deepcopy(defaults)
+    for key, value in settings.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_defaults(value, merged[key])
         else:
+            merged[key] = value
+    return merged
+
+
+class SettingsStore:
+    """
+    内存中的用户设置
+
+    读取时只在文件被外部修改后才重新解析；修改先作用于内存，
+    在 SAVE_DELAY 秒内没有新的修改后才写入文件。写入先写临时文件再替换，
+    并由锁串行化，多个会话同时修改也不会留下不完整的文件。
+    """
+
+    def __init__(self, path=SETTINGS_FILE, delay=SAVE_DELAY):
+        self.path = path
+        self.delay = delay
+        self._settings = None
+        self._mtime = None  # 上次读取或写入时文件的修改时间
+        self._dirty = False
+        self._timer = None
+        self._lock = threading.RLock()  # 保护内存中的设置
+        self._write_lock = threading.Lock()  # 串行化文件写入
+        atexit.register(self.flush)
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self):
+        """从文件读取设置，不存在或损坏时使用默认设置"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    settings = json.load(f)
+                logger.info("User settings loaded successfully")
+                # 补全旧版设置文件中缺少的新选项
+                return _merge_defaults(settings, DEFAULT_SETTINGS)
             logger.info("No user settings found, using defaults")
-            return DEFAULT_SETTINGS
-    except Exception as e:
-        logger.error(f"Error loading settings: {e}")
-        return DEFAULT_SETTINGS
+        except Exception as e:
+            logger.error(f"Error loading settings: {e}")
+        return copy.deepcopy(DEFAULT_SETTINGS)
+
+    def load(self):
+        """返回设置的副本"""
+        with self._lock:
+            mtime = self._file_mtime()
+            # 有未写入的修改时以内存为准
+            if self._settings is None or (not self._dirty and mtime != self._mtime):
+                self._settings = self._read()
+                self._mtime = mtime
+            return copy.deepcopy(self._settings)
+
+    def update(self, modify):
+        """在内存中修改设置，modify(settings) 原地修改，稍后合并写入文件"""
+        with self._lock:
+            if self._settings is None:
+                self.load()
+            modify(self._settings)
+            self._dirty = True
+            # 每次修改都重新计时，连续拖动滑块时只在停下后写一次
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def replace(self, settings):
+        """替换全部设置并立即写入文件"""
+        with self._lock:
+            self._settings = copy.deepcopy(settings)
+            self._dirty = True
+        return self.flush()
+
+    def flush(self):
+        """立即写入未保存的修改"""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return True
+                data = json.dumps(self._settings, indent=4, ensure_ascii=False)
+                self._dirty = False
+            try:
+                # 先写临时文件再替换，其他进程不会读到写了一半的文件
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+                with self._lock:
+                    self._mtime = self._file_mtime()
+                logger.info("Settings saved successfully")
+                return True
+            except Exception as e:
+                logger.error(f"Error saving settings: {e}")
+                with self._lock:
+                    self._dirty = True
+                return False
+
+
+# 进程级共享的设置
+settings_store = SettingsStore()
+
+
+def load_settings():
+    """加载用户设置，如果不存在则返回默认设置"""
+    return settings_store.load()
 
 
 def save_settings(settings):
     """保存用户设置到文件"""
-    try:
-        with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
-            json.dump(settings, f, indent=4, ensure_ascii=False)
-        logger.info("Settings saved successfully")
-        return True
-    except Exception as e:
-        logger.error(f"Error saving settings: {e}")
-        return False
+    return settings_store.replace(settings)
 
 
 def update_single_model_settings(category, model, **advanced_params):
     """更新单模型设置"""
-    settings = load_settings()
-    settings["single_model"]["category"] = category
-    settings["single_model"]["model"] = model
-    
-    # 更新高级参数
-    if advanced_params:
+
+    def modify(settings):
+        settings["single_model"]["category"] = category
+        settings["single_model"]["model"] = model
+
+        # 更新高级参数
         for key, value in advanced_params.items():
             if key in settings["single_model"]["advanced"]:
                 settings["single_model"]["advanced"][key] = value
-    
-    save_settings(settings)
+
+    settings_store.update(modify)
 
 
 def update_ensemble_settings(category, models, method, only_instrumental, **advanced_params):
     """更新多模型合成设置"""
-    settings = load_settings()
-    settings["ensemble"]["category"] = category
-    settings["ensemble"]["models"] = models
-    settings["ensemble"]["method"] = method
-    settings["ensemble"]["only_instrumental"] = only_instrumental
-    
-    # 更新高级参数
-    if advanced_params:
+
+    def modify(settings):
+        settings["ensemble"]["category"] = category
+        settings["ensemble"]["models"] = models
+        settings["ensemble"]["method"] = method
+        settings["ensemble"]["only_instrumental"] = only_instrumental
+
+        # 更新高级参数
         for key, value in advanced_params.items():
             if key in settings["ensemble"]["advanced"]:
                 settings["ensemble"]["advanced"][key] = value
-    
-    save_settings(settings)
+
+    settings_store.update(modify)
 
 
 def update_output_settings(output_format, model_dir, output_dir):
     """更新输出设置"""
-    settings = load_settings()
-    settings["output"]["format"] = output_format
-    settings["output"]["model_dir"] = model_dir
-    settings["output"]["output_dir"] = output_dir
-    save_settings(settings)
\ No newline at end of file
+
+    def modify(settings):
+        settings["output"]["format"] = output_format
+        settings["output"]["model_dir"] = model_dir
+        settings["output"]["output_dir"] = output_dir
+
+    settings_store.update(modify)
@@ -0,0 +1,89 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 低于该能量(dBFS)的帧视为静音
+DEFAULT_SILENCE_THRESHOLD = -60.0
+# 计算能量的帧长(秒)
+FRAME_SECONDS = 0.05
+# 有声区域前后保留的边距(秒)，避免切掉起音和尾音
+DEFAULT_MARGIN_SECONDS = 0.5
+# 短于该长度(秒)的静音不跳过，减少模型调用次数
+DEFAULT_MIN_SILENCE_SECONDS = 2.0
+# 分块读取时每块的帧数
+BLOCK_FRAMES = 4096
+
+
+def frame_energy_db(data, frame):
+    """
+    逐帧计算 RMS 能量(dBFS)，多声道取平均能量
+
+    按块读取，内存映射的长音频不会被整体读入内存。
+
+    参数:
+        data: (channels, length) 或 (length,) 数组
+        frame: 帧长(采样点数)
+
+    返回:
+        每帧的能量数组，最后一帧可能不完整
+    """
+    length = data.shape[-1]
+    block = frame * BLOCK_FRAMES
+    energies = []
+    for start in range(0, length, block):
+        chunk = np.asarray(data[..., start:start + block], dtype=np.float32)
+        chunk = chunk.reshape(-1, chunk.shape[-1])
+        count = chunk.shape[-1]
+        frames = -(-count // frame)
+        padded = np.zeros((chunk.shape[0], frames * frame), dtype=np.float32)
+        padded[:, :count] = chunk
+        power = np.square(padded).reshape(chunk.shape[0], frames, frame).sum(axis=(0, 2))
+        # 不完整的最后一帧按实际采样点数平均
+        sizes = np.full(frames, frame * chunk.shape[0], dtype=np.float64)
+        sizes[-1] = (count - (frames - 1) * frame) * chunk.shape[0]
+        energies.append(power / sizes)
+    if not energies:
+        return np.zeros(0)
+    return 10 * np.log10(np.maximum(np.concatenate(energies), 1e-20))
+
+
+def find_active_regions(
+    data,
+    sample_rate,
+    threshold_db=DEFAULT_SILENCE_THRESHOLD,
+    margin_seconds=DEFAULT_MARGIN_SECONDS,
+    min_silence_seconds=DEFAULT_MIN_SILENCE_SECONDS,
+):
+    """
+    找出需要交给模型分离的有声区域
+
+    参数:
+        data: (channels, length) 或 (length,) 数组
+        sample_rate: 采样率
+        threshold_db: 静音门限(dBFS)
+        margin_seconds: 有声区域前后保留的边距
+        min_silence_seconds: 可跳过的最短静音
+
+    返回:
+        [(起点, 终点), ...] 采样点范围，按时间顺序且互不重叠
+    """
+    length = data.shape[-1]
+    frame = max(1, int(FRAME_SECONDS * sample_rate))
+    active = frame_energy_db(data, frame) > threshold_db
+
+    # 相邻有声帧合并为区域
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0]))))
+    starts = edges[0::2] * frame
+    stops = np.minimum(edges[1::2] * frame, length)
+
+    margin = int(margin_seconds * sample_rate)
+    min_gap = max(int(min_silence_seconds * sample_rate), 2 * margin)
+    regions = []
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = stop
+        else:
+            regions.append([start, stop])
+    return [(max(0, start - margin), min(length, stop + margin)) for start, stop in regions]
@@ -0,0 +1,210 @@
+import os
+import logging
+import importlib.util
+from functools import lru_cache
+
+import numpy as np
+
+# scipy.fft 导入较慢，只检查是否安装，第一次使用时再导入；不可用时回退到 numpy.fft
+_HAS_SCIPY = importlib.util.find_spec("scipy") is not None
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("numpy", "scipy", "torch")
+
+# 频谱计算后端配置，可通过环境变量或 configure() 修改
+# numpy: numpy.fft 双精度，与 librosa 的 STFT/ISTFT 逐位一致，单线程
+# scipy: scipy.fft，多线程，结果与 numpy 相差在 float32 舍入误差内
+# torch: CPU torch.stft/istft
+_config = {
+    "backend": os.environ.get("SPECTRAL_BACKEND", "scipy" if _HAS_SCIPY else "numpy"),
+    "workers": int(os.environ.get("SPECTRAL_WORKERS", os.cpu_count() or 1)),
+}
+
+
+def configure(backend=None, workers=None):
+    """
+    选择 STFT/ISTFT 后端
+
+    参数:
+        backend: "numpy"、"scipy" 或 "torch"
+        workers: FFT 使用的线程数
+    """
+    if backend is not None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown spectral backend: {backend}")
+        if backend == "scipy" and not _HAS_SCIPY:
+            raise ValueError("scipy is not installed")
+        _config["backend"] = backend
+    if workers is not None:
+        _config["workers"] = max(1, int(workers))
+    if _config["backend"] == "torch":
+        import torch
+
+        torch.set_num_threads(_config["workers"])
+    logger.info(f"Spectral backend: {_config['backend']} ({_config['workers']} workers)")
+
+
+def get_backend():
+    return _config["backend"], _config["workers"]
+
+
+@lru_cache(maxsize=8)
+def hann_window(n, dtype=np.float32):
+    """与 librosa/scipy 默认一致的周期 Hann 窗(缓存复用)"""
+    fac = np.linspace(-np.pi, np.pi, n + 1)[:n]
+    window = (0.5 + 0.5 * np.cos(fac)).astype(dtype)
+    window.flags.writeable = False
+    return window
+
+
+def window(n):
+    """
+    当前后端使用的窗
+
+    numpy 后端与 librosa 一样用 float64 窗(加窗和 FFT 以双精度计算后再转为 complex64)，
+    其他后端全程单精度以换取速度。
+    """
+    return hann_window(n, np.float64 if _config["backend"] == "numpy" else np.float32)
+
+
+@lru_cache(maxsize=8)
+def _torch_window(n):
+    import torch
+
+    return torch.from_numpy(hann_window(n).copy())
+
+
+def _scipy_fft():
+    import scipy.fft
+
+    return scipy.fft
+
+
+def rfft(x, axis=-1):
+    """实数 FFT，按当前后端计算"""
+    backend = _config["backend"]
+    if backend == "torch":
+        import torch
+
+        return torch.fft.rfft(torch.from_numpy(np.ascontiguousarray(x)), dim=axis).numpy()
+    if backend == "scipy":
+        return _scipy_fft().rfft(x, axis=axis, workers=_config["workers"])
+    return np.fft.rfft(x, axis=axis)
+
+
+def irfft(x, n, axis=-1):
+    """实数逆 FFT，按当前后端计算"""
+    backend = _config["backend"]
+    if backend == "torch":
+        import torch
+
+        return torch.fft.irfft(torch.from_numpy(np.ascontiguousarray(x)), n=n, dim=axis).numpy()
+    if backend == "scipy":
+        return _scipy_fft().irfft(x, n=n, axis=axis, workers=_config["workers"])
+    return np.fft.irfft(x, n=n, axis=axis)
+
+
+def analyze(frames):
+    """对 (..., frames, nfft) 的帧加窗并做 FFT，返回 complex64 的 (..., frames, bins)"""
+    spec = rfft(frames * window(frames.shape[-1]), axis=-1)
+    return spec.astype(np.complex64, copy=False)
+
+
+def synthesize(spec, nfft):
+    """对 (..., frames, bins) 的频谱做逆 FFT 并加窗，返回 (..., frames, nfft)"""
+    return irfft(spec, n=nfft, axis=-1) * window(nfft)
+
+
+def stft(wave, nfft, hl):
+    """
+    批量 STFT，与 librosa.stft(center=True, pad_mode='constant') 一致
+
+    :param wave: shape = (..., length)，可以一次传入所有模型和声道
+    :return: complex spectrum in shape (..., nfft // 2 + 1, frames)
+    """
+    wave = np.asarray(wave, dtype=np.float32)
+    if _config["backend"] == "torch":
+        return _torch_stft(wave, nfft, hl)
+
+    pad = [(0, 0)] * (wave.ndim - 1) + [(nfft // 2, nfft // 2)]
+    padded = np.pad(wave, pad)
+    frames = np.lib.stride_tricks.sliding_window_view(padded, nfft, axis=-1)[..., ::hl, :]
+    return np.swapaxes(analyze(frames), -1, -2)
+
+
+def istft(spec, hl, length):
+    """
+    批量 ISTFT，与 librosa.istft(center=True, length=length) 一致
+
+    :param spec: shape = (..., nfft // 2 + 1, frames)
+    :return: waveform in shape (..., length)
+    """
+    nfft = 2 * (spec.shape[-2] - 1)
+    if _config["backend"] == "torch":
+        return _torch_istft(spec, nfft, hl, length)
+
+    n_frames = spec.shape[-1]
+    frames = synthesize(np.swapaxes(spec, -1, -2), nfft)
+
+    wave = _overlap_add(frames, hl)
+    wsum = _overlap_add(np.broadcast_to(window(nfft) ** 2, (n_frames, nfft)), hl)
+    nonzero = wsum > np.finfo(np.float32).tiny
+    wave[..., nonzero] /= wsum[nonzero]
+
+    start = nfft // 2
+    wave = wave[..., start:start + length]
+    if wave.shape[-1] < length:
+        pad = [(0, 0)] * (wave.ndim - 1) + [(0, length - wave.shape[-1])]
+        wave = np.pad(wave, pad)
+    return wave
+
+
+def _overlap_add(frames, hl):
+    """把 (..., frames, nfft) 的帧按帧移 hl 重叠相加"""
+    n_frames, nfft = frames.shape[-2:]
+    lead = frames.shape[:-2]
+    if nfft % hl == 0:
+        # 帧长为帧移整数倍时按帧移切块，只需 nfft // hl 次向量化相加
+        ratio = nfft // hl
+        out = np.zeros(lead + (n_frames + ratio - 1, hl), dtype=np.float32)
+        for j in range(ratio):
+            out[..., j:j + n_frames, :] += frames[..., j * hl:(j + 1) * hl]
+        return out.reshape(lead + ((n_frames + ratio - 1) * hl,))
+    out = np.zeros(lead + ((n_frames - 1) * hl + nfft,), dtype=np.float32)
+    for i in range(n_frames):
+        out[..., i * hl:i * hl + nfft] += frames[..., i, :]
+    return out
+
+
+def _torch_stft(wave, nfft, hl):
+    import torch
+
+    lead = wave.shape[:-1]
+    x = torch.from_numpy(np.ascontiguousarray(wave.reshape(-1, wave.shape[-1])))
+    spec = torch.stft(
+        x,
+        n_fft=nfft,
+        hop_length=hl,
+        window=_torch_window(nfft),
+        center=True,
+        pad_mode="constant",
+        return_complex=True,
+    )
+    return spec.numpy().reshape(lead + spec.shape[-2:])
+
+
+def _torch_istft(spec, nfft, hl, length):
+    import torch
+
+    lead = spec.shape[:-2]
+    x = torch.from_numpy(np.ascontiguousarray(spec.reshape((-1,) + spec.shape[-2:])))
+    wave = torch.istft(
+        x,
+        n_fft=nfft,
+        hop_length=hl,
+        window=_torch_window(nfft),
+        center=True,
+        length=length,
+    )
+    return wave.numpy().reshape(lead + (length,))
@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import atexit
+import builtins
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 命令行参数或环境变量开启启动耗时报告
+FLAG = "--startup-report"
+ENV_VAR = "STARTUP_REPORT"
+
+_start = time.perf_counter()
+_lock = threading.Lock()
+_marks = []  # (阶段名, 距启动的秒数)
+_imports = {}  # 模块名 -> 首次导入耗时(包含其导入的子模块)
+_original_import = None
+
+
+def requested(argv=None):
+    """是否要求输出启动耗时报告"""
+    argv = sys.argv if argv is None else argv
+    return FLAG in argv or os.environ.get(ENV_VAR, "") not in ("", "0")
+
+
+def enable():
+    """
+    开始记录模块导入耗时
+
+    需在导入其他模块之前调用，类似 python -X importtime，但只记录每个模块的
+    首次导入并按耗时汇总。
+    """
+    global _original_import
+    if _original_import is not None:
+        return
+    _original_import = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level:
+            return _original_import(name, globals, locals, fromlist, level)
+        if name not in sys.modules:
+            key = name
+        else:
+            # from 包 import 子模块: 包已导入时只有子模块是新导入的
+            key = [
+                f"{name}.{item}" for item in fromlist or ()
+                if item != "*" and f"{name}.{item}" not in sys.modules
+            ]
+            if not key:
+                return _original_import(name, globals, locals, fromlist, level)
+        start = time.perf_counter()
+        try:
+            return _original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            if isinstance(key, list):
+                # fromlist 中的普通属性不是模块，不计入
+                key = ", ".join(module for module in key if module in sys.modules)
+            if key:
+                with _lock:
+                    _imports.setdefault(key, elapsed)
+
+    builtins.__import__ = timed_import
+
+
+def enable_if_requested():
+    """命令行带有 --startup-report 或设置了 STARTUP_REPORT 时开始记录"""
+    if requested():
+        enable()
+
+
+def mark(name):
+    """记录一个启动阶段完成的时间点"""
+    with _lock:
+        _marks.append((name, time.perf_counter() - _start))
+
+
+def report(top=15):
+    """生成启动耗时报告文本"""
+    with _lock:
+        marks = list(_marks)
+        imports = sorted(_imports.items(), key=lambda item: item[1], reverse=True)[:top]
+    lines = ["Startup report (seconds since start):"]
+    lines += [f"  {seconds:8.3f}  {name}" for name, seconds in marks]
+    if imports:
+        lines.append(f"Slowest imports (cumulative, first import only, top {top}):")
+        lines += [f"  {seconds:8.3f}  {name}" for name, seconds in imports]
+    elif _original_import is None:
+        lines.append(f"Import timing disabled, pass {FLAG} or set {ENV_VAR}=1")
+    return "\n".join(lines)
+
+
+def print_report(top=15):
+    """输出启动耗时报告到标准错误"""
+    print(report(top), file=sys.stderr, flush=True)
+
+
+def print_report_at_exit(top=15):
+    """进程退出时记录结束时间并输出报告"""
+
+    def at_exit():
+        mark("exit")
+        print_report(top)
+
+    atexit.register(at_exit)
@@ -0,0 +1,133 @@
+import os
+import uuid
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+from utils import profiling
+
+logger = logging.getLogger(__name__)
+
+# 内存中保留音轨的总预算(字节)，超出后写入内存映射的临时文件
+DEFAULT_MEMORY_BUDGET = int(os.environ.get("STEM_HANDOFF_MAX_BYTES", 2 * 1024**3))
+
+
+class Stem:
+    """
+    一个分离出的音轨，数据为 float32 数组，形状 (channels, length)
+
+    数据可能在内存中，也可能是内存映射的原始 float32 临时文件。
+    跨进程传递时只序列化文件路径，不复制音频数据。
+    """
+
+    def __init__(self, name, data, sample_rate, path=None):
+        self.name = name  # 分离器原本要写出的文件名，用于识别音轨类型
+        self.data = data
+        self.sample_rate = sample_rate
+        self.path = path  # 内存映射临时文件路径，None 表示在内存中
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def release(self):
+        """释放数据引用(Windows 上需要先关闭映射才能删除文件)"""
+        self.data = None
+
+    def to_dict(self):
+        """记录临时文件位置，用于把已分离的音轨写入任务状态文件"""
+        return {
+            "name": self.name,
+            "path": self.path,
+            "shape": list(self.data.shape),
+            "sample_rate": self.sample_rate,
+        }
+
+    @classmethod
+    def from_dict(cls, info):
+        """从 to_dict 的记录重新打开临时文件"""
+        data = np.memmap(info["path"], dtype=np.float32, mode="r", shape=tuple(info["shape"]))
+        return cls(info["name"], data, info["sample_rate"], info["path"])
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.path is not None:
+            state["shape"] = self.data.shape
+            state["data"] = None
+        return state
+
+    def __setstate__(self, state):
+        shape = state.pop("shape", None)
+        self.__dict__.update(state)
+        if self.path is not None:
+            self.data = np.memmap(self.path, dtype=np.float32, mode="r", shape=shape)
+
+
+def spill_to_disk(data, spill_dir):
+    """把数组写入原始 float32 临时文件，返回 (内存映射数组, 文件路径)"""
+    os.makedirs(spill_dir, exist_ok=True)
+    path = os.path.join(spill_dir, f"{uuid.uuid4().hex}.f32")
+    mapped = np.memmap(path, dtype=np.float32, mode="w+", shape=data.shape)
+    mapped[:] = data
+    mapped.flush()
+    return np.memmap(path, dtype=np.float32, mode="r", shape=data.shape), path
+
+
+class StemCapture:
+    """
+    替代分离器的 write_audio，把音轨保存为 float32 数组而不是编码成音频文件
+
+    与 write_audio 一样先做归一化，但跳过整数量化和有损编码。
+    """
+
+    def __init__(self, model_instance, spill_dir=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.model_instance = model_instance
+        self.spill_dir = spill_dir
+        self.memory_budget = memory_budget
+        self.stems = []
+        self.in_memory_bytes = 0
+
+    def __call__(self, stem_path, stem_source):
+        with profiling.stage("stem_handoff"):
+            self._capture(stem_path, stem_source)
+
+    def _capture(self, stem_path, stem_source):
+        from audio_separator.separator.uvr_lib_v5 import spec_utils
+
+        instance = self.model_instance
+        stem_source = spec_utils.normalize(
+            wave=stem_source,
+            max_peak=instance.normalization_threshold,
+            min_peak=instance.amplification_threshold,
+        )
+        # 分离器内部为 (length, channels)，统一转为 (channels, length)
+        data = np.ascontiguousarray(np.asarray(stem_source).T, dtype=np.float32)
+
+        path = None
+        if self.spill_dir and self.in_memory_bytes + data.nbytes > self.memory_budget:
+            data, path = spill_to_disk(data, self.spill_dir)
+            logger.info(f"Spilled stem {stem_path} to {path}")
+        else:
+            self.in_memory_bytes += data.nbytes
+
+        self.stems.append(Stem(os.path.basename(stem_path), data, instance.sample_rate, path))
+
+
+@contextmanager
+def capture_stems(separator, spill_dir=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    在上下文中让分离器把音轨交给内存而不是写文件
+
+    用法:
+        with capture_stems(separator, spill_dir) as capture:
+            separator.separate(audio)
+        stems = capture.stems
+    """
+    instance = separator.model_instance
+    capture = StemCapture(instance, spill_dir, memory_budget)
+    instance.write_audio = capture
+    try:
+        yield capture
+    finally:
+        del instance.write_audio
@@ -1,6 +1,10 @@
+import os
 import gradio as gr
 from utils.error_handler import catch_errors # 错误处理装饰器
+from utils.backends import BACKENDS  # 推理后端
 from utils.i18n import _  # i18n函数
+from utils.registry import model_files  # 模型文件索引
+from utils.scores import METRICS, recommendation_markdown, score_index  # 模型分数索引
 from utils.settings import load_settings, update_single_model_settings, update_ensemble_settings, update_output_settings
 
 
@@ -8,6 +12,17 @@ def update_roformer_models(ROFORMER_MODELS, category):
     return gr.update(choices=list(ROFORMER_MODELS[category].keys()))
 
 
+def model_file_status(ROFORMER_MODELS, model_key, model_dir):
+    """显示模型文件是否已下载"""
+    model_filename = ROFORMER_MODELS.filename(model_key)
+    if model_filename is None:
+        return ""
+    size = model_files.size(model_filename, model_dir)
+    if size is None:
+        return _("*Model file not downloaded yet, it will be downloaded on first use*")
+    return f"*{_('Model file ready')} ({size / 1024**2:.0f} MB)*"
+
+
 def update_ensemble_models(ROFORMER_MODELS, category):
     return gr.update(
         choices=list(ROFORMER_MODELS[category].keys()), value=[]
@@ -93,6 +108,9 @@ def create_interface(
                             choices=list(ROFORMER_MODELS[initial_category].keys()),
                             value=user_settings["single_model"]["model"] if user_settings["single_model"]["model"] in ROFORMER_MODELS[initial_category] else list(ROFORMER_MODELS[initial_category].keys())[0],
                         )
+                        roformer_model_status = gr.Markdown(
+                            model_file_status(ROFORMER_MODELS, roformer_model.value, user_settings["output"]["model_dir"])
+                        )
 
                 roformer_single_stem = gr.Textbox(
                     label=_("Single Track Output"),
@@ -157,6 +175,63 @@ def create_interface(
                         step=1, 
                         label=_("Batch Size")
                     )
+                    with gr.Row():
+                        with gr.Column(scale=1):
+                            roformer_chunk_seconds = gr.Slider(
+                                0, 600,
+                                value=user_settings["single_model"]["advanced"]["chunk_seconds"],
+                                step=30,
+                                label=_("Chunk Length (s)")
+                            )
+                            gr.Markdown(_("*Split long audio into overlapping chunks, 0 separates the whole file at once*"))
+                        with gr.Column(scale=1):
+                            roformer_chunk_overlap = gr.Slider(
+                                1, 30,
+                                value=user_settings["single_model"]["advanced"]["chunk_overlap"],
+                                step=1,
+                                label=_("Chunk Overlap (s)")
+                            )
+                            gr.Markdown(_("*Chunks are joined with an equal-power crossfade over the overlap*"))
+                    with gr.Row():
+                        with gr.Column(scale=1):
+                            roformer_parallel_workers = gr.Slider(
+                                1, max(1, os.cpu_count() or 1),
+                                value=user_settings["single_model"]["advanced"]["parallel_workers"],
+                                step=1,
+                                label=_("Parallel Workers")
+                            )
+                            gr.Markdown(_("*Separate chunks in separate processes at the same time, each loads its own model copy*"))
+                        with gr.Column(scale=1):
+                            roformer_torch_threads = gr.Slider(
+                                0, max(1, os.cpu_count() or 1),
+                                value=user_settings["single_model"]["advanced"]["torch_threads"],
+                                step=1,
+                                label=_("Threads per Worker")
+                            )
+                            gr.Markdown(_("*0 splits CPU cores evenly between workers*"))
+                    with gr.Row():
+                        with gr.Column(scale=1):
+                            roformer_skip_silence = gr.Checkbox(
+                                value=user_settings["single_model"]["advanced"]["skip_silence"],
+                                label=_("Skip Silence")
+                            )
+                            gr.Markdown(_("*Silent regions are not sent to the model and stay silent in the output*"))
+                        with gr.Column(scale=1):
+                            roformer_silence_threshold = gr.Slider(
+                                -90, -30,
+                                value=user_settings["single_model"]["advanced"]["silence_threshold"],
+                                step=1,
+                                label=_("Silence Threshold (dB)")
+                            )
+                    with gr.Row():
+                        with gr.Column(scale=1):
+                            roformer_backend = gr.Dropdown(
+                                choices=list(BACKENDS),
+                                value=user_settings["single_model"]["advanced"]["backend"],
+                                label=_("Inference Backend")
+                            )
+                        with gr.Column(scale=1):
+                            gr.Markdown(_("*onnx runs Roformer models with ONNX Runtime and int8 runs them with dynamically quantized linear layers, both on the CPU; other models and GPUs use torch*"))
 
                 # 步骤3
                 gr.Markdown(f"#### {_('Step 3: Start Processing')}")
@@ -170,6 +245,8 @@ def create_interface(
                     with gr.Column():
                         gr.Markdown(f"##### 🥁 {_('Secondary Track')}")
                         roformer_stem2 = gr.Audio(type="filepath", interactive=False)
+                with gr.Accordion(_("Timing Breakdown"), open=False):
+                    roformer_timing = gr.Markdown()
 
             # Ensemble选项卡
             with gr.Tab(f"🎚️ {_('Multi-model Ensemble')}"):
@@ -264,6 +341,49 @@ def create_interface(
                         step=1, 
                         label=_("Batch Size")
                     )
+                    with gr.Row():
+                        with gr.Column(scale=1):
+                            ensemble_parallel_workers = gr.Slider(
+                                1, max(1, os.cpu_count() or 1),
+                                value=user_settings["ensemble"]["advanced"]["parallel_workers"],
+                                step=1,
+                                label=_("Parallel Workers")
+                            )
+                            gr.Markdown(_("*Run models in separate processes at the same time, each loads its own model copy*"))
+                        with gr.Column(scale=1):
+                            ensemble_torch_threads = gr.Slider(
+                                0, max(1, os.cpu_count() or 1),
+                                value=user_settings["ensemble"]["advanced"]["torch_threads"],
+                                step=1,
+                                label=_("Threads per Worker")
+                            )
+                            gr.Markdown(_("*0 splits CPU cores evenly between workers*"))
+                    with gr.Row():
+                        with gr.Column(scale=1):
+                            ensemble_budget_models = gr.Slider(
+                                0, 8,
+                                value=user_settings["ensemble"]["advanced"]["budget_models"],
+                                step=1,
+                                label=_("Model Budget")
+                            )
+                            gr.Markdown(_("*Run at most this many of the selected models, picked by benchmark scores. 0 runs all*"))
+                        with gr.Column(scale=1):
+                            ensemble_budget_seconds = gr.Slider(
+                                0, 3600,
+                                value=user_settings["ensemble"]["advanced"]["budget_seconds"],
+                                step=10,
+                                label=_("Runtime Budget (seconds)")
+                            )
+                            gr.Markdown(_("*Estimated total separation time allowed, from past runs on this machine. 0 means no limit*"))
+                    with gr.Row():
+                        with gr.Column(scale=1):
+                            ensemble_backend = gr.Dropdown(
+                                choices=list(BACKENDS),
+                                value=user_settings["ensemble"]["advanced"]["backend"],
+                                label=_("Inference Backend")
+                            )
+                        with gr.Column(scale=1):
+                            gr.Markdown(_("*onnx runs Roformer models with ONNX Runtime and int8 runs them with dynamically quantized linear layers, both on the CPU; other models and GPUs use torch*"))
 
                 # 步骤3
                 gr.Markdown(f"#### {_('Step 3: Start Processing')}")
@@ -286,6 +406,27 @@ def create_interface(
                             type="filepath",
                             interactive=False,
                         )
+                with gr.Accordion(_("Timing Breakdown"), open=False):
+                    ensemble_timing = gr.Markdown()
+
+            # 模型推荐选项卡
+            with gr.Tab(f"📊 {_('Model Recommendations')}"):
+                gr.Markdown(_("Rank the available models by their benchmark scores for a target stem, and suggest the smallest ensemble that is expected to beat the best single model."))
+                with gr.Row():
+                    with gr.Column(scale=1):
+                        recommend_stem = gr.Dropdown(
+                            label=_("Target Stem"),
+                            choices=["vocals", "instrumental", "drums", "bass", "other"],
+                            value="vocals",
+                        )
+                    with gr.Column(scale=1):
+                        recommend_metric = gr.Dropdown(
+                            label=_("Metric"),
+                            choices=list(METRICS),
+                            value="SDR",
+                        )
+                recommend_button = gr.Button(f"🔍 {_('Recommend')}", variant="primary")
+                recommend_result = gr.Markdown()
 
             # 帮助选项卡
             try:
@@ -335,7 +476,9 @@ def create_interface(
 
         # 绑定事件处理
         def on_roformer_change(category, model, seg_size, override_seg_size, 
-                              overlap, pitch_shift, norm_thresh, amp_thresh, batch_size):
+                              overlap, pitch_shift, norm_thresh, amp_thresh, batch_size,
+                              chunk_seconds, chunk_overlap, parallel_workers, torch_threads,
+                              skip_silence, silence_threshold, backend):
             update_single_model_settings(
                 category, model, 
                 seg_size=seg_size,
@@ -344,12 +487,20 @@ def create_interface(
                 pitch_shift=pitch_shift,
                 norm_threshold=norm_thresh,
                 amp_threshold=amp_thresh,
-                batch_size=batch_size
+                batch_size=batch_size,
+                chunk_seconds=chunk_seconds,
+                chunk_overlap=chunk_overlap,
+                parallel_workers=parallel_workers,
+                torch_threads=torch_threads,
+                skip_silence=skip_silence,
+                silence_threshold=silence_threshold,
+                backend=backend
             )
             return
 
         def on_ensemble_change(category, models, method, only_instrumental, seg_size, 
-                              overlap, use_tta, norm_thresh, amp_thresh, batch_size):
+                              overlap, use_tta, norm_thresh, amp_thresh, batch_size,
+                              parallel_workers, torch_threads, budget_models, budget_seconds, backend):
             update_ensemble_settings(
                 category, models, method, only_instrumental,
                 seg_size=seg_size,
@@ -357,7 +508,12 @@ def create_interface(
                 use_tta=use_tta,
                 norm_threshold=norm_thresh,
                 amp_threshold=amp_thresh,
-                batch_size=batch_size
+                batch_size=batch_size,
+                parallel_workers=parallel_workers,
+                torch_threads=torch_threads,
+                budget_models=budget_models,
+                budget_seconds=budget_seconds,
+                backend=backend
             )
             return
 
@@ -371,11 +527,21 @@ def create_interface(
             inputs=[
                 roformer_category, roformer_model, roformer_seg_size,
                 roformer_override_seg_size, roformer_overlap, roformer_pitch_shift,
-                norm_threshold, amp_threshold, batch_size
+                norm_threshold, amp_threshold, batch_size,
+                roformer_chunk_seconds, roformer_chunk_overlap,
+                roformer_parallel_workers, roformer_torch_threads,
+                roformer_skip_silence, roformer_silence_threshold, roformer_backend
             ],
             outputs=[]
         )
         
+        for param in [roformer_model, model_file_dir]:
+            param.change(
+                lambda model_key, model_dir: model_file_status(ROFORMER_MODELS, model_key, model_dir),
+                inputs=[roformer_model, model_file_dir],
+                outputs=[roformer_model_status]
+            )
+
         roformer_category.change(
             lambda category: update_roformer_models(ROFORMER_MODELS, category),
             inputs=[roformer_category],
@@ -384,13 +550,19 @@ def create_interface(
 
         # 绑定高级参数的变更事件
         for param in [roformer_seg_size, roformer_override_seg_size, roformer_overlap, 
-                    roformer_pitch_shift, norm_threshold, amp_threshold, batch_size]:
+                    roformer_pitch_shift, norm_threshold, amp_threshold, batch_size,
+                    roformer_chunk_seconds, roformer_chunk_overlap,
+                    roformer_parallel_workers, roformer_torch_threads,
+                    roformer_skip_silence, roformer_silence_threshold, roformer_backend]:
             param.change(
                 on_roformer_change,
                 inputs=[
                     roformer_category, roformer_model, roformer_seg_size,
                     roformer_override_seg_size, roformer_overlap, roformer_pitch_shift,
-                    norm_threshold, amp_threshold, batch_size
+                    norm_threshold, amp_threshold, batch_size,
+                    roformer_chunk_seconds, roformer_chunk_overlap,
+                    roformer_parallel_workers, roformer_torch_threads,
+                    roformer_skip_silence, roformer_silence_threshold, roformer_backend
                 ],
                 outputs=[]
             )
@@ -407,7 +579,9 @@ def create_interface(
             inputs=[
                 ensemble_category, ensemble_models, ensemble_method, only_instrumental,
                 ensemble_seg_size, ensemble_overlap, ensemble_use_tta, 
-                norm_threshold_ensemble, amp_threshold_ensemble, batch_size_ensemble
+                norm_threshold_ensemble, amp_threshold_ensemble, batch_size_ensemble,
+                ensemble_parallel_workers, ensemble_torch_threads,
+                ensemble_budget_models, ensemble_budget_seconds, ensemble_backend
             ],
             outputs=[]
         )
@@ -415,13 +589,16 @@ def create_interface(
         # 绑定ensemble的其他设置变更事件
         for param in [ensemble_method, only_instrumental, ensemble_seg_size, ensemble_overlap,
                     ensemble_use_tta, norm_threshold_ensemble, amp_threshold_ensemble, 
-                    batch_size_ensemble]:
+                    batch_size_ensemble, ensemble_parallel_workers, ensemble_torch_threads,
+                    ensemble_budget_models, ensemble_budget_seconds, ensemble_backend]:
             param.change(
                 on_ensemble_change,
                 inputs=[
                     ensemble_category, ensemble_models, ensemble_method, only_instrumental,
                     ensemble_seg_size, ensemble_overlap, ensemble_use_tta, 
-                    norm_threshold_ensemble, amp_threshold_ensemble, batch_size_ensemble
+                    norm_threshold_ensemble, amp_threshold_ensemble, batch_size_ensemble,
+                    ensemble_parallel_workers, ensemble_torch_threads,
+                    ensemble_budget_models, ensemble_budget_seconds, ensemble_backend
                 ],
                 outputs=[]
             )
@@ -434,6 +611,12 @@ def create_interface(
                 outputs=[]
             )
 
+        recommend_button.click(
+            catch_errors(lambda stem, metric: recommendation_markdown(score_index, ROFORMER_MODELS, stem, metric)),
+            inputs=[recommend_stem, recommend_metric],
+            outputs=[recommend_result],
+        )
+
         roformer_button.click(
             roformer_separator,
             inputs=[
@@ -450,8 +633,15 @@ def create_interface(
                 amp_threshold,
                 batch_size,
                 roformer_single_stem,
+                roformer_chunk_seconds,
+                roformer_chunk_overlap,
+                roformer_parallel_workers,
+                roformer_torch_threads,
+                roformer_skip_silence,
+                roformer_silence_threshold,
+                roformer_backend,
             ],
-            outputs=[roformer_stem1, roformer_stem2],
+            outputs=[roformer_stem1, roformer_stem2, roformer_timing],
         )
 
 
@@ -464,9 +654,11 @@ def create_interface(
                 ensemble_overlap, output_format, ensemble_use_tta, 
                 model_file_dir, output_dir, norm_threshold_ensemble, 
                 amp_threshold_ensemble, batch_size_ensemble, 
-                ensemble_method, only_instrumental
+                ensemble_method, only_instrumental,
+                ensemble_parallel_workers, ensemble_torch_threads,
+                ensemble_budget_models, ensemble_budget_seconds, ensemble_backend
             ],
-            outputs=[ensemble_vocal, ensemble_instrumental]
+            outputs=[ensemble_vocal, ensemble_instrumental, ensemble_timing]
         )
 
     return app
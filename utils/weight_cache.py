@@ -0,0 +1,363 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import itertools
+import threading
+
+import numpy as np
+
+from utils import profiling
+
+logger = logging.getLogger(__name__)
+
+# 转换后的权重保存在模型目录下的该子目录中，设为 0 关闭缓存
+ENABLED = os.environ.get("WEIGHT_CACHE", "1") not in ("", "0")
+CACHE_SUBDIR = ".weights_cache"
+CACHE_VERSION = 1
+# 由 torch.load 读取的检查点格式
+CHECKPOINT_EXTENSIONS = (".ckpt", ".pth", ".pt")
+# 计算源文件指纹时读取的末尾字节数，与 audio-separator 计算模型哈希的方式相同
+HASH_TAIL_BYTES = 10000 * 1024
+# 张量在数据文件中的对齐字节数
+ALIGNMENT = 64
+
+# torch 类型名 -> 存储用的 numpy 类型(bfloat16 没有对应的 numpy 类型，按 int16 原样存取)
+_DTYPES = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "bfloat16": np.int16,
+    "float64": np.float64,
+    "int64": np.int64,
+    "int32": np.int32,
+    "int16": np.int16,
+    "int8": np.int8,
+    "uint8": np.uint8,
+    "bool": np.bool_,
+}
+
+
+def source_signature(path, with_hash=True):
+    """源检查点的大小、修改时间和末尾 10MB 的 MD5"""
+    stat = os.stat(path)
+    signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        with open(path, "rb") as f:
+            f.seek(max(0, stat.st_size - HASH_TAIL_BYTES))
+            signature["hash"] = hashlib.md5(f.read()).hexdigest()
+    return signature
+
+
+class WeightCache:
+    """
+    检查点权重的转换缓存
+
+    第一次通过 torch.load 读取检查点(冷加载)后，把其中的张量按原始字节写入
+    <模型目录>/.weights_cache/<文件名>.bin，名称、类型、形状和偏移写入同名 .json。
+    之后的加载(热加载)以内存映射打开数据文件并直接构造张量，不经过 pickle 也不复制数据。
+    源文件的大小和修改时间不变，或者修改时间变了但指纹相同时才使用缓存。
+
+    share() 把已加载模型的参数换成同一个文件的映射，多个工作进程加载同一模型时
+    共用系统页缓存中的一份权重。
+    """
+
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._dirs = {}  # 正在加载模型的目录 -> 引用计数
+        self._original_load = None
+        self._unconvertible = set()  # 内容不是纯张量字典的检查点
+        self._models = {}  # 模型文件名 -> 冷/热加载耗时
+        self.hits = 0
+        self.misses = 0
+        self.shared_bytes = 0
+
+    def configure(self, enabled=None):
+        if enabled is not None:
+            self.enabled = enabled
+
+    def cache_paths(self, checkpoint_path):
+        directory = os.path.join(os.path.dirname(checkpoint_path), CACHE_SUBDIR)
+        base = os.path.join(directory, os.path.basename(checkpoint_path))
+        return base + ".json", base + ".bin"
+
+    def active(self, model_dir):
+        """
+        在该上下文中加载 model_dir 中的模型时使用缓存
+
+        audio-separator 在内部直接调用 torch.load，这里在第一次使用时包装 torch.load，
+        只拦截已登记目录中的检查点，其他调用原样转发。
+        """
+        return _Active(self, os.path.abspath(model_dir))
+
+    def _install(self):
+        import torch
+
+        with self._lock:
+            if self._original_load is not None:
+                return
+            self._original_load = original = torch.load
+
+        def load(f, *args, **kwargs):
+            if isinstance(f, (str, os.PathLike)) and self._intercepts(os.fspath(f)):
+                return self.load(os.fspath(f), lambda: original(f, *args, **kwargs))
+            return original(f, *args, **kwargs)
+
+        torch.load = load
+
+    def _intercepts(self, path):
+        if not self.enabled or not path.lower().endswith(CHECKPOINT_EXTENSIONS):
+            return False
+        with self._lock:
+            return os.path.dirname(os.path.abspath(path)) in self._dirs
+
+    def load(self, path, load_original):
+        """
+        读取检查点，有有效缓存时从缓存映射，否则调用 load_original 并写入缓存
+
+        返回:
+            torch.load 的结果(张量字典)
+        """
+        name = os.path.basename(path)
+        start = time.perf_counter()
+        try:
+            meta = self._lookup(path)
+            if meta is not None:
+                with profiling.stage("load_weights", cache="warm"):
+                    state = self._map(path, meta)
+                self._record(name, "warm", time.perf_counter() - start)
+                return state
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring weight cache of {name}: {e}")
+
+        start = time.perf_counter()
+        with profiling.stage("load_weights", cache="cold"):
+            state = load_original()
+        elapsed = time.perf_counter() - start
+        convert = None
+        if name not in self._unconvertible:
+            if _is_state_dict(state):
+                try:
+                    with profiling.stage("convert_weights"):
+                        convert_start = time.perf_counter()
+                        self._write(path, state)
+                        convert = time.perf_counter() - convert_start
+                except (OSError, ValueError, TypeError) as e:
+                    logger.warning(f"Failed to cache weights of {name}: {e}")
+            else:
+                self._unconvertible.add(name)
+                logger.info(f"{name} is not a plain tensor dict, not caching it")
+        self._record(name, "cold", elapsed, convert)
+        return state
+
+    def prepare(self, path):
+        """
+        在当前进程中读取一次检查点并生成缓存，已有有效缓存时直接返回
+
+        在启动工作进程前调用，各工作进程随后只映射缓存文件，不会各自读取检查点。
+
+        返回:
+            缓存是否可用
+        """
+        if not self.enabled or not path.lower().endswith(CHECKPOINT_EXTENSIONS) or not os.path.isfile(path):
+            return False
+        try:
+            if self._lookup(path) is not None:
+                return True
+        except (OSError, ValueError, KeyError):
+            pass
+        import torch
+
+        try:
+            self.load(path, lambda: torch.load(path, map_location="cpu", weights_only=True))
+        except Exception as e:
+            logger.warning(f"Failed to prepare weight cache of {os.path.basename(path)}: {e}")
+            return False
+        return os.path.basename(path) not in self._unconvertible
+
+    def share(self, module, path):
+        """
+        把模块在 CPU 上的参数和缓冲区换成缓存文件的内存映射
+
+        映射的页面属于系统页缓存，同一台机器上加载同一模型的进程共用一份，
+        每个进程只需为中间结果分配内存。映射为写时复制，权重被修改时只复制被写的页面，不会写回文件。
+
+        参数:
+            module: 已用该检查点加载好权重的 torch 模块
+            path: 检查点路径
+
+        返回:
+            改为共享的字节数，没有有效缓存时为 0
+        """
+        if not self.enabled:
+            return 0
+        try:
+            meta = self._lookup(path)
+            if meta is None:
+                return 0
+            state = self._map(path, meta)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring weight cache of {os.path.basename(path)}: {e}")
+            return 0
+        shared = 0
+        for name, tensor in itertools.chain(module.named_parameters(), module.named_buffers()):
+            source = state.get(name)
+            # 只替换与缓存完全一致的张量，已移到 GPU 或转换过类型的保持原样
+            if source is None or tensor.device.type != "cpu" or source.dtype != tensor.dtype \
+                    or source.shape != tensor.shape:
+                continue
+            tensor.data = source
+            shared += source.nbytes
+        with self._lock:
+            self.shared_bytes += shared
+        if shared:
+            logger.info(f"Mapped {shared / 1024**2:.0f} MB of {os.path.basename(path)} weights from the cache")
+        return shared
+
+    def _lookup(self, path):
+        """读取缓存元数据，没有缓存或源文件已变化时返回 None"""
+        meta_path, data_path = self.cache_paths(path)
+        if not os.path.exists(meta_path) or not os.path.exists(data_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != CACHE_VERSION:
+            return None
+        source = source_signature(path, with_hash=False)
+        cached = meta["source"]
+        if source["size"] != cached["size"]:
+            return None
+        if source["mtime_ns"] != cached["mtime_ns"] and source_signature(path)["hash"] != cached["hash"]:
+            return None
+        if os.path.getsize(data_path) != meta["data_size"]:
+            raise ValueError("data file size does not match")
+        return meta
+
+    def _map(self, path, meta):
+        """以内存映射打开数据文件，返回张量字典"""
+        import torch
+
+        _, data_path = self.cache_paths(path)
+        state = {}
+        if meta["data_size"]:
+            # 写时复制映射: 张量可写(torch 不会警告)，只读时各进程共享同一份页缓存
+            data = np.memmap(data_path, dtype=np.uint8, mode="c")
+        for entry in meta["tensors"]:
+            dtype = _DTYPES[entry["dtype"]]
+            count = int(np.prod(entry["shape"], dtype=np.int64))
+            if count:
+                array = np.frombuffer(data, dtype=dtype, count=count, offset=entry["offset"])
+            else:
+                array = np.empty(0, dtype=dtype)
+            tensor = torch.from_numpy(array.reshape(entry["shape"]))
+            if entry["dtype"] == "bfloat16":
+                tensor = tensor.view(torch.bfloat16)
+            state[entry["name"]] = tensor
+        return state
+
+    def _write(self, path, state):
+        """把张量字典写入缓存(先写临时文件再替换)"""
+        meta_path, data_path = self.cache_paths(path)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        tensors = []
+        offset = 0
+        with open(data_path + suffix, "wb") as f:
+            for key, tensor in state.items():
+                dtype = str(tensor.dtype).replace("torch.", "")
+                if dtype not in _DTYPES:
+                    raise TypeError(f"unsupported dtype {dtype} for {key}")
+                tensor = tensor.detach().cpu().contiguous()
+                if dtype == "bfloat16":
+                    import torch
+
+                    tensor = tensor.view(torch.int16)
+                padding = -offset % ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                raw = tensor.numpy().tobytes()
+                f.write(raw)
+                tensors.append({"name": key, "dtype": dtype, "shape": list(tensor.shape), "offset": offset})
+                offset += len(raw)
+        meta = {
+            "version": CACHE_VERSION,
+            "source": source_signature(path),
+            "data_size": offset,
+            "tensors": tensors,
+        }
+        os.replace(data_path + suffix, data_path)
+        with open(meta_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + suffix, meta_path)
+        logger.info(f"Cached weights of {os.path.basename(path)} ({offset / 1024**2:.0f} MB)")
+
+    def _record(self, name, kind, seconds, convert=None):
+        with self._lock:
+            if kind == "warm":
+                self.hits += 1
+            else:
+                self.misses += 1
+            entry = self._models.setdefault(name, {})
+            entry[kind] = seconds
+            if convert is not None:
+                entry["convert"] = convert
+        logger.info(
+            f"Loaded weights of {name} in {seconds:.2f}s ({kind}"
+            + (f", cached in {convert:.2f}s" if convert is not None else "")
+            + ")"
+        )
+
+    def stats(self):
+        """命中计数、共享映射的字节数和每个模型最近一次冷/热加载的耗时(秒)"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_bytes": self.shared_bytes,
+                "models": {name: dict(entry) for name, entry in self._models.items()},
+            }
+
+    def report(self):
+        """每个模型冷加载和热加载耗时的对比文本"""
+        lines = []
+        for name, entry in sorted(self.stats()["models"].items()):
+            cold, warm = entry.get("cold"), entry.get("warm")
+            line = f"  {name}: cold " + (f"{cold:.2f}s" if cold is not None else "-")
+            line += ", warm " + (f"{warm:.2f}s" if warm is not None else "-")
+            if cold and warm:
+                line += f" ({cold / warm:.1f}x faster)"
+            lines.append(line)
+        return "Weight loading:\n" + "\n".join(lines) if lines else ""
+
+
+class _Active:
+    def __init__(self, cache, directory):
+        self.cache = cache
+        self.directory = directory
+
+    def __enter__(self):
+        if self.cache.enabled:
+            self.cache._install()
+        with self.cache._lock:
+            self.cache._dirs[self.directory] = self.cache._dirs.get(self.directory, 0) + 1
+        return self.cache
+
+    def __exit__(self, *exc):
+        with self.cache._lock:
+            count = self.cache._dirs.pop(self.directory) - 1
+            if count:
+                self.cache._dirs[self.directory] = count
+        return False
+
+
+def _is_state_dict(state):
+    import torch
+
+    return isinstance(state, dict) and bool(state) and all(
+        isinstance(key, str) and isinstance(value, torch.Tensor) for key, value in state.items()
+    )
+
+
+# 进程级共享的权重缓存
+weight_cache = WeightCache()
@@ -0,0 +1,259 @@
+import os
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import profiling
+from utils.audio_cache import shared_decoding
+from utils.model_pool import model_pool, configure_separator
+from utils.stems import capture_stems, DEFAULT_MEMORY_BUDGET
+from utils.weight_cache import weight_cache
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_config = None
+_executor_lock = threading.Lock()
+
+
+def default_torch_threads(workers):
+    """把CPU核心平均分给各个工作进程"""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def get_executor(workers, torch_threads=0):
+    """
+    获取分离用的进程池
+
+    进程池在配置不变时复用，工作进程内的模型池因此可以跨任务保持模型常驻。
+
+    参数:
+        workers: 工作进程数量
+        torch_threads: 每个进程的torch线程数，0 表示自动分配
+    """
+    global _executor, _executor_config
+
+    torch_threads = torch_threads or default_torch_threads(workers)
+    config = (workers, torch_threads)
+    with _executor_lock:
+        if _executor is not None and _executor_config != config:
+            _executor.shutdown(wait=True)
+            _executor = None
+        if _executor is None:
+            logger.info(f"Starting separation worker pool: {workers} workers x {torch_threads} threads")
+            _executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(torch_threads,),
+            )
+            _executor_config = config
+        return _executor
+
+
+def shutdown_executor():
+    """关闭进程池"""
+    global _executor, _executor_config
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+            _executor_config = None
+
+
+def share_weights(model_filenames, model_dir):
+    """
+    提交任务前在主进程中为模型生成权重缓存
+
+    每个模型的检查点只在主进程读取一次，工作进程加载模型后把参数换成缓存文件的
+    只读映射(见 WeightCache.share)，所有进程共用同一份权重，每个工作进程只需为中间结果分配内存。
+
+    返回:
+        缓存可用的模型数
+    """
+    ready = 0
+    for model_filename in dict.fromkeys(model_filenames):
+        if model_filename and weight_cache.prepare(os.path.join(model_dir, model_filename)):
+            ready += 1
+    return ready
+
+
+def process_memory(pid="self"):
+    """
+    进程的内存占用(字节)
+
+    返回:
+        {"rss": 常驻内存, "pss": 按共享进程数分摊后的内存, "shared": 与其他进程共用的部分,
+         "private": 进程独占的部分}，无法读取时返回 None
+    """
+    try:
+        fields = {}
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0]) * 1024
+        return {
+            "rss": fields["Rss"],
+            "pss": fields["Pss"],
+            "shared": fields["Shared_Clean"] + fields["Shared_Dirty"],
+            "private": fields["Private_Clean"] + fields["Private_Dirty"],
+        }
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        import psutil
+
+        info = psutil.Process(None if pid == "self" else pid).memory_full_info()
+        return {
+            "rss": info.rss,
+            "pss": getattr(info, "pss", info.uss),
+            "shared": info.rss - info.uss,
+            "private": info.uss,
+        }
+    except Exception:
+        return None
+
+
+def worker_memory():
+    """
+    返回:
+        进程池中每个工作进程的内存占用 {pid: process_memory()}，没有进程池时为空字典
+    """
+    with _executor_lock:
+        processes = list(getattr(_executor, "_processes", None) or {})
+    memory = {}
+    for pid in processes:
+        usage = process_memory(pid)
+        if usage is not None:
+            memory[pid] = usage
+    return memory
+
+
+def format_worker_memory(memory):
+    """工作进程内存占用的说明文本，每个进程一行"""
+    return "\n".join(
+        f"  worker {pid}: RSS {usage['rss'] / 1024**2:.0f} MB "
+        f"(shared {usage['shared'] / 1024**2:.0f} MB, private {usage['private'] / 1024**2:.0f} MB, "
+        f"PSS {usage['pss'] / 1024**2:.0f} MB)"
+        for pid, usage in sorted(memory.items())
+    )
+
+
+def _init_worker(torch_threads):
+    """工作进程初始化: 限制线程数，避免多个进程争抢同一批核心"""
+    os.environ["OMP_NUM_THREADS"] = str(torch_threads)
+    os.environ["MKL_NUM_THREADS"] = str(torch_threads)
+    import torch
+
+    torch.set_num_threads(torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # 已经初始化过并行后端时无法再修改
+        pass
+
+
+def separate_file(
+    model_filename,
+    audio,
+    model_dir,
+    output_dir,
+    output_format,
+    norm_thresh,
+    amp_thresh,
+    seg_size,
+    override_seg_size,
+    overlap,
+    batch_size,
+    use_autocast,
+    use_tta=False,
+    pitch_shift=0,
+    single_stem=None,
+    backend="torch",
+):
+    """
+    使用一个模型分离音频并把音轨写入输出目录
+
+    可在当前进程直接调用，也可提交到进程池中执行。
+
+    返回:
+        输出音轨文件路径列表
+    """
+    with model_pool.acquire(
+        model_filename,
+        model_dir,
+        segment_size=seg_size,
+        override_segment_size=override_seg_size,
+        batch_size=batch_size,
+        use_autocast=use_autocast,
+    ) as separator:
+        configure_separator(
+            separator,
+            output_dir=output_dir,
+            output_format=output_format,
+            normalization_threshold=norm_thresh,
+            amplification_threshold=amp_thresh,
+            output_single_stem=single_stem,
+            overlap=overlap,
+            pitch_shift=pitch_shift,
+            use_tta=use_tta,
+            backend=backend,
+        )
+        # 分离器在 separate 内部编码并写出每个音轨，单独记录编码耗时
+        instance = separator.model_instance
+        instance.write_audio = profiling.timed("encode", instance.write_audio)
+        try:
+            with shared_decoding(separator), profiling.stage("separate", backend=separator.backend):
+                separation = separator.separate(audio)
+        finally:
+            del instance.write_audio
+    return [os.path.join(output_dir, file_name) for file_name in separation]
+
+
+def separate_stems(
+    model_filename,
+    audio,
+    model_dir,
+    norm_thresh,
+    amp_thresh,
+    seg_size,
+    override_seg_size,
+    overlap,
+    batch_size,
+    use_autocast,
+    use_tta=False,
+    spill_dir=None,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    backend="torch",
+):
+    """
+    使用一个模型分离音频，音轨以 float32 数组返回而不编码成文件
+
+    在工作进程中执行时应把 memory_budget 设为 0，让音轨写入内存映射
+    临时文件，返回给主进程时只传递文件路径。
+
+    返回:
+        Stem 列表
+    """
+    with model_pool.acquire(
+        model_filename,
+        model_dir,
+        segment_size=seg_size,
+        override_segment_size=override_seg_size,
+        batch_size=batch_size,
+        use_autocast=use_autocast,
+    ) as separator:
+        configure_separator(
+            separator,
+            output_dir=None,
+            output_format="wav",
+            normalization_threshold=norm_thresh,
+            amplification_threshold=amp_thresh,
+            overlap=overlap,
+            use_tta=use_tta,
+            backend=backend,
+        )
+        with capture_stems(separator, spill_dir, memory_budget) as capture, shared_decoding(separator), \
+                profiling.stage("separate", backend=separator.backend):
+            separator.separate(audio)
+    return capture.stems